@@ -0,0 +1,267 @@
+"""Log de atividades assíncrono em JSON lines, com rotação, compactação e consulta indexada.
+
+As mensagens entram em uma fila (QueueHandler) e são gravadas por uma thread própria (QueueListener):
+quem registra, inclusive a thread do Tk, nunca espera pelo disco. O arquivo atual é encerrado ao passar
+de LOG_MAX_BYTES ou na virada do dia; ele é então compactado com gzip na pasta de arquivos e resumido
+em um índice (período, níveis, produtos e eventos de cada segmento), de modo que uma consulta só
+descompacta os segmentos que podem conter o que se procura.
+"""
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from remote_index import classify
+
+LOG_MAX_BYTES = 5 * 1024 * 1024  # Tamanho a partir do qual o arquivo atual é compactado e recomeçado
+LOG_KEEP_SEGMENTS = 60  # Segmentos compactados mantidos; os mais antigos são apagados
+INDEX_NAME = "indice.json"
+STRUCTURED_FIELDS = ("event", "product", "file", "bytes", "duration", "status")
+EVENT_ALIASES = {"extracao": ("extraction",)}  # Nomes antigos de eventos, ainda presentes em segmentos anteriores
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR,
+          "critical": logging.CRITICAL}
+
+PRODUCT_PATTERN = re.compile(r'\b(BPA|SIA|FPO|BDSIA|CNES)\b')  # Produto citado em mensagens sem campos estruturados
+FILE_PATTERN = re.compile(r'[\w.-]+\.(?:exe|zip)\b', re.IGNORECASE)
+LEGACY_LINE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}) (\d{2}:\d{2}:\d{2}),\d+ - (\w+) - (.*)$')  # Formato anterior
+
+
+def log_event(event, message, level="info", **fields):
+    """Registra uma mensagem com campos estruturados (produto, arquivo, bytes, duração...) apenas no arquivo de log."""
+    logging.getLogger().log(LEVELS[level], message, extra={"fields": dict(fields, event=event)})
+
+
+def infer_product(message):
+    """Produto citado na mensagem, pelo nome de um arquivo ou pela sigla; None se não houver."""
+    for name in FILE_PATTERN.findall(message):
+        info = classify(name)
+        if info:
+            return info["product"]
+        if name.upper().startswith("SCNES"):
+            return "cnes"
+    match = PRODUCT_PATTERN.search(message)
+    return match[1].lower() if match else None
+
+
+def _atomic_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def parse_line(line):
+    """Registro de uma linha do log (JSON, ou o formato de texto usado antes), ou None se não for uma."""
+    line = line.rstrip("\n")
+    if line.startswith("{"):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+    match = LEGACY_LINE_PATTERN.match(line)
+    if match:
+        return {"time": f"{match[1]}T{match[2]}", "level": match[3].lower(), "message": match[4],
+                "product": infer_product(match[4])}
+    return None
+
+
+def _read_records(lines):
+    """Registros das linhas; linhas de continuação do formato antigo são anexadas à mensagem anterior."""
+    record = None
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is None:
+            if record is not None and line.strip():
+                record["message"] += "\n" + line.rstrip("\n")
+            continue
+        if record is not None:
+            yield record
+        record = parsed
+    if record is not None:
+        yield record
+
+
+def summarize(records):
+    """Resumo de um segmento para o índice: período, níveis, produtos e eventos presentes."""
+    summary = {"start": None, "end": None, "records": 0, "levels": set(), "products": set(), "events": set()}
+    for record in records:
+        summary["start"] = summary["start"] or record["time"]
+        summary["end"] = record["time"]
+        summary["records"] += 1
+        summary["levels"].add(record["level"])
+        for key, target in (("product", "products"), ("event", "events")):
+            if record.get(key):
+                summary[target].add(record[key])
+    return {key: sorted(value) if isinstance(value, set) else value for key, value in summary.items()}
+
+
+class RotatingJsonHandler(logging.Handler):
+    """Grava os registros em JSON lines em path, compactando-o em archive_dir ao atingir max_bytes ou mudar o dia.
+
+    Executado pela thread do QueueListener: rotação e compactação também ficam fora de quem registra.
+    """
+    def __init__(self, path, archive_dir, max_bytes=LOG_MAX_BYTES, keep=LOG_KEEP_SEGMENTS):
+        super().__init__()
+        self.path = path
+        self.archive_dir = archive_dir
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self._stream = None
+        self._day = None  # Dia do primeiro registro do arquivo atual
+        self._limit = max_bytes  # Tamanho do arquivo atual que dispara a próxima rotação
+
+    def _open(self):
+        if self._day is None and os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+                first = next(_read_records(f), None)
+            self._day = first["time"][:10] if first else None
+        self._stream = open(self.path, 'a', encoding='utf-8')
+
+    def emit(self, record):
+        try:
+            now = datetime.fromtimestamp(record.created)
+            entry = {"time": now.isoformat(timespec="milliseconds"), "level": record.levelname.lower(),
+                     "message": record.getMessage(), "thread": record.threadName}
+            fields = getattr(record, "fields", None) or {}
+            entry.update((key, fields[key]) for key in STRUCTURED_FIELDS if fields.get(key) is not None)
+            if "product" not in entry:
+                product = infer_product(entry["message"])
+                if product:
+                    entry["product"] = product
+            if self._stream is None:
+                self._open()
+            day = entry["time"][:10]
+            if self._day and (day != self._day or self._stream.tell() >= self._limit):
+                size = self._stream.tell()
+                if self.rotate():
+                    self._limit = self.max_bytes
+                else:
+                    # Continua no arquivo atual; nova tentativa só no próximo limite de tamanho ou de dia
+                    self._day = day
+                    self._limit = size + self.max_bytes
+                self._open()
+            self._day = self._day or day
+            self._stream.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def rotate(self):
+        """Compacta o arquivo atual em um novo segmento, registra-o no índice e apaga os segmentos excedentes.
+
+        Retorna False se o arquivo atual não pôde ser apagado (ex.: aberto por outro programa no Windows);
+        o segmento gravado é substituído, com o conteúdo acrescido, na rotação seguinte.
+        """
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if not os.path.exists(self.path):
+            self._day = None
+            return True
+        os.makedirs(self.archive_dir, exist_ok=True)
+        tmp_path = os.path.join(self.archive_dir, "segmento.tmp")
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as source, \
+                gzip.open(tmp_path, 'wt', encoding='utf-8') as target:
+            def copied():
+                for line in source:  # Uma única leitura, em fluxo, mesmo para um log antigo muito grande
+                    target.write(line)
+                    yield line
+            summary = summarize(_read_records(copied()))
+        if not summary["records"]:
+            os.remove(tmp_path)
+        else:
+            name = "log-" + re.sub(r"[^0-9]", "", summary["start"]) + ".jsonl.gz"
+            os.replace(tmp_path, os.path.join(self.archive_dir, name))
+            index = load_index(self.archive_dir)
+            index = [s for s in index if s["segment"] != name] + [dict(summary, segment=name)]
+            index.sort(key=lambda s: s["start"])
+            for expired in index[:-self.keep]:
+                try:
+                    os.remove(os.path.join(self.archive_dir, expired["segment"]))
+                except OSError:
+                    pass
+            _atomic_json(os.path.join(self.archive_dir, INDEX_NAME), index[-self.keep:])
+        try:
+            os.remove(self.path)
+        except OSError:
+            return False
+        self._day = None
+        return True
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        super().close()
+
+
+def load_index(archive_dir):
+    """Resumos dos segmentos compactados, do mais antigo para o mais recente."""
+    try:
+        with open(os.path.join(archive_dir, INDEX_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def start_logging(path, archive_dir, level=logging.INFO):
+    """Liga o logger raiz a uma fila gravada em segundo plano por um RotatingJsonHandler; retorna o QueueListener.
+
+    Chamadas repetidas reaproveitam o listener já iniciado. Ele é parado (e a fila esvaziada) ao sair.
+    """
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, QueueHandler) and getattr(handler, "listener", None):
+            return handler.listener
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, RotatingJsonHandler(path, archive_dir))
+    handler = QueueHandler(records)
+    handler.listener = listener
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def query(path, archive_dir, product=None, level=None, since=None, until=None, event=None, text=None):
+    """Registros que atendem aos filtros, em ordem cronológica.
+
+    level é o nível mínimo ("warning" inclui "error"); since e until são datas ou instantes ISO
+    (AAAA-MM-DD[THH:MM]), ambos inclusivos; event inclui os nomes antigos do mesmo evento (EVENT_ALIASES).
+    Segmentos compactados cujo resumo no índice não pode conter registros compatíveis não são abertos.
+    """
+    minimum = LEVELS[level] if level else 0
+    events = {event, *EVENT_ALIASES.get(event, ())} if event else None
+
+    def matches(record):
+        stamp = record["time"]
+        return ((product is None or record.get("product") == product)
+                and LEVELS.get(record["level"], 0) >= minimum
+                and (since is None or stamp >= since)
+                and (until is None or stamp[:len(until)] <= until)
+                and (events is None or record.get("event") in events)
+                and (text is None or text.lower() in record["message"].lower()))
+
+    for segment in load_index(archive_dir):
+        if ((product and product not in segment["products"])
+                or (events and events.isdisjoint(segment["events"]))
+                or not any(LEVELS.get(name, 0) >= minimum for name in segment["levels"])
+                or (since and segment["end"] < since)
+                or (until and segment["start"][:len(until)] > until)):
+            continue
+        try:
+            with gzip.open(os.path.join(archive_dir, segment["segment"]), 'rt', encoding='utf-8', errors='replace') as f:
+                yield from filter(matches, _read_records(f))
+        except OSError:
+            continue  # Segmento apagado ou corrompido
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            yield from filter(matches, _read_records(f))
+    except OSError:
+        pass
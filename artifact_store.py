@@ -0,0 +1,234 @@
+"""Repositório local de artefatos baixados, endereçados pelo SHA-256 calculado durante o download."""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+
+HASH_BLOCK_SIZE = 1024 * 1024  # Bloco lido do disco quando o hash precisa alcançar bytes já gravados
+HASH_BUFFER_LIMIT = 4 * 1024 * 1024  # Bytes gravados fora de ordem mantidos em memória; o excedente é relido do disco
+MANIFEST_NAME = "manifesto.json"
+
+
+def file_sha256(path, start=0, hasher=None):
+    """Atualiza (ou cria) um sha256 com o conteúdo de path a partir de start."""
+    hasher = hasher or hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                return hasher
+            hasher.update(block)
+
+
+class StreamingHasher:
+    """Calcula o SHA-256 de um arquivo à medida que seus blocos são gravados.
+
+    Blocos que continuam a sequência já calculada entram direto no hash. Os gravados à frente dela
+    (demais segmentos de um download paralelo) entram no hash assim que a sequência os alcança: os
+    primeiros buffer_limit bytes ficam em memória, e do excedente guarda-se só a posição, sendo lido
+    de volta do disco nesse momento, ainda durante o download (em geral, do cache do sistema).
+    Só bytes que o hasher não viu (ex.: .part retomado) são lidos ao final.
+    """
+    def __init__(self, buffer_limit=HASH_BUFFER_LIMIT):
+        self.buffer_limit = buffer_limit
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, path=None, offset=0):
+        """Recomeça o hash; com offset, lê de path os bytes já presentes antes de continuar em fluxo.
+
+        path é também de onde são lidos os blocos fora de ordem que não couberam na memória.
+        """
+        with self._lock:
+            self._hash = hashlib.sha256()
+            self.position = 0
+            self.path = path
+            self._pending = {}  # Deslocamento -> bytes do bloco, ou apenas o tamanho se ele ficou só no disco
+            self._buffered = 0
+            if path and offset:
+                self._read(offset)
+
+    def _read(self, end):
+        """Acrescenta ao hash os bytes de path entre position e end."""
+        with open(self.path, 'rb') as f:
+            f.seek(self.position)
+            while self.position < end:
+                block = f.read(min(HASH_BLOCK_SIZE, end - self.position))
+                if not block:
+                    break
+                self._hash.update(block)
+                self.position += len(block)
+
+    def written(self, offset, length):
+        """Registra bytes que já estão em path e não passarão por update (ex.: segmentos retomados)."""
+        if length:
+            with self._lock:
+                self._pending[offset] = length
+                self._advance()
+
+    def update(self, offset, data):
+        """Registra um bloco já gravado em offset; entra no hash agora ou quando a sequência o alcançar."""
+        with self._lock:
+            if offset == self.position:
+                self._hash.update(data)
+                self.position += len(data)
+                self._advance()
+            elif offset > self.position:
+                if self._buffered + len(data) <= self.buffer_limit:
+                    self._pending[offset] = bytes(data)  # O buffer do BlockWriter é reutilizado
+                    self._buffered += len(data)
+                else:
+                    self._pending[offset] = len(data)
+
+    def _advance(self):
+        """Consome os blocos pendentes que a sequência já alcançou."""
+        while self.position in self._pending:
+            block = self._pending.pop(self.position)
+            if isinstance(block, int):
+                if self.path is None:
+                    self._pending[self.position] = block
+                    return
+                self._read(self.position + block)
+            else:
+                self._buffered -= len(block)
+                self._hash.update(block)
+                self.position += len(block)
+
+    def hexdigest(self, path):
+        """Completa o hash com o restante de path, se necessário, e retorna o SHA-256 em hexadecimal."""
+        with self._lock:
+            self._pending.clear()
+            self._buffered = 0
+            if os.path.getsize(path) > self.position:
+                file_sha256(path, self.position, self._hash)
+                self.position = os.path.getsize(path)
+            return self._hash.hexdigest()
+
+
+class ArtifactStore:
+    """Guarda cada artefato uma única vez em objetos/<aa>/<sha256>, com um manifesto de produto, versão e origem.
+
+    Um artefato já presente e íntegro dispensa o download: o arquivo de destino é apenas
+    vinculado (hard link) ou copiado a partir do repositório.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._entries = self._load()  # sha256 -> dados do artefato
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, "objetos", sha256[:2], sha256)
+
+    def entries(self):
+        """Cópia do manifesto: sha256 -> {product, version, name, size, source, modify, stored_at}."""
+        with self._lock:
+            return {sha: dict(entry) for sha, entry in self._entries.items()}
+
+    def _forget(self, sha256):
+        with self._lock:
+            self._entries.pop(sha256, None)
+            try:
+                self._save()
+                os.remove(self.object_path(sha256))
+            except OSError:
+                pass
+
+    def verify(self, sha256):
+        """Indica se o objeto existe e ainda tem o conteúdo registrado.
+
+        O hash só é recalculado se o tamanho ou a data do objeto mudaram desde que foi guardado.
+        """
+        with self._lock:
+            entry = self._entries.get(sha256)
+        if entry is None:
+            return False
+        path = self.object_path(sha256)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry.get("object_mtime_ns"):
+            return True
+        return file_sha256(path).hexdigest() == sha256
+
+    def lookup(self, source, size, modify):
+        """Retorna o artefato íntegro baixado de source com o mesmo tamanho e data remotos, ou None.
+
+        Objetos corrompidos ou ausentes são retirados do manifesto.
+        """
+        if size is None or not modify:
+            return None
+        with self._lock:
+            candidates = [(sha, dict(entry)) for sha, entry in self._entries.items()
+                          if entry["source"] == source and entry["size"] == size and entry.get("modify") == modify]
+        for sha256, entry in candidates:
+            if self.verify(sha256):
+                return dict(entry, sha256=sha256)
+            self._forget(sha256)
+        return None
+
+    def add(self, path, sha256, source, product=None, version=None, modify=None):
+        """Guarda path (já verificado com sha256) no repositório e o registra no manifesto."""
+        target = self.object_path(sha256)
+        if not self.verify(sha256):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = target + ".tmp"
+            _link_or_copy(path, tmp_path)
+            os.replace(tmp_path, target)
+        entry = {
+            "product": product,
+            "version": version,
+            "name": os.path.basename(path),
+            "size": os.path.getsize(target),
+            "source": source,
+            "modify": modify,
+            "stored_at": datetime.now().isoformat(timespec="seconds"),
+            "object_mtime_ns": os.stat(target).st_mtime_ns,
+        }
+        with self._lock:
+            self._entries[sha256] = entry
+            try:
+                self._save()
+            except OSError:
+                pass  # Sem manifesto o artefato apenas não será reaproveitado
+        return dict(entry, sha256=sha256)
+
+    def materialize(self, sha256, dest_path):
+        """Coloca em dest_path o conteúdo do artefato, sem transferência pela rede."""
+        source = self.object_path(sha256)
+        if os.path.exists(dest_path) and os.path.samefile(source, dest_path):
+            return dest_path
+        os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+        tmp_path = dest_path + ".tmp"
+        _link_or_copy(source, tmp_path)
+        os.replace(tmp_path, dest_path)
+        return dest_path
+
+
+def _link_or_copy(source, target):
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
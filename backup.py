@@ -0,0 +1,251 @@
+"""Backup incremental e deduplicado das pastas de trabalho (BPA, SIA, FPO), com restauração.
+
+Cada arquivo é dividido em blocos definidos pelo conteúdo (ver chunking.py), e cada bloco é guardado
+uma única vez, compactado, em blocos/<aa>/<sha256>; um snapshot é um manifesto JSON com a lista de
+blocos de cada arquivo. Arquivos com o mesmo tamanho e data do snapshot anterior reaproveitam
+a lista sem serem lidos de novo. Bancos Firebird abertos por outro programa não são copiados: a
+cópia de um banco em uso pode ser inconsistente.
+"""
+import hashlib
+import json
+import os
+import threading
+import zlib
+from datetime import datetime
+
+from block_writer import sync_file
+from chunking import iter_chunks
+
+COMPRESSION_LEVEL = 1  # Nível do zlib para os blocos (bancos Firebird compactam bem mesmo no nível mais rápido)
+KEEP_COMPETENCIAS = 6  # Competências mantidas por pasta; snapshots mais antigos são removidos
+EXCLUDED_SUFFIXES = (".exe", ".part", ".part.json", ".tmp")  # Instaladores já ficam no repositório de artefatos
+DATABASE_SUFFIXES = (".fdb", ".gdb")  # Bancos Firebird: lidos com acesso exclusivo, para não copiar um banco em uso
+
+# Constantes do Windows usadas para abrir um banco sem compartilhamento
+GENERIC_READ = 0x80000000
+OPEN_EXISTING = 3
+ERROR_SHARING_VIOLATION = 32
+
+
+class DatabaseInUseError(OSError):
+    """O banco Firebird está aberto por outro programa (ex.: o servidor Firebird ou o próprio BPA/SIA/FPO)."""
+
+
+def _atomic_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _open_database(path):
+    """Abre um banco Firebird para leitura sem compartilhamento, impedindo que ele seja aberto durante a cópia.
+
+    Levanta DatabaseInUseError se outro processo estiver com o arquivo aberto. Fora do Windows, onde não
+    há abertura exclusiva, o arquivo é aberto normalmente.
+    """
+    if os.name != "nt":
+        return open(path, 'rb')
+    import ctypes
+    import msvcrt
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.CreateFileW.restype = ctypes.c_void_p
+    handle = kernel32.CreateFileW(path, GENERIC_READ, 0, None, OPEN_EXISTING, 0, None)
+    if handle is None or handle == ctypes.c_void_p(-1).value:
+        error = ctypes.get_last_error()
+        if error == ERROR_SHARING_VIOLATION:
+            raise DatabaseInUseError(f"Banco de dados em uso; feche o programa e o Firebird e repita o backup: {path}")
+        raise ctypes.WinError(error)
+    return os.fdopen(msvcrt.open_osfhandle(handle, os.O_RDONLY | os.O_BINARY), 'rb')
+
+
+class BackupRepository:
+    """Repositório local de snapshots das pastas de trabalho, com os blocos compartilhados entre eles.
+
+    Snapshots e restaurações são serializados: apenas um é executado por vez.
+    """
+    def __init__(self, root, keep_competencias=KEEP_COMPETENCIAS):
+        self.root = root
+        self.keep_competencias = keep_competencias
+        self._lock = threading.Lock()
+
+    def chunk_path(self, sha256):
+        return os.path.join(self.root, "blocos", sha256[:2], sha256)
+
+    def _snapshot_path(self, snapshot_id):
+        return os.path.join(self.root, "snapshots", snapshot_id + ".json")
+
+    def _store_chunk(self, data):
+        """Guarda o bloco se ele ainda não existir; retorna (sha256, bytes gravados no repositório)."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(sha256)
+        if os.path.exists(path):
+            return sha256, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        return sha256, len(compressed)
+
+    def _read_chunk(self, sha256):
+        with open(self.chunk_path(sha256), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise ValueError(f"Bloco {sha256[:12]} corrompido no repositório de backup.")
+        return data
+
+    def snapshots(self, name=None):
+        """Resumo dos snapshots (opcionalmente de uma pasta), do mais recente para o mais antigo."""
+        summaries = []
+        try:
+            names = os.listdir(os.path.join(self.root, "snapshots"))
+        except OSError:
+            return []
+        for filename in names:
+            if not filename.endswith(".json"):
+                continue
+            try:
+                manifest = self.load(filename[:-len(".json")])
+            except (OSError, ValueError):
+                continue
+            if name is None or manifest["name"] == name:
+                summaries.append({key: value for key, value in manifest.items() if key != "files"})
+        return sorted(summaries, key=lambda s: (s["created_at"], s["id"]), reverse=True)
+
+    def load(self, snapshot_id):
+        """Manifesto completo de um snapshot."""
+        with open(self._snapshot_path(snapshot_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _scan(self, directory):
+        """Arquivos de directory a incluir no backup: caminho relativo -> os.stat_result."""
+        found = {}
+        for current, dirs, files in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.lower().endswith(EXCLUDED_SUFFIXES):
+                    continue
+                path = os.path.join(current, filename)
+                try:
+                    found[os.path.relpath(path, directory).replace(os.sep, "/")] = os.stat(path)
+                except OSError:
+                    continue  # Removido durante a varredura
+        return found
+
+    def snapshot(self, name, directory, reason="", competencia=None, progress=None):
+        """Registra o estado atual de directory; retorna o resumo do snapshot criado.
+
+        Arquivos que não puderem ser lidos (ex.: bloqueados por outro programa) e bancos Firebird
+        alterados que estejam em uso ficam de fora e são listados em "errors". progress
+        (TransferProgress) recebe os bytes lidos dos arquivos alterados.
+        """
+        with self._lock:
+            previous = self.snapshots(name)
+            previous_files = self.load(previous[0]["id"])["files"] if previous else {}
+            now = datetime.now()
+            manifest = {
+                "id": f"{name}-{now.strftime('%Y%m%d-%H%M%S-%f')}",
+                "name": name,
+                "directory": os.path.abspath(directory),
+                "competencia": competencia or now.strftime("%Y%m"),
+                "created_at": now.isoformat(timespec="seconds"),
+                "reason": reason,
+                "files": {},
+                "errors": {},
+                "size": 0,
+                "stored_bytes": 0,  # Bytes gravados no repositório por este snapshot (blocos novos, compactados)
+                "read_bytes": 0,  # Bytes lidos de arquivos alterados desde o snapshot anterior
+            }
+            files = self._scan(directory)
+            changed = {}
+            for relative, stat in files.items():
+                entry = previous_files.get(relative)
+                if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                    manifest["files"][relative] = entry
+                else:
+                    changed[relative] = stat
+            if progress:
+                progress.set_total(sum(stat.st_size for stat in changed.values()))
+                progress.start_transfer()
+            for relative, stat in changed.items():
+                try:
+                    manifest["files"][relative] = self._chunk_file(directory, relative, stat, manifest, progress)
+                except OSError as e:
+                    manifest["errors"][relative] = str(e)
+            manifest["size"] = sum(entry["size"] for entry in manifest["files"].values())
+            os.makedirs(os.path.dirname(self._snapshot_path(manifest["id"])), exist_ok=True)
+            _atomic_json(self._snapshot_path(manifest["id"]), manifest)
+            self._prune(name)
+            return {key: value for key, value in manifest.items() if key != "files"}
+
+    def _chunk_file(self, directory, relative, stat, manifest, progress):
+        """Guarda os blocos novos de um arquivo; o tamanho registrado é o efetivamente lido.
+
+        A data é a de antes da leitura: um arquivo alterado durante o backup será lido de novo no próximo.
+        """
+        chunks, size = [], 0
+        path = os.path.join(directory, *relative.split("/"))
+        with _open_database(path) if relative.lower().endswith(DATABASE_SUFFIXES) else open(path, 'rb') as f:
+            for data in iter_chunks(f):
+                sha256, stored = self._store_chunk(data)
+                chunks.append(sha256)
+                size += len(data)
+                manifest["stored_bytes"] += stored
+                if progress:
+                    progress.add(len(data))
+        manifest["read_bytes"] += size
+        return {"size": size, "mtime_ns": stat.st_mtime_ns, "chunks": chunks}
+
+    def restore(self, snapshot_id, target=None, progress=None):
+        """Grava em target (por padrão, a pasta de origem) os arquivos do snapshot; retorna o número de arquivos.
+
+        Cada arquivo é montado em um .tmp e só então substitui o atual. Arquivos criados depois do
+        snapshot (ausentes do manifesto) não são apagados nem alterados: restaurada na pasta de origem,
+        ela fica com os arquivos do snapshot mais esses arquivos novos. Para obter exatamente o
+        conteúdo do snapshot, restaure em uma pasta vazia.
+        """
+        with self._lock:
+            manifest = self.load(snapshot_id)
+            target = target or manifest["directory"]
+            root = os.path.realpath(target)
+            if progress:
+                progress.set_total(manifest["size"])
+                progress.start_transfer()
+            for relative, entry in manifest["files"].items():
+                path = os.path.realpath(os.path.join(root, *relative.split("/")))
+                if os.path.commonpath([root, path]) != root:
+                    raise ValueError(f"Caminho inválido no snapshot: {relative}")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    for sha256 in entry["chunks"]:
+                        data = self._read_chunk(sha256)
+                        f.write(data)
+                        if progress:
+                            progress.add(len(data))
+                sync_file(tmp_path)
+                os.replace(tmp_path, path)
+                os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            return len(manifest["files"])
+
+    def _prune(self, name):
+        """Remove os snapshots de name além das keep_competencias mais recentes e os blocos que ficaram sem uso."""
+        snapshots = self.snapshots(name)
+        kept = sorted({s["competencia"] for s in snapshots}, reverse=True)[:self.keep_competencias]
+        expired = [s for s in snapshots if s["competencia"] not in kept]
+        if not expired:
+            return
+        for summary in expired:
+            os.remove(self._snapshot_path(summary["id"]))
+        referenced = set()
+        for summary in self.snapshots():
+            for entry in self.load(summary["id"])["files"].values():
+                referenced.update(entry["chunks"])
+        blocks_dir = os.path.join(self.root, "blocos")
+        for prefix in os.listdir(blocks_dir):
+            for sha256 in os.listdir(os.path.join(blocks_dir, prefix)):
+                if sha256 not in referenced:
+                    os.remove(os.path.join(blocks_dir, prefix, sha256))
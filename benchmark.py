@@ -0,0 +1,542 @@
+"""Benchmark das verificações, downloads e extração contra servidores FTP/HTTP locais simulados.
+
+Os servidores locais reproduzem a estrutura de /siasus/BPA/, /siasus/sia/ e /siasus/fpo/ com arquivos
+sintéticos, e o CNES por HTTP, com latência e banda por conexão configuráveis. Os resultados são
+gravados em JSON e podem ser comparados com uma execução anterior para detectar regressões.
+
+Exemplos:
+    python benchmark.py --saida base.json
+    python benchmark.py --latencia 80 --banda 2048 --saida novo.json --comparar base.json
+    python benchmark.py --gravacao D:\\  # Apenas a gravação em disco, por tamanho de bloco e política de fsync
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import platform
+import re
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from email.utils import formatdate
+
+from block_writer import BlockWriter, open_part, sync_file, FSYNC_POLICIES, RECEIVE_CHUNK
+from core import Engine, FTP_PATH_BPA, FTP_PATH_SIA, FTP_PATH_FPO, CHECK_TIMEOUTS
+from downloads import download_ftp_resumable, download_http
+from extraction import extract_zip
+from ftp_pool import FTPPool
+from http_cache import HTTPMetadataCache, create_session
+from orchestrator import CheckOrchestrator
+
+MB = 1024 * 1024
+REGRESSION_THRESHOLD = 0.10  # Piora relativa a partir da qual um resultado é considerado regressão
+MIN_REGRESSION_SECONDS = 0.02  # Piora absoluta mínima; abaixo disso a diferença é ruído de medição
+
+# Arquivos sintéticos de cada diretório (nome -> tamanho em bytes)
+SYNTHETIC_TREE = {
+    FTP_PATH_BPA: {"bpamag0309.exe": 1 * MB, "bpamag0410.exe": 1 * MB},
+    FTP_PATH_SIA: {"instsia0123.exe": 2 * MB, "instsia0124.exe": 2 * MB,
+                   "BDSIA202403a.exe": 2 * MB, "BDSIA202404a.exe": 2 * MB, "BDSIA202404b.exe": 2 * MB},
+    FTP_PATH_FPO: {"fpo_instalador_0100.exe": 1 * MB, "fpo0101.exe": MB // 4, "fpo0102.exe": MB // 4},
+}
+CNES_FILE = "SCNES4700-COMPLETA.ZIP"
+WRITE_BENCH_BLOCKS_KB = (64, 1024, 4096, 8192)  # 64 KB equivale à gravação bloco a bloco anterior
+
+
+# --- Servidores simulados ---
+class Throttle:
+    """Atraso fixo por resposta e limite de banda por conexão, imitando o link até o DATASUS."""
+    def __init__(self, latency=0.0, bandwidth=0):
+        self.latency = latency  # Segundos acrescentados a cada resposta
+        self.bandwidth = bandwidth  # Bytes por segundo por conexão (0 = ilimitado)
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def send(self, write, data, block=16 * 1024):
+        """Envia data em blocos, respeitando a banda configurada."""
+        started = time.monotonic()
+        sent = 0
+        view = memoryview(data)
+        while sent < len(view):
+            chunk = view[sent:sent + block]
+            write(chunk)
+            sent += len(chunk)
+            if self.bandwidth:
+                ahead = sent / self.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+class _FTPHandler(socketserver.StreamRequestHandler):
+    """Subconjunto do protocolo FTP suficiente para o cliente ftplib usado pelo programa."""
+    def reply(self, line):
+        self.server.throttle.delay()
+        self.wfile.write((line + "\r\n").encode())
+
+    def _local(self, cwd, name=""):
+        path = os.path.normpath(os.path.join(cwd, name)).replace("\\", "/")
+        return path, os.path.join(self.server.root, path.lstrip("/"))
+
+    def handle(self):
+        cwd, rest, passive = "/", 0, None
+        self.reply("220 Servidor de teste")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, arg = line.decode("latin-1").strip().partition(" ")
+            command = command.upper()
+            self.server.commands.append(command)
+            if command in ("USER", "PASS"):
+                self.reply("331 Senha" if command == "USER" else "230 Conectado")
+            elif command in ("TYPE", "NOOP", "OPTS"):
+                self.reply("200 OK")
+            elif command == "SYST":
+                self.reply("215 UNIX Type: L8")
+            elif command == "QUIT":
+                self.reply("221 Tchau")
+                return
+            elif command == "PWD":
+                self.reply(f'257 "{cwd}"')
+            elif command == "CWD":
+                path, local = self._local(cwd, arg)
+                if os.path.isdir(local):
+                    cwd = path
+                    self.reply("250 OK")
+                else:
+                    self.reply("550 Diretório inexistente")
+            elif command in ("SIZE", "MDTM"):
+                _, local = self._local(cwd, arg)
+                if not os.path.isfile(local):
+                    self.reply("550 Arquivo inexistente")
+                elif command == "SIZE":
+                    self.reply(f"213 {os.path.getsize(local)}")
+                else:
+                    self.reply("213 " + time.strftime("%Y%m%d%H%M%S", time.gmtime(os.path.getmtime(local))))
+            elif command == "REST":
+                rest = int(arg)
+                self.reply("350 Posição registrada")
+            elif command in ("PASV", "EPSV"):
+                passive = socket.create_server(("127.0.0.1", 0))
+                port = passive.getsockname()[1]
+                if command == "EPSV":
+                    self.reply(f"229 Modo passivo (|||{port}|)")
+                else:
+                    self.reply(f"227 Modo passivo (127,0,0,1,{port >> 8},{port & 255})")
+            elif command in ("NLST", "LIST", "MLSD", "RETR"):
+                if passive is None:
+                    self.reply("425 Use PASV primeiro")
+                    continue
+                _, local = self._local(cwd, arg if command == "RETR" else "")
+                if command == "RETR" and not os.path.isfile(local):
+                    passive.close()
+                    passive = None
+                    self.reply("550 Arquivo inexistente")
+                    continue
+                self.reply("150 Abrindo conexão de dados")
+                data_conn, _ = passive.accept()
+                passive.close()
+                passive = None
+                try:
+                    if command == "RETR":
+                        with open(local, "rb") as f:
+                            f.seek(rest)
+                            self.server.throttle.send(data_conn.sendall, f.read())
+                    else:
+                        data_conn.sendall(self._listing(command, local).encode())
+                    self.reply("226 Transferência concluída")
+                except OSError:
+                    self.reply("426 Transferência interrompida")
+                finally:
+                    rest = 0
+                    data_conn.close()
+            else:
+                self.reply("502 Comando não implementado")
+
+    def _listing(self, command, directory):
+        lines = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            size = os.path.getsize(path)
+            modify = time.strftime("%Y%m%d%H%M%S", time.gmtime(os.path.getmtime(path)))
+            if command == "NLST":
+                lines.append(name)
+            elif command == "MLSD":
+                kind = "dir" if os.path.isdir(path) else "file"
+                lines.append(f"type={kind};size={size};modify={modify}; {name}")
+            else:
+                flag = "d" if os.path.isdir(path) else "-"
+                stamp = time.strftime("%b %d %H:%M", time.gmtime(os.path.getmtime(path)))
+                lines.append(f"{flag}rw-r--r--   1 ftp ftp {size:>12} {stamp} {name}")
+        return "".join(line + "\r\n" for line in lines)
+
+
+class LocalFTPServer(socketserver.ThreadingTCPServer):
+    """Servidor FTP local servindo os arquivos de root."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, throttle):
+        super().__init__(("127.0.0.1", 0), _FTPHandler)
+        self.root = root
+        self.throttle = throttle
+        self.commands = []  # Comandos recebidos, para contagem de round trips
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class _HTTPHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve arquivos com suporte a Range, ETag e If-None-Match, aplicando o Throttle do servidor."""
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.throttle.delay()
+        path = self.translate_path(self.path.split("?")[0])
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        stat = os.stat(path)
+        etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match and self.server.accept_ranges:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        self.end_headers()
+        try:
+            self.server.throttle.send(self.wfile.write, body)
+        except OSError:
+            pass  # Cliente encerrou a conexão (ex.: sonda de Range)
+
+
+class LocalHTTPServer(http.server.ThreadingHTTPServer):
+    """Servidor HTTP local servindo os arquivos de root."""
+    daemon_threads = True
+
+    def __init__(self, root, throttle, accept_ranges=True):
+        super().__init__(("127.0.0.1", 0), functools.partial(_HTTPHandler, directory=root))
+        self.throttle = throttle
+        self.accept_ranges = accept_ranges
+
+    def url(self, filename):
+        return f"http://127.0.0.1:{self.server_address[1]}/{filename}"
+
+
+def start_server(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- Dados sintéticos ---
+def write_synthetic_file(path, size):
+    """Grava um arquivo de size bytes, metade aleatória e metade compressível, como um instalador real."""
+    block = os.urandom(32 * 1024) + b"DATASUS " * 4096
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def build_tree(root, bdsia_size=None):
+    """Cria a árvore de diretórios do FTP e o zip do CNES em root."""
+    for ftp_path, files in SYNTHETIC_TREE.items():
+        directory = os.path.join(root, ftp_path.strip("/"))
+        os.makedirs(directory, exist_ok=True)
+        for name, size in files.items():
+            write_synthetic_file(os.path.join(directory, name), size)
+    with zipfile.ZipFile(os.path.join(root, CNES_FILE), "w", zipfile.ZIP_DEFLATED) as zf:
+        for i in range(8):
+            member = os.path.join(root, f"tabela{i}.dbf")
+            write_synthetic_file(member, 2 * MB)
+            zf.write(member, f"tabela{i}.dbf")
+            os.remove(member)
+
+
+# --- Cenários ---
+def _timed(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def bench_full_check(ftp_server, repeats):
+    """Latência da verificação geral (BPA, SIA, FPO, BDSIA), com o engine recém-criado e com cache aquecido."""
+    results = []
+    for _ in range(repeats):
+        engine = Engine(ftp_server="127.0.0.1", ftp_port=ftp_server.port)
+        orchestrator = CheckOrchestrator(engine.product_checks(), timeouts=CHECK_TIMEOUTS)
+        ftp_server.commands.clear()
+        cold = _timed(lambda: orchestrator.run().result())
+        round_trips = len(ftp_server.commands)
+        warm = _timed(lambda: orchestrator.run().result())
+        results.append((cold, warm, round_trips, engine.ftp_pool.handshakes))
+        orchestrator.shutdown()
+        engine.close()
+    return [
+        {"name": "verificacao_geral_fria", "seconds": _median([r[0] for r in results]),
+         "ftp_commands": results[-1][2], "handshakes": results[-1][3]},
+        {"name": "verificacao_geral_cache", "seconds": _median([r[1] for r in results])},
+    ]
+
+
+def bench_ftp_downloads(ftp_server, root, sizes, segment_levels, workdir):
+    """Vazão de download FTP por tamanho de arquivo e número de segmentos."""
+    results = []
+    directory = os.path.join(root, "bench")
+    os.makedirs(directory, exist_ok=True)
+    for size in sizes:
+        name = f"arquivo_{size // MB}mb.exe"
+        write_synthetic_file(os.path.join(directory, name), size)
+        for segments in segment_levels:
+            pool = FTPPool("127.0.0.1", ftp_server.port, max_connections=segments + 1)
+            save_path = os.path.join(workdir, name)
+            seconds = _timed(lambda: download_ftp_resumable(pool, "/bench/", name, save_path, segments=segments,
+                                                            min_segment_size=MB, log=_quiet))
+            pool.close_all()
+            os.remove(save_path)
+            results.append({"name": "download_ftp", "size_mb": size // MB, "segments": segments,
+                            "seconds": seconds, "mb_per_s": size / MB / seconds})
+    return results
+
+
+def bench_parallel_downloads(ftp_server, root, concurrency_levels, workdir):
+    """Vazão agregada de vários downloads FTP simultâneos (ex.: BDSIA + SIA + BPA)."""
+    results = []
+    files = [(path, name, size) for path, tree in SYNTHETIC_TREE.items() for name, size in tree.items()]
+    for concurrency in concurrency_levels:
+        chosen = files[:concurrency]
+        pool = FTPPool("127.0.0.1", ftp_server.port, max_connections=concurrency)
+        threads = [threading.Thread(target=download_ftp_resumable,
+                                    args=(pool, path, name, os.path.join(workdir, name)), kwargs={"log": _quiet})
+                   for path, name, _ in chosen]
+        seconds = _timed(lambda: ([t.start() for t in threads], [t.join() for t in threads]))
+        pool.close_all()
+        total = sum(size for _, _, size in chosen)
+        for _, name, _ in chosen:
+            os.remove(os.path.join(workdir, name))
+        results.append({"name": "downloads_simultaneos", "concurrency": concurrency,
+                        "seconds": seconds, "mb_per_s": total / MB / seconds})
+    return results
+
+
+def bench_http_download(http_server, segment_levels, workdir):
+    """Vazão do download HTTP do CNES, com e sem segmentos, e custo de uma revalidação (304)."""
+    results = []
+    session = create_session()
+    save_path = os.path.join(workdir, CNES_FILE)
+    url = http_server.url(CNES_FILE)
+    for segments in segment_levels:
+        seconds = _timed(lambda: download_http(session, url, save_path, segments=segments, min_segment_size=MB, log=_quiet))
+        results.append({"name": "download_http_cnes", "segments": segments,
+                        "seconds": seconds, "mb_per_s": os.path.getsize(save_path) / MB / seconds})
+    cache = HTTPMetadataCache(os.path.join(workdir, "cache_bench.json"))
+    download_http(session, url, save_path, cache=cache, log=_quiet)
+    seconds = _timed(lambda: download_http(session, url, save_path, cache=cache, log=_quiet))
+    results.append({"name": "revalidacao_http_cnes", "seconds": seconds})
+    session.close()
+    return results
+
+
+def bench_extraction(workdir, repeats):
+    """Tempo de extração do zip sintético do CNES: extractall sequencial, paralela e reextração sobre arquivos iguais."""
+    zip_path = os.path.join(workdir, CNES_FILE)
+    size = sum(info.file_size for info in zipfile.ZipFile(zip_path).infolist())
+    results = []
+    scenarios = [
+        ("extracao_cnes_extractall", lambda target: zipfile.ZipFile(zip_path).extractall(target)),
+        ("extracao_cnes_paralela", lambda target: extract_zip(zip_path, target)),
+    ]
+    for name, extract in scenarios:
+        timings = []
+        for i in range(repeats):
+            target = os.path.join(workdir, f"{name}_{i}")
+            timings.append(_timed(lambda: extract(target)))
+        results.append({"name": name, "seconds": _median(timings), "mb_per_s": size / MB / _median(timings)})
+    target = os.path.join(workdir, "extracao_cnes_paralela_0")
+    seconds = _timed(lambda: extract_zip(zip_path, target))
+    results.append({"name": "reextracao_cnes", "seconds": seconds, "mb_per_s": size / MB / seconds})
+    return results
+
+
+def bench_disk_writes(directory, size, blocks_kb=WRITE_BENCH_BLOCKS_KB, policies=FSYNC_POLICIES):
+    """Vazão de gravação no disco de directory por tamanho de bloco e política de fsync.
+
+    Os dados chegam em pedaços de até RECEIVE_CHUNK bytes, como os lidos da rede pelos downloads.
+    """
+    pattern = os.urandom(RECEIVE_CHUNK)
+    path = os.path.join(directory, "bench_gravacao_datasus.part")
+    results = []
+
+    def write(block_size, policy):
+        remaining = size
+
+        def read_into(view):
+            nonlocal remaining
+            count = min(len(view), remaining)
+            view[:count] = pattern[:count]
+            remaining -= count
+            return count
+
+        with open_part(path, 0, size) as f:
+            writer = BlockWriter(f, 0, block_size, policy)
+            while writer.fill(read_into):
+                pass
+            writer.close()
+        sync_file(path, policy)
+
+    try:
+        for block_kb in blocks_kb:
+            for policy in policies:
+                seconds = _timed(lambda: write(block_kb * 1024, policy))
+                results.append({"name": "gravacao_disco", "block_kb": block_kb, "fsync": policy,
+                                "seconds": seconds, "mb_per_s": size / MB / seconds})
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return results
+
+
+def _quiet(message, level="info"):
+    pass
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+# --- Execução e comparação ---
+def _key(result):
+    params = {k: v for k, v in result.items() if k not in ("seconds", "mb_per_s", "ftp_commands", "handshakes")}
+    return json.dumps(params, sort_keys=True)
+
+
+def compare(current, previous, threshold=REGRESSION_THRESHOLD):
+    """Compara dois conjuntos de resultados; retorna linhas de relatório e a lista de regressões.
+
+    Um cenário da execução anterior que não foi medido agora também conta como regressão.
+    """
+    previous_by_key = {_key(r): r for r in previous["results"]}
+    current_keys = {_key(r) for r in current["results"]}
+    lines, regressions = [], []
+    for result in current["results"]:
+        old = previous_by_key.get(_key(result))
+        if old is None:
+            continue
+        if old["seconds"]:
+            change = (result["seconds"] - old["seconds"]) / old["seconds"]
+        else:
+            change = float("inf") if result["seconds"] else 0
+        marker = ""
+        if change > threshold and result["seconds"] - old["seconds"] > MIN_REGRESSION_SECONDS:
+            marker = "  <-- REGRESSÃO"
+            regressions.append(result)
+        lines.append(f"{_key(result)}: {old['seconds']:.3f}s -> {result['seconds']:.3f}s ({change:+.1%}){marker}")
+    for key, old in previous_by_key.items():
+        if key not in current_keys:
+            lines.append(f"{key}: {old['seconds']:.3f}s -> não medido  <-- REGRESSÃO")
+            regressions.append(old)
+    return lines, regressions
+
+
+def run(args):
+    throttle = Throttle(latency=args.latencia / 1000, bandwidth=args.banda * 1024)
+    with tempfile.TemporaryDirectory(prefix="bench_datasus_") as base:
+        root = os.path.join(base, "servidor")
+        workdir = os.path.join(base, "cliente")
+        os.makedirs(root)
+        os.makedirs(workdir)
+        build_tree(root)
+        ftp_server = start_server(LocalFTPServer(root, throttle))
+        http_server = start_server(LocalHTTPServer(root, throttle))
+        original_cwd = os.getcwd()
+        os.chdir(workdir)  # Cache HTTP e métricas do Engine ficam no diretório temporário
+        try:
+            results = bench_full_check(ftp_server, args.repeticoes)
+            results += bench_ftp_downloads(ftp_server, root, [s * MB for s in args.tamanhos], args.segmentos, workdir)
+            results += bench_parallel_downloads(ftp_server, root, args.concorrencia, workdir)
+            results += bench_http_download(http_server, args.segmentos, workdir)
+            results += bench_extraction(workdir, args.repeticoes)
+        finally:
+            os.chdir(original_cwd)
+            ftp_server.shutdown()
+            http_server.shutdown()
+    return {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "latency_ms": args.latencia, "bandwidth_kb_s": args.banda},
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do Automatizador DATASUS com servidores locais.")
+    parser.add_argument("--latencia", type=float, default=0, help="Latência por resposta, em ms (padrão: 0).")
+    parser.add_argument("--banda", type=int, default=0, help="Banda por conexão, em KB/s (padrão: ilimitada).")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[4, 32], help="Tamanhos dos downloads, em MB.")
+    parser.add_argument("--segmentos", type=int, nargs="+", default=[1, 4], help="Números de segmentos a testar.")
+    parser.add_argument("--concorrencia", type=int, nargs="+", default=[1, 3], help="Downloads simultâneos a testar.")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Repetições dos cenários curtos (usa a mediana).")
+    parser.add_argument("--gravacao", nargs="?", const=tempfile.gettempdir(), metavar="PASTA",
+                        help="Mede apenas a gravação em disco na pasta indicada (padrão: a pasta temporária).")
+    parser.add_argument("--tamanho-gravacao", type=int, default=256, help="Tamanho do arquivo gravado, em MB.")
+    parser.add_argument("--saida", help="Grava os resultados neste arquivo JSON.")
+    parser.add_argument("--comparar", help="Compara com os resultados de uma execução anterior.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.gravacao:
+        report = {"environment": {"python": platform.python_version(), "platform": platform.platform(),
+                                  "directory": os.path.abspath(args.gravacao)},
+                  "results": bench_disk_writes(args.gravacao, args.tamanho_gravacao * MB)}
+    else:
+        report = run(args)
+    for result in report["results"]:
+        print(json.dumps(result, ensure_ascii=False))
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            previous = json.load(f)
+        if not {_key(r) for r in report["results"]} & {_key(r) for r in previous["results"]}:
+            print(f"Nenhum cenário em comum com {args.comparar}; use os mesmos parâmetros da execução anterior.")
+            return 2
+        lines, regressions = compare(report, previous)
+        print("\n".join(lines))
+        if regressions:
+            print(f"{len(regressions)} regressão(ões) acima de {REGRESSION_THRESHOLD:.0%} ou cenário(s) não medido(s).")
+            return 1
+        print("Nenhuma regressão.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
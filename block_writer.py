@@ -0,0 +1,132 @@
+"""Gravação dos downloads em blocos grandes, com buffer reutilizável, pré-alocação e política de fsync."""
+import os
+from contextlib import contextmanager
+
+from tracing import span
+
+MB = 1024 * 1024
+WRITE_BLOCK_SIZE = 4 * MB  # Bloco gravado no disco de cada vez
+MIN_WRITE_BLOCK_SIZE = 1 * MB
+MAX_WRITE_BLOCK_SIZE = 8 * MB
+RECEIVE_CHUNK = 256 * 1024  # Máximo lido da rede por chamada, para manter progresso e cancelamento responsivos
+
+# Durabilidade do arquivo baixado
+FSYNC_NONE = "nenhum"  # Confia no cache do sistema operacional
+FSYNC_END = "final"  # Um fsync antes de renomear o .part (padrão)
+FSYNC_PERIODIC = "periodico"  # fsync a cada FSYNC_PERIODIC_BYTES gravados e no final
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_END, FSYNC_PERIODIC)
+FSYNC_PERIODIC_BYTES = 64 * MB
+
+
+class DiskWriteError(OSError):
+    """Falha ao gravar no disco local (ex.: disco cheio, sem permissão); repetir a transferência não resolve."""
+
+
+@contextmanager
+def disk_write(path):
+    """Converte as falhas de E/S do bloco em DiskWriteError, separando-as das falhas de rede."""
+    try:
+        yield
+    except DiskWriteError:
+        raise
+    except OSError as e:
+        raise DiskWriteError(e.errno, f"Falha ao gravar {path} no disco: {e.strerror or e}") from e
+
+
+def open_part(path, offset=0, size=None):
+    """Abre o .part para gravar a partir de offset (truncando-o se offset for 0), pré-alocado em size bytes."""
+    with disk_write(path):
+        f = open(path, 'r+b' if offset and os.path.exists(path) else 'w+b')
+        try:
+            if size and os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)  # Reserva o espaço de uma vez, reduzindo a fragmentação em discos lentos
+            f.seek(offset)
+        except BaseException:
+            f.close()
+            raise
+    return f
+
+
+def sync_file(path, policy=FSYNC_END):
+    """Aplica ao arquivo completo a política de durabilidade antes de ele ser renomeado para o destino."""
+    if policy == FSYNC_NONE:
+        return
+    with disk_write(path), open(path, 'rb+') as f, span("disco.fsync", "disco", file=os.path.basename(path)):
+        os.fsync(f.fileno())
+
+
+class BlockWriter:
+    """Acumula os dados recebidos em um buffer reutilizável e os grava em f em blocos de block_size bytes.
+
+    f deve estar posicionado em offset. Os dados podem ser lidos direto no buffer com fill(read_into),
+    sem criar um objeto por pedaço, ou entregues prontos com write(data). O progresso conta cada pedaço
+    assim que chega; o hasher e on_flush(posição gravada) só veem os blocos já gravados.
+    expected (bytes ainda esperados, se conhecidos) evita alocar um buffer maior que o necessário.
+    """
+    def __init__(self, f, offset=0, block_size=WRITE_BLOCK_SIZE, fsync_policy=FSYNC_END,
+                 progress=None, hasher=None, on_flush=None, expected=None):
+        self.f = f
+        self.position = offset  # Deslocamento no arquivo do primeiro byte ainda no buffer
+        self.fsync_policy = fsync_policy
+        self.progress = progress
+        self.hasher = hasher
+        self.on_flush = on_flush
+        self._buffer = memoryview(bytearray(min(block_size, expected) if expected else block_size))
+        self._used = 0
+        self._unsynced = 0
+
+    def fill(self, read_into, limit=None):
+        """Lê com read_into(memoryview) no espaço livre do buffer; retorna os bytes lidos (0 no fim dos dados)."""
+        free = min(len(self._buffer) - self._used, RECEIVE_CHUNK)
+        if limit is not None:
+            free = min(free, limit)
+        count = read_into(self._buffer[self._used:self._used + free]) or 0
+        if count:
+            self._used += count
+            if self._used == len(self._buffer):
+                self.flush()
+            if self.progress:
+                self.progress.add(count)
+        return count
+
+    def write(self, data):
+        """Copia data para o buffer, gravando os blocos que se completarem."""
+        data = memoryview(data)
+        total = len(data)
+        while data:
+            count = min(len(data), len(self._buffer) - self._used)
+            self._buffer[self._used:self._used + count] = data[:count]
+            self._used += count
+            data = data[count:]
+            if self._used == len(self._buffer):
+                self.flush()
+        if self.progress:
+            self.progress.add(total)
+
+    def flush(self):
+        """Grava no arquivo o que estiver no buffer."""
+        if not self._used:
+            return
+        block = self._buffer[:self._used]
+        with disk_write(getattr(self.f, "name", "")):
+            with span("disco.gravacao", "disco", bytes=self._used, position=self.position):
+                self.f.write(block)
+            if self.hasher:
+                self.f.flush()  # O hasher pode reler o bloco do disco por outro descritor
+                self.hasher.update(self.position, block)
+            self.position += self._used
+            self._unsynced += self._used
+            self._used = 0
+            if self.fsync_policy == FSYNC_PERIODIC and self._unsynced >= FSYNC_PERIODIC_BYTES:
+                self.f.flush()
+                os.fsync(self.f.fileno())
+                self._unsynced = 0
+            if self.on_flush:
+                self.f.flush()  # on_flush costuma registrar a posição para retomada; os dados vêm antes
+        if self.on_flush:
+            self.on_flush(self.position)
+
+    def close(self):
+        """Grava o restante do buffer; retorna a posição final no arquivo."""
+        self.flush()
+        return self.position
@@ -0,0 +1,47 @@
+"""Divisão de arquivos em blocos definidos pelo conteúdo, usada pelo backup e pelos deltas entre versões.
+
+Uma alteração no meio de um arquivo muda apenas os blocos vizinhos: os cortes dependem só dos bytes
+próximos a eles, e os demais blocos continuam idênticos aos da versão anterior.
+"""
+import hashlib
+
+CHUNK_MIN_SIZE = 64 * 1024  # Nenhum bloco (exceto o último de cada arquivo) é menor que isto
+CHUNK_MAX_SIZE = 1024 * 1024  # Corte forçado quando o conteúdo não apresenta uma âncora
+ANCHOR_BITS = 18  # Comprimento da âncora; blocos têm em média min_size + 2**anchor_bits bytes
+
+
+def _bits(seed, count):
+    """count bytes 0/1 derivados de seed; fixos entre execuções para que os cortes sejam sempre os mesmos."""
+    digest = hashlib.sha256(seed).digest()
+    return bytes((digest[i // 8] >> (i % 8)) & 1 for i in range(count))
+
+
+# Cada byte do arquivo vira um bit; um corte acontece ao fim de anchor_bits bytes cujos bits formam a âncora.
+# translate e find rodam em C, o que mantém a divisão na velocidade do disco sem um hash byte a byte.
+BIT_TABLE = _bits(b"automatizador-datasus/tabela", 256)
+
+
+def anchor(bits=ANCHOR_BITS):
+    """Âncora de bits bytes; âncoras menores produzem blocos menores."""
+    return _bits(b"automatizador-datasus/ancora", bits)
+
+
+ANCHOR = anchor()
+
+
+def iter_chunks(f, min_size=CHUNK_MIN_SIZE, max_size=CHUNK_MAX_SIZE, anchor=ANCHOR):
+    """Divide o conteúdo do arquivo aberto f em blocos definidos pelo conteúdo."""
+    data = mapped = b""
+    eof = False
+    while True:
+        if not eof and len(data) < max_size:
+            more = f.read(max_size - len(data))
+            eof = not more
+            data += more
+            mapped += more.translate(BIT_TABLE)
+        if not data:
+            return
+        found = mapped.find(anchor, min_size - len(anchor), max_size) if len(data) > min_size else -1
+        cut = found + len(anchor) if found >= 0 else min(len(data), max_size)
+        yield data[:cut]
+        data, mapped = data[cut:], mapped[cut:]
@@ -0,0 +1,299 @@
+"""Modo de linha de comando: executa a verificação geral e os downloads sem interface gráfica.
+
+Exemplos:
+    python cli.py                          # Verifica todos os sistemas e imprime o resumo
+    python cli.py --json                   # Mesmo resultado em JSON, para tarefas agendadas
+    python cli.py --baixar desatualizados  # Baixa todos os instaladores desatualizados
+    python cli.py --baixar bdsia cnes      # Baixa o BDSIA mais recente e o CNES
+    python cli.py --espelho http://servidor:8021  # Usa o espelho da rede local (ver mirror.py)
+    python cli.py --backup                 # Faz o backup das pastas do BPA, SIA e FPO e sai
+    python cli.py --pre-download           # Para uma tarefa agendada à noite: adianta os downloads pendentes
+    python cli.py --restaurar fpo-20250301-093000-000000 --destino D:\\restaurado
+    python cli.py --log --produto bdsia --nivel warning --desde 2025-03-01  # Consulta o log de atividades
+    python cli.py --rastrear --rastrear-amostras  # Grava um trace da verificação (ver tracing.py)
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+from core import (
+    Engine, configure_logging, load_settings, write_options, STATUS_UPDATED, STATUS_NOT_INSTALLED,
+    FTP_SERVER, DIR_CNES, CNES_URL, CNES_FILENAME, CHECK_TIMEOUTS, BACKUP_DIR, BACKUP_DIRECTORIES,
+    LOG_FILE, LOG_ARCHIVE_DIR, PREFETCH_DIR, TRACE_FILE,
+)
+from activity_log import LEVELS, query
+from orchestrator import CheckOrchestrator, OUTCOME_OK
+from tracing import start_tracing, stop_tracing
+from prefetch import Prefetcher, PREFETCH_WINDOW, PREFETCH_RATE_LIMIT_KB, in_window
+
+# Códigos de saída
+EXIT_OK = 0  # Tudo atualizado, ou todos os downloads pedidos concluídos
+EXIT_OUTDATED = 1  # Há atualizações disponíveis que não foram baixadas
+EXIT_CHECK_ERROR = 2  # Alguma verificação falhou
+EXIT_DOWNLOAD_ERROR = 3  # Algum download falhou
+EXIT_BACKUP_ERROR = 4  # Algum arquivo ficou fora do backup (ex.: bloqueado por outro programa)
+
+INSTALLERS = ("bpa", "sia", "fpo")
+DOWNLOAD_CHOICES = INSTALLERS + ("bdsia", "cnes", "desatualizados")
+
+
+def parse_args(argv=None):
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Automatizador DATASUS em modo linha de comando.")
+    parser.add_argument("--json", action="store_true", help="Imprime o resultado em JSON.")
+    parser.add_argument("--baixar", nargs="+", choices=DOWNLOAD_CHOICES, default=[], metavar="PRODUTO",
+                        help=f"Baixa sem confirmação os produtos indicados ({', '.join(DOWNLOAD_CHOICES)}).")
+    parser.add_argument("--servidor", default=FTP_SERVER, metavar="HOST[:PORTA]",
+                        help=f"Servidor FTP a consultar (padrão: {FTP_SERVER}).")
+    parser.add_argument("--espelho", default=settings.get("espelho"), metavar="URL",
+                        help="Espelho da rede local a usar antes do DATASUS (padrão: o do arquivo de configuração).")
+    parser.add_argument("--fonte", action="append", dest="fontes", metavar="ORIGEM",
+                        help="Fonte equivalente dos arquivos (ftp://host[:porta], URL de espelho ou pasta); "
+                             "pode ser repetida e substitui --servidor (padrão: as do arquivo de configuração).")
+    parser.add_argument("--backup", action="store_true", help="Faz o backup das pastas do BPA, SIA e FPO e sai.")
+    parser.add_argument("--listar-backups", action="store_true", help="Lista os backups guardados e sai.")
+    parser.add_argument("--restaurar", metavar="ID", help="Restaura um backup (ver --listar-backups) e sai.")
+    parser.add_argument("--destino", metavar="PASTA",
+                        help="Pasta onde restaurar o backup (padrão: a pasta de origem, substituindo os arquivos; "
+                             "arquivos criados depois do backup são mantidos).")
+    parser.add_argument("--pre-download", action="store_true",
+                        help="Baixa para a área de preparação o que a estação precisa, dentro da janela e do teto "
+                             "de banda do pré-download, e sai.")
+    parser.add_argument("--log", action="store_true", help="Consulta o log de atividades (filtros abaixo) e sai.")
+    parser.add_argument("--produto", choices=INSTALLERS + ("bdsia", "cnes"), help="Filtro do --log por produto.")
+    parser.add_argument("--nivel", choices=tuple(LEVELS), help="Filtro do --log pelo nível mínimo.")
+    parser.add_argument("--desde", metavar="AAAA-MM-DD[THH:MM]", help="Filtro do --log: a partir desta data.")
+    parser.add_argument("--ate", metavar="AAAA-MM-DD[THH:MM]", help="Filtro do --log: até esta data (inclusive).")
+    parser.add_argument("--evento", choices=("download", "verificacao", "backup", "extracao"),
+                        help="Filtro do --log por tipo de evento.")
+    parser.add_argument("--texto", help="Filtro do --log: trecho da mensagem.")
+    parser.add_argument("--rastrear", nargs="?", const=TRACE_FILE, metavar="ARQUIVO",
+                        help=f"Grava um trace da execução no formato do Chrome (padrão: {TRACE_FILE}).")
+    parser.add_argument("--rastrear-amostras", action="store_true",
+                        help="Com --rastrear, grava também amostras das pilhas (.folded, para flamegraph).")
+    parser.add_argument("--rastrear-memoria", action="store_true",
+                        help="Com --rastrear, inclui a memória alocada (tracemalloc).")
+    parser.add_argument("--verbose", action="store_true", help="Repete o log de atividades na saída de erro.")
+    args = parser.parse_args(argv)
+    args.fontes = args.fontes or settings.get("fontes")
+    args.write_options = write_options(settings)
+    args.backup_dir = settings.get("pasta_backup", BACKUP_DIR)
+    args.backup_before_install = settings.get("backup_antes_de_instalar", True)
+    args.prefetch_dir = settings.get("pasta_pre_download", PREFETCH_DIR)
+    args.prefetch_window = settings.get("janela_pre_download", PREFETCH_WINDOW)
+    args.prefetch_rate_limit = settings.get("limite_banda_pre_download_kb", PREFETCH_RATE_LIMIT_KB) * 1024
+    return args
+
+
+def run_checks(engine):
+    """Executa todas as verificações em paralelo; retorna (resultados, erros, tempo total)."""
+    orchestrator = CheckOrchestrator(engine.product_checks(), timeouts=CHECK_TIMEOUTS)
+    try:
+        summary = orchestrator.run().result()
+    finally:
+        orchestrator.shutdown()
+    results, errors = {}, {}
+    for name, outcome in summary["outcomes"].items():
+        if outcome["status"] == OUTCOME_OK:
+            results[name] = outcome["result"]
+        else:
+            engine.log(f"Erro ao verificar {name.upper()}: {outcome['error']}", "error")
+            errors[name] = outcome["error"]
+    engine.log(f"Verificação geral concluída em {summary['elapsed']:.1f}s.")
+    return results, errors, summary["elapsed"]
+
+
+def run_downloads(engine, requested, results):
+    """Baixa os produtos pedidos; retorna a lista de downloads realizados e os erros."""
+    wanted = set(requested)
+    downloads, errors = [], {}
+    if "desatualizados" in wanted:
+        # Todas as atualizações pendentes (inclusive as incrementais do FPO), uma sessão FTP por diretório
+        wanted.discard("desatualizados")
+        plan = [item for item in engine.update_plan(results) if item["product"] in INSTALLERS]
+        wanted.difference_update(item["product"] for item in plan)
+        for outcome in engine.update_all(plan):
+            if outcome["status"] == OUTCOME_OK:
+                downloads.append({"product": outcome["product"], "path": outcome["path"], "transferred": True})
+            else:
+                errors.setdefault(outcome["product"], f"{outcome['file']}: {outcome['error']}")
+
+    if not wanted:
+        return downloads, errors
+    engine.ensure_folders_exist()
+    for name in sorted(wanted):
+        try:
+            if name == "cnes":
+                save_path, changed = engine.download_http(CNES_URL, CNES_FILENAME, DIR_CNES)
+                downloads.append({"product": name, "path": save_path, "transferred": changed})
+                continue
+            result = results.get(name)
+            if result is None:
+                raise RuntimeError("verificação indisponível.")
+            if name == "bdsia":
+                save_path = os.path.join(result["dest_dir"], result["file"] or "")
+                if not result["file"] or os.path.exists(save_path):
+                    continue
+                engine.download_ftp(result["ftp_path"], result["file"], result["dest_dir"])
+            elif result["status"] == STATUS_UPDATED:
+                continue
+            elif not result["file"]:
+                raise FileNotFoundError("nenhum arquivo disponível para download.")
+            else:
+                save_path = engine.download_result(result)
+            downloads.append({"product": name, "path": save_path, "transferred": True})
+        except Exception as e:
+            engine.log(f"Falha no download de {name.upper()}: {e}", "error")
+            errors[name] = str(e)
+    return downloads, errors
+
+
+def run_prefetch(engine, args, results):
+    """Uma rodada de pré-download (ver prefetch.py); retorna os downloads realizados e os erros."""
+    prefetcher = Prefetcher(engine, args.prefetch_dir, window=args.prefetch_window, rate_limit=args.prefetch_rate_limit)
+    downloads, errors = [], {}
+    if not in_window(prefetcher.window, datetime.now()):
+        engine.log(f"Fora da janela de pré-download ({args.prefetch_window}); nada foi baixado.", "warning")
+        return downloads, errors
+    for outcome in prefetcher.fetch(results):
+        if outcome["status"] == OUTCOME_OK:
+            path = os.path.join(prefetcher.staging_dir, outcome["file"])
+            downloads.append({"product": outcome["product"], "path": path, "transferred": True})
+        else:
+            errors.setdefault(outcome["product"], f"{outcome['file']}: {outcome['error']}")
+    return downloads, errors
+
+
+def run_log_query(args):
+    """Imprime os registros do log de atividades que atendem aos filtros de --log."""
+    records = query(LOG_FILE, LOG_ARCHIVE_DIR, product=args.produto, level=args.nivel, since=args.desde,
+                    until=args.ate, event=args.evento, text=args.texto)
+    for record in records:
+        if args.json:
+            print(json.dumps(record, ensure_ascii=False))
+            continue
+        details = ", ".join(f"{key}={record[key]}" for key in ("file", "bytes", "duration") if record.get(key) is not None)
+        product = f" [{record['product']}]" if record.get("product") else ""
+        print(f"{record['time']} {record['level'].upper()}{product} {record['message']}" + (f" ({details})" if details else ""))
+    return EXIT_OK
+
+
+def run_backup_command(engine, args):
+    """Executa --backup, --listar-backups ou --restaurar; retorna o código de saída."""
+    if args.restaurar:
+        count = engine.restore_backup(args.restaurar, args.destino)
+        print(f"{count} arquivos restaurados.")
+        return EXIT_OK
+    if args.listar_backups:
+        summaries = engine.list_backups()
+    else:
+        summaries = [engine.backup_directory(product).result()
+                     for product, directory in BACKUP_DIRECTORIES.items() if os.path.isdir(directory)]
+    if args.json:
+        print(json.dumps(summaries, ensure_ascii=False, indent=2))
+    else:
+        for summary in summaries:
+            print(f"{summary['id']}  {summary['directory']}  competência {summary['competencia']}  "
+                  f"{summary['size']} bytes  {summary['reason']}")
+    return EXIT_BACKUP_ERROR if args.backup and any(summary["errors"] for summary in summaries) else EXIT_OK
+
+
+def exit_code(results, check_errors, downloads, download_errors):
+    if download_errors:
+        return EXIT_DOWNLOAD_ERROR
+    if check_errors:
+        return EXIT_CHECK_ERROR
+    downloaded = {d["product"] for d in downloads}
+    pending = [name for name in INSTALLERS
+               if name in results and results[name]["status"] != STATUS_UPDATED and name not in downloaded]
+    return EXIT_OUTDATED if pending else EXIT_OK
+
+
+def format_text(results, check_errors, downloads, download_errors):
+    lines = []
+    for name in INSTALLERS:
+        if name in check_errors:
+            lines.append(f"{name.upper()}: erro na verificação ({check_errors[name]})")
+            continue
+        result = results.get(name)
+        if result is None:
+            continue
+        if result["status"] == STATUS_UPDATED:
+            lines.append(f"{name.upper()}: instalado {result['local_version']} (atualizado)")
+        elif result["status"] == STATUS_NOT_INSTALLED:
+            lines.append(f"{name.upper()}: não instalado. Disponível: {result['file']}")
+        else:
+            lines.append(f"{name.upper()}: instalado {result['local_version'] or 'nenhum'}. Disponível: {result['latest_version']}")
+    if "bdsia" in check_errors:
+        lines.append(f"BDSIA: erro na verificação ({check_errors['bdsia']})")
+    elif "bdsia" in results:
+        lines.append(f"BDSIA: {', '.join(results['bdsia']['files']) or 'nenhuma versão encontrada'}")
+    for download in downloads:
+        state = "baixado" if download["transferred"] else "já atualizado"
+        lines.append(f"Download {download['product'].upper()}: {state} em {download['path']}")
+    for name, error in download_errors.items():
+        lines.append(f"Download {name.upper()}: falhou ({error})")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.log:
+        return run_log_query(args)
+    configure_logging()
+
+    def log(message, level="info"):
+        getattr(logging, level)(message)
+        if args.verbose:
+            print(message, file=sys.stderr)
+
+    if args.rastrear:
+        start_tracing(args.rastrear, sample=args.rastrear_amostras, memory=args.rastrear_memoria)
+    try:
+        return run_engine(args, log)
+    finally:
+        for path in stop_tracing():
+            print(f"Rastreamento gravado em {os.path.abspath(path)}", file=sys.stderr)
+
+
+def run_engine(args, log):
+    """Executa o comando pedido (backup, pré-download, verificação e downloads); retorna o código de saída."""
+    host, _, port = args.servidor.partition(":")
+    engine = Engine(log=log, ftp_server=host, ftp_port=int(port or 21), mirror_url=args.espelho, sources=args.fontes,
+                    write_options=args.write_options, backup_dir=args.backup_dir,
+                    backup_before_install=args.backup_before_install)
+    if args.backup or args.listar_backups or args.restaurar:
+        try:
+            return run_backup_command(engine, args)
+        finally:
+            engine.close()
+    try:
+        results, check_errors, elapsed = run_checks(engine)
+        if args.pre_download:
+            downloads, download_errors = run_prefetch(engine, args, results)
+        else:
+            downloads, download_errors = run_downloads(engine, args.baixar, results)
+    finally:
+        engine.close()
+
+    code = exit_code(results, check_errors, downloads, download_errors)
+    if args.json:
+        print(json.dumps({
+            "checks": results,
+            "check_errors": check_errors,
+            "downloads": downloads,
+            "download_errors": download_errors,
+            "elapsed": elapsed,
+            "exit_code": code,
+        }, ensure_ascii=False, indent=2))
+    else:
+        print(format_text(results, check_errors, downloads, download_errors))
+        print(f"Tempo total da verificação: {elapsed:.1f}s")
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
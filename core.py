@@ -0,0 +1,863 @@
+"""Núcleo de verificação e download dos sistemas do DATASUS, independente da interface gráfica."""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from remote_index import RemoteIndex, classify
+from activity_log import log_event, start_logging
+from tracing import span
+from artifact_store import ArtifactStore, StreamingHasher, file_sha256
+from backup import BackupRepository
+from delta import DELTA_SUFFIX, apply_delta
+from scheduler import MAX_CONCURRENT_DOWNLOADS, TransferCancelled
+from orchestrator import CheckCancelled, OUTCOME_OK, OUTCOME_ERROR
+from http_cache import HTTPMetadataCache, create_session
+from progress import MetricsWriter, TransferProgress, format_bytes
+from block_writer import (
+    MB, WRITE_BLOCK_SIZE, MIN_WRITE_BLOCK_SIZE, MAX_WRITE_BLOCK_SIZE, FSYNC_END, FSYNC_POLICIES, DiskWriteError,
+)
+from sources import SourceSelector, SOURCE_FTP, SOURCE_MIRROR, SOURCE_LOCAL, local_entries, local_path, parse_source
+
+# --- Configurações Globais ---
+FTP_SERVER = "arpoador.datasus.gov.br"
+FTP_PATH_BPA = "/siasus/BPA/"
+FTP_PATH_SIA = "/siasus/sia/"
+FTP_PATH_FPO = "/siasus/fpo/"
+DOWNLOAD_SEGMENTS = 4  # Conexões paralelas por download (1 desativa o modo segmentado)
+DOWNLOAD_MIN_SEGMENT_SIZE = 8 * 1024 * 1024  # Tamanho mínimo de cada segmento, em bytes
+FTP_MAX_CONNECTIONS = DOWNLOAD_SEGMENTS + 1  # Máximo de conexões simultâneas mantidas com o servidor FTP
+FTP_LISTING_TTL = 120  # Validade, em segundos, das listagens de diretório em cache
+STATUS_SNAPSHOT_FILE = "status_automatizador_datasus.json"  # Resultado da última verificação, exibido ao abrir o programa
+HTTP_CACHE_FILE = "cache_http_automatizador_datasus.json"  # Validadores (ETag/Last-Modified) dos downloads HTTP
+LOG_FILE = "log_automatizador_datasus.log"  # Log de atividades atual, em JSON lines (ver activity_log.py)
+LOG_ARCHIVE_DIR = "logs_automatizador_datasus"  # Segmentos antigos do log, compactados, e o índice para consultas
+METRICS_FILE = "metricas_automatizador_datasus.jsonl"  # Registros JSON de cada listagem e download
+ARTIFACT_STORE_DIR = "artefatos_automatizador_datasus"  # Repositório de instaladores baixados, indexados por SHA-256
+BACKUP_DIR = "backup_automatizador_datasus"  # Snapshots deduplicados das pastas de trabalho (ver backup.py)
+PREFETCH_DIR = "pre_download_automatizador_datasus"  # Área de preparação do pré-download (ver prefetch.py)
+TRACE_FILE = "rastro_automatizador_datasus.json"  # Trace gravado com o rastreamento ligado (ver tracing.py)
+SETTINGS_FILE = "config_automatizador_datasus.json"  # Configurações locais (ex.: {"espelho": "http://servidor:8021"})
+SOURCES_FILE = "fontes_automatizador_datasus.json"  # Latência, vazão e rebaixamentos de cada fonte configurada
+MIRROR_TIMEOUT = 10  # Tempo limite, em segundos, das requisições ao espelho da rede local
+MIRROR_READ_TIMEOUT = 120  # Tempo limite de leitura dos arquivos servidos pelo espelho
+MIRROR_MAX_WAIT = 60 * 60  # Espera máxima enquanto o espelho busca no DATASUS um arquivo que ainda não tem
+CHECK_TIMEOUTS = {"bpa": 30, "sia": 30, "fpo": 30, "bdsia": 30}  # Tempo limite de cada verificação, em segundos
+
+CNES_URL = "https://cnes.datasus.gov.br/EstatisticasServlet?path=SCNES4700-COMPLETA.ZIP"
+CNES_FILENAME = "SCNES4700-COMPLETA.ZIP"
+FIREBIRD_URL = "https://cnes.datasus.gov.br/EstatisticasServlet?path=INSTALADORFIREBIRD-155.ZIP"
+FIREBIRD_FILENAME = "INSTALADORFIREBIRD-155.ZIP"
+
+# Diretórios padrão de instalação
+DIR_BPA = "C:\\BPA"
+DIR_FPO = "C:\\FPO"
+DIR_SIA = "C:\\INSTSIA"
+DIR_CNES = "C:\\CNES"
+
+# Arquivos para controle de versão local
+VERSION_FILE_BPA = os.path.join(DIR_BPA, "versao.txt")
+VERSION_FILE_SIA = os.path.join(DIR_SIA, "versao.txt")
+VERSION_FILE_FPO = os.path.join(DIR_FPO, "versao.txt")
+
+# Pastas de trabalho protegidas por um snapshot antes do download de um instalador ou atualização
+BACKUP_DIRECTORIES = {"bpa": DIR_BPA, "sia": DIR_SIA, "fpo": DIR_FPO}
+
+# Situações possíveis de um produto após a verificação
+STATUS_UPDATED = "atualizado"
+STATUS_OUTDATED = "desatualizado"
+STATUS_NOT_INSTALLED = "nao_instalado"
+STATUS_AVAILABLE = "disponivel"
+OUTCOME_SKIPPED = "pulado"  # Item da atualização geral não baixado porque um anterior do mesmo produto falhou
+
+
+def configure_logging():
+    """Direciona o log de atividades para o arquivo padrão, gravado em segundo plano e rotacionado."""
+    start_logging(LOG_FILE, LOG_ARCHIVE_DIR)
+
+
+def load_settings(path=SETTINGS_FILE):
+    """Lê as configurações locais; um arquivo ausente ou inválido equivale a nenhuma configuração."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return settings if isinstance(settings, dict) else {}
+
+
+def save_settings(settings, path=SETTINGS_FILE):
+    """Grava as configurações locais de forma atômica."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(settings, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def write_options(settings):
+    """Opções de gravação dos downloads a partir das configurações locais (bloco em MB, política de fsync)."""
+    block_mb = settings.get("bloco_gravacao_mb", WRITE_BLOCK_SIZE // MB)
+    block_size = min(MAX_WRITE_BLOCK_SIZE, max(MIN_WRITE_BLOCK_SIZE, int(block_mb * MB)))
+    policy = settings.get("fsync", FSYNC_END)
+    return {"block_size": block_size, "fsync_policy": policy if policy in FSYNC_POLICIES else FSYNC_END}
+
+
+def _default_log(message, level="info"):
+    getattr(logging, level)(message)
+
+
+class Engine:
+    """Executa as verificações no FTP e os downloads, reportando o andamento por uma função de log.
+
+    sources lista fontes equivalentes dos arquivos ("ftp://host[:porta]", a URL de um espelho da rede
+    local ou uma pasta com a estrutura do espelho); sem ela, usa apenas ftp_server. mirror_url
+    (ver mirror.py) entra como primeira fonte. Listagens são disputadas entre as fontes e downloads
+    seguem a que tem o melhor desempenho recente, passando à seguinte em caso de falha.
+    Havendo um espelho e uma versão anterior do mesmo arquivo na estação, o download tenta antes um
+    delta do espelho (ver delta.py), com o arquivo completo como alternativa.
+    Com backup_before_install, o download de um instalador ou atualização dispara um snapshot da
+    pasta de trabalho do produto (ver backup.py), concluído antes de o download ser dado como pronto.
+    Os módulos de rede (ftplib, requests) e de extração só são importados no primeiro uso,
+    para que a interface abra sem esperar por eles.
+    """
+    def __init__(self, log=None, ftp_server=FTP_SERVER, ftp_port=21, mirror_url=None, sources=None, write_options=None,
+                 backup_dir=BACKUP_DIR, backup_before_install=True):
+        self.log = log or _default_log
+        self.ftp_server = ftp_server  # Nome canônico do servidor, usado para identificar os artefatos
+        self.ftp_port = ftp_port
+        specs = list(sources or [f"ftp://{ftp_server}:{ftp_port}"])
+        if mirror_url:
+            specs.insert(0, mirror_url)
+        self.sources = SourceSelector(specs, SOURCES_FILE)
+        self.write_options = write_options or {}  # block_size e fsync_policy dos downloads (ver write_options())
+        self._lazy_lock = threading.Lock()
+        self._ftp_clients = {}  # Chave da fonte FTP -> (pool de conexões, cache de listagens)
+        self._http_session = None
+        self.http_cache = HTTPMetadataCache(HTTP_CACHE_FILE)
+        self.metrics = MetricsWriter(METRICS_FILE)
+        self.artifacts = ArtifactStore(ARTIFACT_STORE_DIR)
+        self.backups = BackupRepository(backup_dir)
+        self.backup_before_install = backup_before_install
+        self._backup_executor = None
+        self._backups_in_flight = {}  # Produto -> Future do snapshot em andamento
+
+    def _ftp_client(self, source):
+        """(pool, cache de listagens) de uma fonte FTP, criados no primeiro uso."""
+        with self._lazy_lock:
+            if source["key"] not in self._ftp_clients:
+                from ftp_pool import FTPPool, ListingCache
+                pool = FTPPool(source["host"], source["port"], max_connections=FTP_MAX_CONNECTIONS)
+                self._ftp_clients[source["key"]] = (pool, ListingCache(pool, ttl=FTP_LISTING_TTL))
+            return self._ftp_clients[source["key"]]
+
+    @property
+    def _primary_ftp(self):
+        ftp_sources = [s for s in self.sources.sources if s["kind"] == SOURCE_FTP]
+        return ftp_sources[0] if ftp_sources else parse_source(f"ftp://{self.ftp_server}:{self.ftp_port}")
+
+    @property
+    def ftp_pool(self):
+        """Pool de conexões da primeira fonte FTP configurada."""
+        return self._ftp_client(self._primary_ftp)[0]
+
+    @property
+    def ftp_listings(self):
+        """Cache das listagens de diretório da primeira fonte FTP configurada."""
+        return self._ftp_client(self._primary_ftp)[1]
+
+    @property
+    def http_session(self):
+        """Sessão HTTP keep-alive compartilhada, criada no primeiro download HTTP."""
+        with self._lazy_lock:
+            if self._http_session is None:
+                self._http_session = create_session()
+            return self._http_session
+
+    def close(self):
+        """Encerra as conexões FTP e HTTP abertas, aguardando os backups em andamento."""
+        for pool, _ in list(self._ftp_clients.values()):
+            pool.close_all()
+        if self._http_session is not None:
+            self._http_session.close()
+        if self._backup_executor is not None:
+            self._backup_executor.shutdown(wait=True)
+
+    def ensure_folders_exist(self):
+        """Garante que os diretórios base e de exportação existam em C:\\."""
+        paths_to_create = [
+            DIR_BPA, os.path.join(DIR_BPA, "EXPORTA"),
+            DIR_FPO, os.path.join(DIR_FPO, "EXPORTA"),
+            DIR_SIA, os.path.join(DIR_SIA, "IMPORTA"),
+            DIR_CNES
+        ]
+        for path in paths_to_create:
+            if not os.path.exists(path):
+                os.makedirs(path)
+                self.log(f"Diretório criado: {path}")
+
+    def get_local_version(self, file_path):
+        """Lê a versão salva localmente."""
+        try:
+            if os.path.exists(file_path):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    return f.read().strip()
+        except Exception as e:
+            self.log(f"Erro ao ler arquivo de versão {file_path}: {e}", "error")
+        return None
+
+    def record_version(self, version_file, version_str):
+        """Grava a versão instalada no arquivo de controle local."""
+        with open(version_file, 'w') as f:
+            f.write(version_str)
+        self.log(f"Versão local atualizada para {version_str}.")
+
+    def _source_entries(self, source, ftp_path, cancel=None):
+        """Entradas de um diretório do FTP segundo uma fonte."""
+        with span("listagem", "fonte", source=source["key"], path=ftp_path):
+            return self._fetch_source_entries(source, ftp_path, cancel)
+
+    def _fetch_source_entries(self, source, ftp_path, cancel=None):
+        if source["kind"] == SOURCE_FTP:
+            return self._ftp_client(source)[1].entries(ftp_path, cancel)
+        if source["kind"] == SOURCE_MIRROR:
+            response = self.http_session.get(f"{source['url']}/ftp{ftp_path}", timeout=MIRROR_TIMEOUT)
+            response.raise_for_status()
+            return response.json()["entries"]
+        return local_entries(source, ftp_path)
+
+    def _directory_entries(self, ftp_path, cancel=None):
+        """(fonte, entradas) do diretório: uma listagem FTP ainda válida em cache, ou a da fonte que responder primeiro.
+
+        cancel: CancelToken da verificação que pediu a listagem (ver orchestrator).
+        """
+        for source in self.sources.ranked((SOURCE_FTP,)):
+            client = self._ftp_clients.get(source["key"])
+            entries = client and client[1].peek(ftp_path)
+            if entries is not None:
+                return source, entries
+        return self.sources.race(lambda source: self._source_entries(source, ftp_path, cancel), cancel=cancel)
+
+    def list_ftp_entries(self, ftp_path, cancel=None):
+        """Lista nome, tamanho e data dos arquivos de um diretório do FTP, reaproveitando conexões e listagens recentes."""
+        started = time.monotonic()
+        try:
+            source, entries = self._directory_entries(ftp_path, cancel)
+            self.metrics.write("listing", path=ftp_path, source=source["key"], files=len(entries),
+                               elapsed=round(time.monotonic() - started, 3))
+            return entries
+        except CheckCancelled:
+            raise
+        except Exception as e:
+            self.metrics.write("listing", path=ftp_path, error=str(e), elapsed=round(time.monotonic() - started, 3))
+            self.log(f"Falha ao conectar ou listar arquivos em {ftp_path}: {e}", "error")
+            return None
+
+    def remote_index(self, ftp_path, products=None, cancel=None):
+        """Índice dos artefatos publicados em ftp_path, ou None se a listagem falhar."""
+        entries = self.list_ftp_entries(ftp_path, cancel)
+        return None if entries is None else RemoteIndex().add_directory(ftp_path, entries, products)
+
+    def product_checks(self):
+        """Funções de verificação de cada produto, indexadas pelo nome usado no orquestrador."""
+        checks = {"bpa": self.check_bpa, "sia": self.check_sia, "fpo": self.check_fpo, "bdsia": self.check_bdsia}
+        return {name: self._logged_check(name, check) for name, check in checks.items()}
+
+    def _logged_check(self, name, check):
+        """Envolve uma verificação para registrar no log estruturado sua duração e resultado."""
+        def run(cancel=None):
+            started = time.monotonic()
+            try:
+                with span(f"verificacao.{name}", "verificacao"):
+                    result = check(cancel=cancel)
+            except Exception as e:
+                log_event("verificacao", f"Verificação de {name.upper()} falhou: {e}", "error", product=name,
+                          status=OUTCOME_ERROR, duration=round(time.monotonic() - started, 3))
+                raise
+            log_event("verificacao", f"Verificação de {name.upper()}: {result['status']}", product=name,
+                      file=result.get("file"), status=result["status"], duration=round(time.monotonic() - started, 3))
+            return result
+        return run
+
+    def _installer_result(self, product, ftp_path, dest_dir, version_file, artifact, installer=None, updates=()):
+        """Compara o instalador mais recente do servidor com a versão local."""
+        result = {
+            "product": product,
+            "ftp_path": ftp_path,
+            "dest_dir": dest_dir,
+            "version_file": version_file,
+            "latest_file": artifact["name"],
+            "latest_version": artifact["name"][:-4],  # Remove .exe
+            "latest_size": artifact["size"],
+            "latest_modify": artifact["modify"],
+        }
+        if product == "FPO":
+            result["installer_file"] = installer["name"] if installer else None
+            result["installer_size"] = installer and installer["size"]
+            result["installer_modify"] = installer and installer["modify"]
+            result["updates"] = [{"name": u["name"], "size": u["size"], "modify": u["modify"]} for u in updates]
+        return self.apply_local_state(result)
+
+    def apply_local_state(self, result):
+        """(Re)calcula status, arquivo e versão alvo de um resultado a partir da versão instalada localmente.
+
+        Permite reaproveitar um resultado antigo (ex.: o snapshot da última verificação) sem acessar o FTP.
+        """
+        local_version = self.get_local_version(result["version_file"])
+        result.update(
+            local_version=local_version,
+            status=STATUS_UPDATED if local_version == result["latest_version"] else STATUS_OUTDATED,
+            file=result["latest_file"],
+            target_version=result["latest_version"],
+            size=result["latest_size"],
+            modify=result["latest_modify"],
+        )
+        if result["product"] == "FPO" and (not os.path.exists(result["dest_dir"]) or not local_version):
+            result.update(status=STATUS_NOT_INSTALLED, file=result["installer_file"], target_version="Instalador Base",
+                          size=result["installer_size"], modify=result["installer_modify"])
+        if result["product"] == "FPO":
+            result["pending_updates"] = self._pending_fpo_updates(result)
+        return result
+
+    def _pending_fpo_updates(self, result):
+        """Atualizações incrementais do FPO posteriores à versão instalada, da mais antiga para a mais recente."""
+        if result["status"] != STATUS_OUTDATED:
+            return []
+        installed = classify(result["local_version"] + ".exe")
+        if installed is None or installed["product"] != "fpo":
+            return [u for u in result["updates"] if u["name"] == result["latest_file"]]  # Versão local desconhecida
+        return [u for u in result["updates"] if classify(u["name"])["version"] > installed["version"]]
+
+    # --- Lógica do BPA ---
+    def check_bpa(self, cancel=None):
+        self.log("Verificando BPA no servidor FTP...")
+        index = self.remote_index(FTP_PATH_BPA, ("bpa",), cancel)
+        if index is None: raise ConnectionError("Não foi possível listar arquivos do BPA.")
+
+        latest = index.latest("bpa")
+        if not latest: raise FileNotFoundError("Nenhum instalador 'bpamag*.exe' encontrado.")
+
+        result = self._installer_result("BPA", FTP_PATH_BPA, DIR_BPA, VERSION_FILE_BPA, latest)
+        self.log(f"Verificação do BPA concluída. Versão online: {result['latest_version']}")
+        return result
+
+    # --- Lógica do SIA ---
+    def check_sia(self, cancel=None):
+        self.log("Verificando SIA no servidor FTP...")
+        index = self.remote_index(FTP_PATH_SIA, ("sia",), cancel)
+        if index is None: raise ConnectionError("Não foi possível listar arquivos do SIA.")
+
+        latest = index.latest("sia", "installer")
+        if not latest: raise FileNotFoundError("Nenhum instalador 'instsia*.exe' encontrado.")
+
+        result = self._installer_result("SIA", FTP_PATH_SIA, DIR_SIA, VERSION_FILE_SIA, latest)
+        self.log(f"Verificação do SIA concluída. Versão online: {result['latest_version']}")
+        return result
+
+    # --- Lógica do FPO ---
+    def check_fpo(self, cancel=None):
+        self.log("Verificando FPO no servidor FTP...")
+        index = self.remote_index(FTP_PATH_FPO, ("fpo",), cancel)
+        if index is None: raise ConnectionError("Não foi possível listar arquivos do FPO.")
+
+        latest_update = index.latest("fpo", "update")
+        if not latest_update: raise FileNotFoundError("Nenhum arquivo de atualização do FPO encontrado.")
+
+        result = self._installer_result("FPO", FTP_PATH_FPO, DIR_FPO, VERSION_FILE_FPO, latest_update,
+                                        installer=index.latest("fpo", "installer"),
+                                        updates=reversed(index.query("fpo", "update")))
+        self.log("Verificação do FPO concluída.")
+        return result
+
+    # --- Lógica do BDSIA ---
+    def check_bdsia(self, count=3, cancel=None):
+        self.log("Listando versões do BDSIA...")
+        index = self.remote_index(FTP_PATH_SIA, ("bdsia",), cancel)
+        if index is None: raise ConnectionError("Não foi possível listar arquivos do SIA/BDSIA.")
+
+        recent = index.query("bdsia")[:count]
+        self.log(f"{len(recent)} versões recentes do BDSIA encontradas.")
+        return {
+            "product": "BDSIA",
+            "ftp_path": FTP_PATH_SIA,
+            "dest_dir": DIR_SIA,
+            "status": STATUS_AVAILABLE if recent else STATUS_NOT_INSTALLED,
+            "files": [artifact["name"] for artifact in recent],
+            "file": recent[0]["name"] if recent else None,
+            "artifacts": recent,
+        }
+
+    # --- Funções de Download ---
+    @contextmanager
+    def _tracked_transfer(self, filename, protocol, on_progress, limiter=None, product=None):
+        """Acompanha uma transferência e grava o registro final nas métricas e no log estruturado, com sucesso ou falha."""
+        event = {"zip": "extracao", "backup": "backup"}.get(protocol, "download")
+        progress = TransferProgress(filename, protocol, on_update=on_progress, limiter=limiter)
+        if product is None:
+            product = (classify(filename) or {}).get("product")
+        try:
+            with span(event, "transferencia", file=filename, protocol=protocol, product=product):
+                yield progress
+        except Exception as e:
+            snapshot = progress.finish("erro", str(e))
+            self.metrics.write(event, **snapshot)
+            log_event(event, f"{filename} ({protocol}): falhou após {snapshot['bytes']} bytes ({e})", "warning",
+                      product=product, file=filename, bytes=snapshot["bytes"], duration=round(snapshot["elapsed"], 3),
+                      status=snapshot["status"])
+            raise
+        snapshot = progress.finish()
+        self.metrics.write(event, **snapshot)
+        log_event(event, f"{filename} ({protocol}): {snapshot['bytes']} bytes em {snapshot['elapsed']:.1f}s",
+                  product=product, file=filename, bytes=snapshot["bytes"], duration=round(snapshot["elapsed"], 3),
+                  status=snapshot["status"])
+
+    def _listed_file_info(self, ftp_path, filename):
+        """(tamanho, data) do arquivo segundo a listagem do diretório (em cache, se ainda válida), ou None."""
+        try:
+            _, entries = self._directory_entries(ftp_path)
+        except Exception:
+            return None  # O próprio download consulta SIZE/MDTM
+        for entry in entries:
+            if entry["name"] == filename:
+                return entry["size"], entry["modify"]
+        return None
+
+    def _artifact_source(self, ftp_path, filename):
+        """Origem de um arquivo do FTP no repositório de artefatos, qualquer que seja a fonte usada no download."""
+        return f"ftp://{self.ftp_server}{ftp_path}{filename}"
+
+    def _store_download(self, save_path, sha256, source, modify):
+        """Registra no repositório de artefatos o arquivo recém-baixado e loga o SHA-256."""
+        filename = os.path.basename(save_path)
+        info = classify(filename) or {}
+        try:
+            entry = self.artifacts.add(save_path, sha256, source, product=info.get("product"),
+                                       version=os.path.splitext(filename)[0], modify=modify)
+            self.log(f"Download de {filename} concluído com sucesso! SHA-256: {entry['sha256']}", "info")
+        except OSError as e:
+            self.log(f"Download de {filename} concluído, mas não foi guardado no repositório local: {e}", "warning")
+
+    def download_ftp(self, ftp_path, filename, dest_dir, on_progress=None, limiter=None, backup=True, segments=None):
+        """Baixa um arquivo do FTP para dest_dir e retorna o caminho salvo.
+
+        Se o arquivo for um instalador ou atualização, a pasta de trabalho do produto é copiada para o
+        repositório de backup enquanto o download acontece; o retorno aguarda o fim do backup.
+        backup=False dispensa o snapshot (ex.: pré-download, que não instala nada).
+        segments substitui DOWNLOAD_SEGMENTS (1 baixa tudo por uma única conexão, que volta ao pool).
+        """
+        backup = self._backup_before_install(filename, on_progress) if backup else None
+        save_path = self._download_ftp(ftp_path, filename, dest_dir, on_progress, limiter, segments)
+        self._await_backup(backup, filename)
+        return save_path
+
+    def _download_ftp(self, ftp_path, filename, dest_dir, on_progress=None, limiter=None, segments=None):
+        """Download de download_ftp, sem o backup.
+
+        Se o repositório de artefatos já tem uma cópia íntegra do mesmo arquivo remoto (tamanho e data),
+        ela é usada sem acessar a rede. on_progress recebe periodicamente o snapshot de TransferProgress;
+        limiter(nbytes) é chamado a cada bloco recebido (ver DownloadScheduler).
+        Sem cópia local, tenta um delta do espelho sobre a versão anterior (ver _download_delta) e,
+        sem ele, as fontes são tentadas da melhor para a pior até uma concluir o download.
+        """
+        save_path = os.path.join(dest_dir, filename)
+        source_id = self._artifact_source(ftp_path, filename)
+        remote_info = self._listed_file_info(ftp_path, filename)
+        modify = remote_info and remote_info[1]
+        stored = self.artifacts.lookup(source_id, *remote_info) if remote_info else None
+        if stored:
+            self.artifacts.materialize(stored["sha256"], save_path)
+            self.metrics.write("download", name=filename, protocol="ftp", status="reutilizado",
+                               bytes=stored["size"], sha256=stored["sha256"])
+            self.log(f"{filename} já está no repositório local (SHA-256 {stored['sha256'][:12]}); download dispensado.")
+            return save_path
+        for source in self.sources.ranked((SOURCE_MIRROR,))[:1]:
+            sha256 = self._download_delta(source, ftp_path, filename, save_path, remote_info, on_progress, limiter)
+            if sha256:
+                self._store_download(save_path, sha256, source_id, modify)
+                return save_path
+
+        errors = []
+        candidates = [source for source in self.sources.ranked(size=remote_info and remote_info[0])
+                      if source["kind"] != SOURCE_LOCAL or os.path.isfile(local_path(source, ftp_path, filename))]
+        for position, source in enumerate(candidates):
+            self.log(f"Iniciando download de {filename} de {source['key']}...")
+            hasher = StreamingHasher()
+            attempts = 3 if position == len(candidates) - 1 else 1  # Havendo outra fonte, passa logo a ela
+            try:
+                self._transfer_from(source, filename, on_progress, limiter, lambda progress: self._fetch_ftp_file(
+                    source, ftp_path, filename, save_path, progress, remote_info, hasher, attempts, segments))
+            except (TransferCancelled, DiskWriteError):
+                raise  # Outra fonte gravaria no mesmo disco
+            except Exception as e:
+                errors.append(e)
+                continue
+            self._store_download(save_path, hasher.hexdigest(save_path), source_id, modify)
+            return save_path
+        raise errors[-1] if errors else FileNotFoundError(f"{filename} não está disponível em nenhuma fonte.")
+
+    def _delta_base(self, filename, dest_dir):
+        """Versão anterior mais recente do mesmo produto e tipo presente na estação: (nome, caminho), ou None.
+
+        Procura no repositório de artefatos e em dest_dir (ex.: o BDSIA do mês passado em DIR_SIA).
+        """
+        info = classify(filename)
+        if info is None:
+            return None
+        found = {entry["name"]: self.artifacts.object_path(sha256) for sha256, entry in self.artifacts.entries().items()}
+        try:
+            for name in os.listdir(dest_dir):
+                found.setdefault(name, os.path.join(dest_dir, name))
+        except OSError:
+            pass
+        older = []
+        for name, path in found.items():
+            other = classify(name)
+            if (other and (other["product"], other["kind"]) == (info["product"], info["kind"])
+                    and other["version"] < info["version"] and os.path.isfile(path)):
+                older.append((other["version"], name, path))
+        return max(older)[1:] if older else None
+
+    def _download_delta(self, source, ftp_path, filename, save_path, remote_info, on_progress=None, limiter=None):
+        """Monta save_path a partir da versão anterior local e de um delta do espelho; retorna o SHA-256 ou None.
+
+        Qualquer falha (espelho sem o delta, versão local diferente da usada no delta, tamanho que não
+        confere com a listagem) apenas devolve None, e o arquivo é baixado por completo.
+        """
+        from downloads import PART_SUFFIX, META_SUFFIX, download_http
+
+        base = self._delta_base(filename, os.path.dirname(save_path))
+        if base is None:
+            return None
+        old, old_path = base
+        delta_path = save_path + DELTA_SUFFIX
+        try:
+            with self._tracked_transfer(filename, "delta", on_progress, limiter) as progress:
+                download_http(self.http_session, f"{source['url']}/delta{ftp_path}{filename}?de={quote(old)}",
+                              delta_path, timeout=(MIRROR_TIMEOUT, MIRROR_READ_TIMEOUT), log=self.log,
+                              progress=progress, **self.write_options)
+                sha256 = apply_delta(old_path, delta_path, save_path, remote_info and remote_info[0])
+        except TransferCancelled:
+            raise
+        except Exception as e:
+            self.log(f"Delta de {old} para {filename} indisponível ({e}); baixando o arquivo completo.", "warning")
+            return None
+        finally:
+            for path in (delta_path, delta_path + PART_SUFFIX, delta_path + META_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.log(f"{filename} montado a partir de {old} com um delta de {format_bytes(progress.bytes)}.")
+        return sha256
+
+    def _fetch_ftp_file(self, source, ftp_path, filename, save_path, progress, remote_info, hasher, attempts=3,
+                        segments=None):
+        from downloads import copy_local, download_ftp_resumable, download_http
+
+        segments = segments or DOWNLOAD_SEGMENTS
+        if source["kind"] == SOURCE_FTP:
+            pool, listings = self._ftp_client(source)
+            download_ftp_resumable(pool, ftp_path, filename, save_path, attempts=attempts, segments=segments,
+                                   min_segment_size=DOWNLOAD_MIN_SEGMENT_SIZE, log=self.log, progress=progress,
+                                   remote_info=remote_info, hasher=hasher, **self.write_options)
+            listings.invalidate(ftp_path)
+        elif source["kind"] == SOURCE_MIRROR:
+            self._await_mirror(filename, progress, lambda: download_http(
+                self.http_session, f"{source['url']}/ftp{ftp_path}{filename}", save_path, segments=segments,
+                min_segment_size=DOWNLOAD_MIN_SEGMENT_SIZE, timeout=(MIRROR_TIMEOUT, MIRROR_READ_TIMEOUT),
+                log=self.log, progress=progress, hasher=hasher, **self.write_options))
+        else:
+            copy_local(local_path(source, ftp_path, filename), save_path, progress, hasher, **self.write_options)
+
+    def _await_mirror(self, filename, progress, fetch):
+        """Executa fetch(), aguardando e repetindo enquanto o espelho responde que ainda busca o arquivo no DATASUS.
+
+        A espera não conta como falha do espelho: todas as estações aguardam a mesma busca em vez de
+        irem ao DATASUS. Depois de MIRROR_MAX_WAIT segundos, levanta TimeoutError.
+        """
+        from downloads import RetryLaterError
+
+        deadline = time.monotonic() + MIRROR_MAX_WAIT
+        while True:
+            try:
+                return fetch()
+            except RetryLaterError as e:
+                if time.monotonic() + e.retry_after > deadline:
+                    raise TimeoutError(f"O espelho não concluiu a busca de {filename} "
+                                       f"em {MIRROR_MAX_WAIT // 60} min.") from e
+                if not progress.phases.get("mirror_wait"):
+                    self.log(f"O espelho ainda está baixando {filename} do DATASUS; aguardando...")
+                with progress.phase("mirror_wait"):
+                    waited = 0
+                    while waited < e.retry_after:
+                        time.sleep(min(1, e.retry_after - waited))
+                        waited += 1
+                        if progress.limiter:
+                            progress.limiter(0)  # Levanta TransferCancelled se o download foi cancelado
+
+    def _transfer_from(self, source, filename, on_progress, limiter, fetch):
+        """Executa fetch(progress) acompanhando a transferência e atualizando a pontuação da fonte."""
+        try:
+            with self._tracked_transfer(filename, source["kind"], on_progress, limiter) as progress:
+                result = fetch(progress)
+        except (TransferCancelled, DiskWriteError):
+            raise  # Não dizem nada sobre a fonte
+        except Exception as e:
+            duration = self.sources.record_failure(source)
+            self.log(f"Falha ao baixar {filename} de {source['key']} ({e}); fonte rebaixada por {duration:.0f}s.", "warning")
+            raise
+        self.sources.record_success(source, nbytes=progress.bytes - progress.resumed_bytes,
+                                    elapsed=progress.phases.get("transfer"))
+        return result
+
+    def download_http(self, url, filename, dest_dir, on_progress=None, limiter=None):
+        """Baixa uma URL para dest_dir; retorna (caminho salvo, se houve transferência).
+
+        Espelhos e pastas configurados como fontes são tentados antes da URL original.
+        """
+        from downloads import copy_local
+
+        save_path = os.path.join(dest_dir, filename)
+        for source in self.sources.ranked((SOURCE_MIRROR, SOURCE_LOCAL)):
+            if source["kind"] == SOURCE_MIRROR:
+                url_in_mirror = f"{source['url']}/http/{filename}"
+                fetch = lambda progress, url_in_mirror=url_in_mirror: self._await_mirror(
+                    filename, progress, lambda: self._download_http_stream(
+                        url_in_mirror, save_path, progress, timeout=(MIRROR_TIMEOUT, MIRROR_READ_TIMEOUT)))
+            else:
+                copy_path = os.path.join(source["root"], "http", filename)
+                if not os.path.isfile(copy_path):
+                    continue
+                fetch = lambda progress, copy_path=copy_path: copy_local(
+                    copy_path, save_path, progress, **self.write_options)
+            self.log(f"Iniciando download de {filename} de {source['key']}...")
+            try:
+                changed = self._transfer_from(source, filename, on_progress, limiter, fetch)
+            except TransferCancelled:
+                raise
+            except Exception:
+                continue
+            if changed:
+                self.log(f"Download de {filename} concluído com sucesso!", "info")
+            return save_path, changed
+        self.log(f"Iniciando download de {filename} via HTTP...")
+        return save_path, self._download_http(url, save_path, on_progress, limiter)
+
+    def _download_http_stream(self, url, save_path, progress, timeout=30):
+        from downloads import download_http
+
+        return download_http(self.http_session, url, save_path, segments=DOWNLOAD_SEGMENTS,
+                             min_segment_size=DOWNLOAD_MIN_SEGMENT_SIZE, timeout=timeout, cache=self.http_cache,
+                             log=self.log, progress=progress, **self.write_options)
+
+    def _download_http(self, url, save_path, on_progress, limiter=None):
+        filename = os.path.basename(save_path)
+        with self._tracked_transfer(filename, "http", on_progress, limiter) as progress:
+            changed = self._download_http_stream(url, save_path, progress)
+        if changed:
+            self.log(f"Download de {filename} concluído com sucesso!", "info")
+        return changed
+
+    def extract_zip(self, zip_path, dest_dir, on_progress=None):
+        """Extrai um zip em dest_dir, em paralelo e pulando membros já extraídos; retorna o resumo."""
+        from extraction import extract_zip
+
+        name = os.path.basename(zip_path)
+        self.log(f"Extraindo {name} para {dest_dir}...")
+
+        def on_member(member, done, total, skipped):
+            self.log(f"[{done}/{total}] {member} {'já extraído' if skipped else 'extraído'}")
+
+        with self._tracked_transfer(f"Extração de {name}", "zip", on_progress) as progress:
+            summary = extract_zip(zip_path, dest_dir, progress=progress, on_member=on_member)
+        self.log(f"Extração concluída: {summary['extracted']} arquivos extraídos, {summary['skipped']} já atualizados.")
+        return summary
+
+    # --- Backup das pastas de trabalho ---
+    def backup_directory(self, product, reason="manual", on_progress=None):
+        """Inicia em segundo plano um snapshot da pasta de trabalho do produto; retorna um Future com o resumo.
+
+        Os snapshots são executados um de cada vez; pedidos do mesmo produto feitos enquanto o snapshot
+        dele ainda está em andamento (ex.: várias atualizações do FPO) compartilham essa execução.
+        """
+        with self._lazy_lock:
+            future = self._backups_in_flight.get(product)
+            if future is not None:
+                return future
+            if self._backup_executor is None:
+                self._backup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backup")
+            future = self._backup_executor.submit(self._run_backup, product, reason, on_progress)
+            self._backups_in_flight[product] = future
+        future.add_done_callback(lambda f: self._forget_backup(product, f))
+        return future
+
+    def _forget_backup(self, product, future):
+        with self._lazy_lock:
+            if self._backups_in_flight.get(product) is future:
+                del self._backups_in_flight[product]
+
+    def _run_backup(self, product, reason, on_progress=None):
+        directory = BACKUP_DIRECTORIES[product]
+        self.log(f"Backup de {directory} iniciado ({reason})...")
+        try:
+            with self._tracked_transfer(f"Backup de {product.upper()}", "backup", on_progress, product=product) as progress:
+                summary = self.backups.snapshot(product, directory, reason, progress=progress)
+        except Exception as e:
+            self.log(f"Falha no backup de {directory}: {e}", "error")
+            raise
+        self.log(f"Backup de {directory} concluído: {format_bytes(summary['size'])} protegidos, "
+                 f"{format_bytes(summary['stored_bytes'])} novos no repositório (snapshot {summary['id']}).")
+        for relative, error in summary["errors"].items():
+            self.log(f"Backup de {directory}: {relative} não foi copiado ({error}).", "warning")
+        return summary
+
+    def _backup_before_install(self, filename, on_progress=None):
+        """Inicia o backup da pasta do produto se filename for um instalador ou atualização já instalado."""
+        info = classify(filename)
+        if not self.backup_before_install or not info or info["product"] not in BACKUP_DIRECTORIES:
+            return None
+        if not os.path.isdir(BACKUP_DIRECTORIES[info["product"]]):
+            return None  # Nada instalado ainda
+        return self.backup_directory(info["product"], f"antes de {filename}", on_progress)
+
+    def _await_backup(self, future, filename):
+        """Aguarda o backup iniciado antes de um download; uma falha é registrada, mas não impede o download."""
+        if future is None:
+            return
+        if not future.done():
+            self.log(f"{filename} baixado; aguardando o fim do backup antes de liberá-lo...")
+        try:
+            future.result()
+        except Exception as e:
+            self.log(f"O backup anterior a {filename} falhou ({e}); a pasta atual NÃO está protegida.", "error")
+
+    def list_backups(self, product=None):
+        """Snapshots guardados (opcionalmente de um produto), do mais recente para o mais antigo."""
+        return self.backups.snapshots(product)
+
+    def restore_backup(self, snapshot_id, target=None, on_progress=None):
+        """Restaura um snapshot em target (por padrão, na pasta de origem); retorna o número de arquivos.
+
+        Antes de sobrescrever a pasta de origem, o estado atual dela também é guardado em um snapshot.
+        """
+        manifest = self.backups.load(snapshot_id)
+        if target is None and os.path.isdir(manifest["directory"]):
+            self.backup_directory(manifest["name"], f"antes de restaurar {snapshot_id}", on_progress).result()
+        self.log(f"Restaurando {snapshot_id} em {target or manifest['directory']}...")
+        with self._tracked_transfer(f"Restauração de {manifest['name'].upper()}", "backup", on_progress,
+                                    product=manifest["name"]) as progress:
+            count = self.backups.restore(snapshot_id, target, progress)
+        self.log(f"Restauração concluída: {count} arquivos gravados em {target or manifest['directory']}.")
+        return count
+
+    # --- Atualização geral ---
+    def update_plan(self, results):
+        """Arquivos necessários para deixar a estação atualizada, a partir dos resultados das verificações.
+
+        Inclui todas as atualizações incrementais do FPO que faltam, na ordem de instalação,
+        e o BDSIA mais recente se ele ainda não estiver na pasta do SIA.
+        """
+        plan = []
+        for name in ("bpa", "sia", "fpo"):
+            result = results.get(name)
+            if not result or result["status"] == STATUS_UPDATED or not result.get("file"):
+                continue
+            if result["status"] == STATUS_OUTDATED and result.get("pending_updates"):
+                items = [(u["name"], u["size"], u["name"][:-4]) for u in result["pending_updates"]]
+            else:
+                items = [(result["file"], result["size"], result["target_version"])]
+            plan += [{"product": name, "ftp_path": result["ftp_path"], "dest_dir": result["dest_dir"], "file": file,
+                      "size": size, "version_file": result["version_file"], "version": version}
+                     for file, size, version in items]
+        bdsia = results.get("bdsia")
+        if bdsia and bdsia.get("artifacts"):
+            newest = bdsia["artifacts"][0]
+            save_path = os.path.join(bdsia["dest_dir"], newest["name"])
+            if not os.path.exists(save_path) or os.path.getsize(save_path) != newest["size"]:
+                plan.append({"product": "bdsia", "ftp_path": bdsia["ftp_path"], "dest_dir": bdsia["dest_dir"],
+                             "file": newest["name"], "size": newest["size"], "version_file": None, "version": None})
+        return plan
+
+    def _verify_download(self, item, save_path):
+        """Confere tamanho e SHA-256 do arquivo baixado antes de a versão local ser registrada.
+
+        O SHA-256 esperado é o registrado no repositório de artefatos para a mesma origem, tamanho e
+        data remota. Sem esse registro a verificação é inconclusiva e também levanta ValueError.
+        """
+        size = os.path.getsize(save_path)
+        if item["size"] is not None and size != item["size"]:
+            raise ValueError(f"{item['file']} tem {size} bytes; o servidor anunciou {item['size']}.")
+        source_id = self._artifact_source(item["ftp_path"], item["file"])
+        remote_info = self._listed_file_info(item["ftp_path"], item["file"])
+        modify = remote_info and remote_info[1]
+        recorded = [(entry["stored_at"], sha256) for sha256, entry in self.artifacts.entries().items()
+                    if entry["source"] == source_id and entry["size"] == size
+                    and (not modify or entry.get("modify") == modify)]
+        if not recorded:
+            raise ValueError(f"{item['file']} sem SHA-256 registrado no repositório local; verificação inconclusiva.")
+        expected = max(recorded)[1]
+        sha256 = file_sha256(save_path).hexdigest()
+        if sha256 != expected:
+            raise ValueError(f"{item['file']} tem SHA-256 {sha256[:12]}; o download registrou {expected[:12]}.")
+
+    @staticmethod
+    def plan_by_directory(plan):
+        """Agrupa os itens de update_plan por diretório remoto, mantendo a ordem do plano."""
+        by_directory = {}
+        for item in plan:
+            by_directory.setdefault(item["ftp_path"], []).append(item)
+        return by_directory
+
+    def update_directory(self, items, on_progress=None, limiter=None):
+        """Baixa em sequência itens de update_plan de um mesmo diretório remoto.
+
+        Cada arquivo vem inteiro por uma única conexão (segments=1), que volta ao pool e é reaproveitada
+        pelo arquivo seguinte, já no diretório certo. A versão local de cada produto só é gravada depois
+        que o arquivo correspondente é verificado (ver _verify_download). Se um item falhar, os seguintes
+        do mesmo produto (ex.: atualizações posteriores do FPO) são pulados.
+        Retorna os itens acrescidos de status ("ok", "erro" ou "pulado"), path e error.
+        """
+        self.ensure_folders_exist()
+        outcomes, failed = [], set()
+        for item in items:
+            if item["product"] in failed:
+                outcomes.append(dict(item, status=OUTCOME_SKIPPED, path=None, error="Item anterior do produto falhou."))
+                continue
+            try:
+                save_path = self.download_ftp(item["ftp_path"], item["file"], item["dest_dir"], on_progress, limiter,
+                                              segments=1)
+                self._verify_download(item, save_path)
+                if item["version_file"] and item["version"]:
+                    self.record_version(item["version_file"], item["version"])
+                outcomes.append(dict(item, status=OUTCOME_OK, path=save_path, error=None))
+            except TransferCancelled:
+                raise
+            except Exception as e:
+                self.log(f"Falha na atualização de {item['file']}: {e}", "error")
+                failed.add(item["product"])
+                outcomes.append(dict(item, status=OUTCOME_ERROR, path=None, error=str(e)))
+        return outcomes
+
+    def update_all(self, plan, on_progress=None, limiter=None, max_workers=MAX_CONCURRENT_DOWNLOADS):
+        """Baixa os itens de update_plan, um diretório remoto por vez em cada uma de max_workers threads.
+
+        Ver update_directory. Retorna os resultados de todos os itens, na ordem dos diretórios.
+        """
+        by_directory = self.plan_by_directory(plan)
+        if not by_directory:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(by_directory), max_workers), thread_name_prefix="atualizacao") as executor:
+            futures = [executor.submit(self.update_directory, items, on_progress, limiter)
+                       for items in by_directory.values()]
+        outcomes = []
+        for future in futures:
+            outcomes += future.result()
+        return outcomes
+
+    def download_result(self, result):
+        """Baixa o arquivo indicado por uma verificação e registra a nova versão local, quando houver."""
+        save_path = self.download_ftp(result["ftp_path"], result["file"], result["dest_dir"])
+        if result.get("version_file") and result.get("target_version"):
+            self.record_version(result["version_file"], result["target_version"])
+        return save_path
@@ -0,0 +1,157 @@
+"""Deltas binários entre versões consecutivas de um arquivo (BDSIA, instsia, bpamag, fpo).
+
+O delta descreve a versão nova como uma sequência de trechos copiados da versão antiga e de dados
+novos. As duas versões são divididas em blocos pelo conteúdo (ver chunking.py): blocos da nova que
+também existem na antiga viram cópias, e só o restante viaja no delta, compactado.
+
+Formato: DELTA_MAGIC, o tamanho (4 bytes) de um cabeçalho JSON com nome, tamanho e SHA-256 das duas
+versões, e um fluxo gzip de operações "C" (deslocamento na antiga, 8 bytes; comprimento, 4 bytes)
+e "D" (comprimento, 4 bytes; dados).
+"""
+import gzip
+import hashlib
+import json
+import os
+import struct
+import zlib
+
+from block_writer import sync_file
+from chunking import anchor, iter_chunks
+
+DELTA_MAGIC = b"DATASUS-DELTA-1\n"
+DELTA_MIN_CHUNK = 2 * 1024  # Blocos menores que os do backup: trechos alterados menores viajam no delta
+DELTA_MAX_CHUNK = 64 * 1024
+DELTA_ANCHOR = anchor(12)
+DELTA_MAX_RATIO = 0.7  # Deltas maiores que esta fração da versão nova não compensam o download completo
+DELTA_SUFFIX = ".delta"
+COPY_OP = struct.Struct(">QI")
+DATA_OP = struct.Struct(">I")
+READ_SIZE = 1024 * 1024
+
+
+class DeltaError(Exception):
+    """O delta é inválido ou não reconstrói a versão esperada."""
+
+
+def _chunks(f):
+    return iter_chunks(f, DELTA_MIN_CHUNK, DELTA_MAX_CHUNK, DELTA_ANCHOR)
+
+
+def make_delta(old_path, new_path, delta_path):
+    """Grava em delta_path o delta de old_path para new_path; retorna o cabeçalho, acrescido do tamanho do delta."""
+    blocks = {}  # Resumo do bloco -> (deslocamento, comprimento) na versão antiga
+    old_sha256 = hashlib.sha256()
+    offset = 0
+    with open(old_path, 'rb') as f:
+        for data in _chunks(f):
+            old_sha256.update(data)
+            blocks.setdefault(hashlib.blake2b(data, digest_size=16).digest(), (offset, len(data)))
+            offset += len(data)
+    header = {"old": {"name": os.path.basename(old_path), "size": offset, "sha256": old_sha256.hexdigest()}}
+
+    new_sha256 = hashlib.sha256()
+    size = 0
+    tmp_path = delta_path + ".tmp"
+    with open(new_path, 'rb') as source, open(tmp_path, 'wb') as out:
+        out.write(DELTA_MAGIC)
+        header_position = out.tell()
+        out.write(bytes(4 + 4096))  # Reservado para o cabeçalho, conhecido só no final
+        with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6, mtime=0) as ops:
+            copy = None  # Cópia pendente (deslocamento, comprimento), estendida enquanto os blocos forem contíguos
+            for data in _chunks(source):
+                new_sha256.update(data)
+                size += len(data)
+                match = blocks.get(hashlib.blake2b(data, digest_size=16).digest())
+                if match and copy and copy[0] + copy[1] == match[0]:
+                    copy = (copy[0], copy[1] + match[1])
+                    continue
+                if copy:
+                    ops.write(b"C" + COPY_OP.pack(*copy))
+                    copy = None
+                if match:
+                    copy = match
+                else:
+                    ops.write(b"D" + DATA_OP.pack(len(data)))
+                    ops.write(data)
+            if copy:
+                ops.write(b"C" + COPY_OP.pack(*copy))
+        header["new"] = {"name": os.path.basename(new_path), "size": size, "sha256": new_sha256.hexdigest()}
+        encoded = json.dumps(header).encode()
+        if len(encoded) > 4096:
+            raise DeltaError("Cabeçalho do delta muito grande.")
+        out.seek(header_position)
+        out.write(DATA_OP.pack(len(encoded)) + encoded)
+    os.replace(tmp_path, delta_path)
+    return dict(header, delta_size=os.path.getsize(delta_path))
+
+
+def read_header(f):
+    """Lê o cabeçalho de um delta aberto e posiciona f no início das operações."""
+    if f.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+        raise DeltaError("Arquivo não é um delta.")
+    length, = DATA_OP.unpack(f.read(4))
+    try:
+        header = json.loads(f.read(length))
+    except ValueError as e:
+        raise DeltaError(f"Cabeçalho do delta inválido: {e}")
+    f.seek(len(DELTA_MAGIC) + 4 + 4096)
+    return header
+
+
+def _read_exact(f, count):
+    data = f.read(count)
+    if len(data) != count:
+        raise DeltaError("Delta truncado.")
+    return data
+
+
+def apply_delta(old_path, delta_path, save_path, expected_size=None):
+    """Reconstrói a versão nova em save_path a partir de old_path e do delta; retorna o SHA-256 dela.
+
+    O arquivo é montado em um .tmp e só substitui save_path se tamanho e SHA-256 conferirem com o
+    cabeçalho e, se informado, o tamanho com expected_size (ex.: o anunciado pelo servidor de origem);
+    caso contrário levanta DeltaError (ex.: a versão antiga local difere da usada no delta).
+    """
+    tmp_path = save_path + ".tmp"
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(delta_path, 'rb') as delta, open(old_path, 'rb') as old, open(tmp_path, 'wb') as out:
+            header = read_header(delta)
+            with gzip.GzipFile(fileobj=delta, mode='rb') as ops:
+                while True:
+                    kind = ops.read(1)
+                    if not kind:
+                        break
+                    if kind == b"C":
+                        offset, remaining = COPY_OP.unpack(_read_exact(ops, COPY_OP.size))
+                        old.seek(offset)
+                        while remaining:
+                            data = old.read(min(remaining, READ_SIZE))
+                            if not data:
+                                raise DeltaError("A versão antiga local é menor que a usada no delta.")
+                            out.write(data)
+                            sha256.update(data)
+                            remaining -= len(data)
+                            size += len(data)
+                    elif kind == b"D":
+                        length, = DATA_OP.unpack(_read_exact(ops, DATA_OP.size))
+                        data = _read_exact(ops, length)
+                        out.write(data)
+                        sha256.update(data)
+                        size += length
+                    else:
+                        raise DeltaError(f"Operação desconhecida no delta: {kind!r}")
+        digest = sha256.hexdigest()
+        if size != header["new"]["size"] or digest != header["new"]["sha256"]:
+            raise DeltaError(f"{header['new']['name']} reconstruído não confere (SHA-256 {digest[:12]}).")
+        if expected_size is not None and size != expected_size:
+            raise DeltaError(f"{header['new']['name']} reconstruído tem {size} bytes; o servidor anuncia {expected_size}.")
+        sync_file(tmp_path)
+        os.replace(tmp_path, save_path)
+        return digest
+    except (OSError, EOFError, struct.error, zlib.error) as e:
+        raise DeltaError(f"Falha ao aplicar o delta: {e}") from e
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
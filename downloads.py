@@ -0,0 +1,471 @@
+"""Rotinas de transferência de arquivos usadas pelos workers de download."""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from ftplib import all_errors, error_perm
+
+from block_writer import (
+    BlockWriter, DiskWriteError, disk_write, open_part, sync_file, FSYNC_END, RECEIVE_CHUNK, WRITE_BLOCK_SIZE,
+)
+from tracing import span
+
+PART_SUFFIX = ".part"  # Arquivo parcial, renomeado para o destino apenas quando completo
+META_SUFFIX = ".part.json"  # Sidecar com o tamanho e a data do arquivo remoto que originou o .part
+RETRY_DELAY = 2  # Segundos de espera (multiplicados pela tentativa) entre tentativas de download
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024  # Arquivos menores que dois segmentos deste tamanho usam uma única conexão
+SEGMENT_CHECKPOINT_INTERVAL = 2  # Segundos mínimos entre gravações do sidecar de um download segmentado
+
+
+class IncompleteDownloadError(Exception):
+    """O arquivo baixado não tem o tamanho anunciado pelo servidor."""
+
+
+class RangeNotSupportedError(Exception):
+    """O servidor não aceita transferências parciais (REST no FTP, Range no HTTP)."""
+
+
+class RetryLaterError(Exception):
+    """O servidor pediu para repetir o pedido depois (HTTP 503 com Retry-After), ex.: espelho ainda buscando o arquivo."""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after  # Segundos sugeridos pelo servidor
+
+
+def _default_log(message, level="info"):
+    getattr(logging, level)(message)
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_path, meta):
+    with disk_write(meta_path), open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+
+def _phase(progress, name):
+    return progress.phase(name) if progress else nullcontext()
+
+
+def _fsync(path, progress, policy=FSYNC_END):
+    """Garante, conforme a política, que o arquivo baixado está no disco antes de ser renomeado para o destino."""
+    with _phase(progress, "fsync"):
+        sync_file(path, policy)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def remote_file_info(ftp, filename):
+    """Obtém (tamanho, data de modificação) de um arquivo remoto; cada valor é None se o servidor não informar."""
+    size = mtime = None
+    try:
+        ftp.voidcmd("TYPE I")  # SIZE só é confiável em modo binário
+        size = ftp.size(filename)
+    except error_perm:
+        pass
+    try:
+        mtime = ftp.sendcmd(f"MDTM {filename}")[4:].strip().split(".")[0]
+    except error_perm:
+        pass
+    return size, mtime
+
+
+def _resume_offset(part_path, meta, remote_meta):
+    """Calcula de onde retomar o .part, ou 0 se ele não corresponde ao arquivo remoto atual.
+
+    O .part é pré-alocado, então a posição vem do campo received do sidecar; sidecars antigos,
+    sem esse campo, usam o tamanho do arquivo.
+    """
+    if (remote_meta["size"] is None or not meta or "segments" in meta
+            or {k: meta.get(k) for k in remote_meta} != remote_meta or not os.path.exists(part_path)):
+        return 0
+    offset = meta.get("received", os.path.getsize(part_path))
+    return offset if offset <= min(remote_meta["size"], os.path.getsize(part_path)) else 0
+
+
+def _retrieve(ftp, filename, part_path, offset, size=None, progress=None, hasher=None, on_flush=None,
+              block_size=WRITE_BLOCK_SIZE, fsync_policy=FSYNC_END):
+    """Executa o RETR gravando no .part a partir de offset, recomeçando do zero se o servidor recusar o REST.
+
+    Os dados são lidos do socket direto no buffer do BlockWriter. Retorna a posição final gravada.
+    """
+    if progress:
+        progress.start_transfer()
+    ftp.voidcmd("TYPE I")
+    try:
+        conn = ftp.transfercmd(f'RETR {filename}', rest=offset or None)
+    except error_perm as e:
+        if not offset or not str(e).startswith(("500", "501", "502", "504")):
+            raise
+        offset = 0
+        if progress:
+            progress.resume_from(0)
+        if hasher:
+            hasher.reset()
+        conn = ftp.transfercmd(f'RETR {filename}')
+    with conn, open_part(part_path, offset, size) as f, span("ftp.retr", "ftp", file=filename, offset=offset):
+        writer = BlockWriter(f, offset, block_size, fsync_policy, progress, hasher, on_flush,
+                             expected=size - offset if size else None)
+        try:
+            while writer.fill(conn.recv_into):
+                pass
+        finally:
+            position = writer.close()
+    ftp.voidresp()
+    return position
+
+
+def plan_segments(size, segments, min_segment_size=MIN_SEGMENT_SIZE):
+    """Divide [0, size) em até `segments` faixas de pelo menos min_segment_size bytes."""
+    if not size or segments <= 1:
+        return [(0, size or 0)]
+    count = max(1, min(segments, size // max(1, min_segment_size)))
+    step = -(-size // count)  # Divisão arredondada para cima
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def _download_segments(fetch_range, ranges, part_path, meta_path, remote_meta, log, progress=None, hasher=None,
+                       block_size=WRITE_BLOCK_SIZE, fsync_policy=FSYNC_END):
+    """Baixa as faixas em paralelo, cada uma gravando no .part pré-alocado em seu próprio deslocamento.
+
+    fetch_range(início, fim, writer) entrega os bytes da faixa a um BlockWriter. O progresso de cada
+    faixa (bytes já gravados) vai para o sidecar durante o download, no máximo a cada
+    SEGMENT_CHECKPOINT_INTERVAL segundos, permitindo que uma nova tentativa, ou o programa reaberto
+    após uma queda, continue de onde parou.
+    """
+    meta = _read_meta(meta_path)
+    expected = [[start, end] for start, end in ranges]
+    if (meta and os.path.exists(part_path) and {k: meta.get(k) for k in remote_meta} == remote_meta
+            and [seg[:2] for seg in meta.get("segments", [])] == expected):
+        done = [seg[2] for seg in meta["segments"]]
+        log(f"Retomando download segmentado: {sum(done)} de {remote_meta['size']} bytes já recebidos.")
+    else:
+        done = [0] * len(ranges)
+        open_part(part_path, 0, remote_meta["size"]).close()
+    if progress:
+        progress.resume_from(sum(done))
+        progress.start_transfer()
+    if hasher:
+        hasher.reset(part_path, done[0])  # O primeiro segmento começa em 0 e segue em fluxo no hash
+        for (start, _), received in zip(ranges[1:], done[1:]):
+            hasher.written(start, received)
+
+    lock = threading.Lock()
+    last_saved = [time.monotonic()]
+
+    def save_progress():
+        with lock:
+            _write_meta(meta_path, dict(remote_meta, segments=[[s, e, d] for (s, e), d in zip(ranges, done)]))
+            last_saved[0] = time.monotonic()
+
+    save_progress()
+
+    def worker(index):
+        start, end = ranges[index]
+        if start + done[index] >= end:
+            return
+        with open(part_path, 'r+b') as f:
+            f.seek(start + done[index])
+
+            def on_flush(position):
+                done[index] = position - start
+                if time.monotonic() - last_saved[0] >= SEGMENT_CHECKPOINT_INTERVAL:
+                    save_progress()
+
+            writer = BlockWriter(f, start + done[index], block_size, fsync_policy, progress, hasher, on_flush,
+                                 expected=end - start - done[index])
+            try:
+                fetch_range(start + done[index], end, writer)
+            finally:
+                writer.close()
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(worker, i) for i in range(len(ranges))]
+        errors = [f.exception() for f in futures if f.exception()]
+        if errors:
+            raise next((e for e in errors if isinstance(e, DiskWriteError)), errors[0])
+    finally:
+        save_progress()
+    return sum(done)
+
+
+def _ftp_fetch_range(pool, ftp_path, filename, start, end, size, writer, progress=None):
+    """Lê os bytes [start, end) de um arquivo remoto usando REST; faixas intermediárias abandonam o RETR."""
+    with pool.connection(ftp_path, progress) as ftp, span("ftp.faixa", "ftp", file=filename, start=start, end=end):
+        ftp.voidcmd("TYPE I")
+        try:
+            conn = ftp.transfercmd(f'RETR {filename}', rest=start)
+        except error_perm as e:
+            if str(e).startswith(("500", "501", "502", "504")):
+                raise RangeNotSupportedError(str(e)) from e
+            raise
+        remaining = end - start
+        try:
+            while remaining > 0:
+                count = writer.fill(conn.recv_into, remaining)
+                if not count:
+                    break
+                remaining -= count
+        finally:
+            conn.close()
+        if remaining:
+            raise IncompleteDownloadError(f"{filename}: faixa {start}-{end} interrompida.")
+        if end < size:
+            pool.retire(ftp)  # A transferência foi abandonada no meio; a conexão não volta ao pool
+        else:
+            ftp.voidresp()
+
+
+def download_ftp_resumable(pool, ftp_path, filename, save_path, attempts=3, segments=1,
+                           min_segment_size=MIN_SEGMENT_SIZE, log=None, progress=None, remote_info=None,
+                           hasher=None, block_size=WRITE_BLOCK_SIZE, fsync_policy=FSYNC_END):
+    """Baixa um arquivo do FTP via .part, retomando com REST transferências interrompidas.
+
+    O sidecar registra o tamanho e a data do arquivo remoto; se eles mudarem, o .part é descartado.
+    Com segments > 1 e tamanho conhecido, o arquivo é dividido em faixas baixadas por conexões paralelas.
+    O arquivo só é renomeado para save_path depois que o tamanho confere com o do servidor.
+    Só falhas de rede são repetidas; uma falha do disco local (DiskWriteError) encerra o download na hora.
+    remote_info=(tamanho, data) vindo de uma listagem MLSD recente dispensa o SIZE/MDTM na primeira tentativa.
+    Um StreamingHasher em hasher recebe os blocos à medida que são gravados.
+    block_size e fsync_policy configuram a gravação (ver block_writer).
+    """
+    log = log or _default_log
+    part_path = save_path + PART_SUFFIX
+    meta_path = save_path + META_SUFFIX
+    for attempt in range(1, attempts + 1):
+        try:
+            with pool.connection(ftp_path, progress) as ftp:
+                if attempt == 1 and remote_info and remote_info[0] is not None:
+                    size, mtime = remote_info
+                else:
+                    with _phase(progress, "listing"):
+                        size, mtime = remote_file_info(ftp, filename)
+                if progress:
+                    progress.set_total(size)
+                remote_meta = {"size": size, "mtime": mtime}
+                ranges = plan_segments(size, segments, min_segment_size)
+
+                def checkpoint(position):
+                    _write_meta(meta_path, dict(remote_meta, received=position))
+
+                if len(ranges) == 1:
+                    downloaded = offset = _resume_offset(part_path, _read_meta(meta_path), remote_meta)
+                    if offset:
+                        log(f"Retomando download de {filename} a partir de {offset} bytes.")
+                    else:
+                        checkpoint(0)
+                    if progress:
+                        progress.resume_from(offset)
+                    if hasher:
+                        hasher.reset(part_path, offset)
+                    if not offset or offset < size:
+                        downloaded = _retrieve(ftp, filename, part_path, offset, size, progress, hasher, checkpoint,
+                                               block_size, fsync_policy)
+
+            if len(ranges) > 1:
+                try:
+                    downloaded = _download_segments(
+                        lambda start, end, writer: _ftp_fetch_range(pool, ftp_path, filename, start, end, size, writer, progress),
+                        ranges, part_path, meta_path, remote_meta, log, progress, hasher, block_size, fsync_policy)
+                except RangeNotSupportedError:
+                    log(f"Servidor recusou REST; baixando {filename} em uma única conexão.", "warning")
+                    checkpoint(0)
+                    if progress:
+                        progress.resume_from(0)
+                    if hasher:
+                        hasher.reset()
+                    with pool.connection(ftp_path) as ftp:
+                        downloaded = _retrieve(ftp, filename, part_path, 0, size, progress, hasher, checkpoint,
+                                               block_size, fsync_policy)
+
+            # O .part é pré-alocado: o tamanho do arquivo não indica quanto foi recebido
+            if size is not None and downloaded != size:
+                raise IncompleteDownloadError(f"{filename}: {downloaded} de {size} bytes recebidos.")
+            _fsync(part_path, progress, fsync_policy)
+            with disk_write(save_path):
+                os.replace(part_path, save_path)
+            _remove_quietly(meta_path)
+            return save_path
+        except DiskWriteError:
+            raise  # Disco cheio ou sem permissão: outra tentativa falharia do mesmo jeito
+        except (IncompleteDownloadError, *all_errors) as e:
+            if attempt == attempts or (isinstance(e, error_perm) and str(e).startswith("550")):
+                raise
+            log(f"Download de {filename} interrompido ({e}). Nova tentativa {attempt + 1}/{attempts}...", "warning")
+            time.sleep(RETRY_DELAY * attempt)
+
+
+def _http_total_size(response):
+    """Extrai o tamanho total do cabeçalho Content-Range de uma resposta 206."""
+    content_range = response.headers.get("Content-Range", "")
+    total = content_range.rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def _identity_encoded(response):
+    return response.headers.get("Content-Encoding", "identity").lower() == "identity"
+
+
+def _http_content_length(response):
+    """Tamanho do corpo segundo o Content-Length, ou None se ausente, inválido ou com compressão de transporte."""
+    length = response.headers.get("Content-Length", "")
+    return int(length) if length.isdigit() and _identity_encoded(response) else None
+
+
+def _http_copy(response, writer, limit=None):
+    """Copia o corpo da resposta (no máximo limit bytes) para writer; retorna quantos bytes foram copiados.
+
+    Sem compressão de transporte, o corpo é lido direto no buffer do writer.
+    """
+    copied = 0
+    if _identity_encoded(response):
+        while limit is None or copied < limit:
+            count = writer.fill(response.raw.readinto, None if limit is None else limit - copied)
+            if not count:
+                break
+            copied += count
+        return copied
+    for chunk in response.iter_content(chunk_size=RECEIVE_CHUNK):
+        if limit is not None:
+            chunk = chunk[:limit - copied]
+        writer.write(chunk)
+        copied += len(chunk)
+        if limit is not None and copied >= limit:
+            break
+    return copied
+
+
+def _http_fetch_range(session, url, start, end, writer, timeout):
+    with span("http.faixa", "http", url=url, start=start, end=end), session.get(url, headers={"Range": f"bytes={start}-{end - 1}"}, stream=True, timeout=timeout) as response:
+        if response.status_code != 206:
+            raise RangeNotSupportedError(f"HTTP {response.status_code} para requisição parcial.")
+        if _http_copy(response, writer, end - start) < end - start:
+            raise IncompleteDownloadError(f"{url}: faixa {start}-{end} interrompida.")
+
+
+def _http_stream(response, part_path, progress=None, hasher=None, block_size=WRITE_BLOCK_SIZE, fsync_policy=FSYNC_END):
+    """Grava a resposta inteira no .part, pré-alocado pelo Content-Length quando confiável."""
+    if progress:
+        progress.start_transfer()
+    if hasher:
+        hasher.reset()
+    size = _http_content_length(response)
+    with open_part(part_path, 0, size) as f:
+        writer = BlockWriter(f, 0, block_size, fsync_policy, progress, hasher, expected=size)
+        try:
+            _http_copy(response, writer)
+        finally:
+            written = writer.close()
+    if size is not None and written != size:
+        raise IncompleteDownloadError(f"{response.url}: {written} de {size} bytes recebidos.")
+
+
+def download_http(session, url, save_path, segments=1, min_segment_size=MIN_SEGMENT_SIZE, timeout=30,
+                  cache=None, log=None, progress=None, hasher=None, block_size=WRITE_BLOCK_SIZE, fsync_policy=FSYNC_END):
+    """Baixa uma URL via .part, usando requisições Range paralelas quando o servidor as aceita.
+
+    A primeira requisição pede apenas o byte 0: uma resposta 206 revela o tamanho total e habilita
+    os segmentos; qualquer outra resposta é o próprio arquivo completo, gravado em fluxo único.
+    Com um HTTPMetadataCache, a requisição é condicional e uma resposta 304 mantém a cópia local.
+    Retorna False quando o arquivo local já estava atualizado e nada foi transferido.
+    Uma resposta 503 com Retry-After levanta RetryLaterError, sem tocar no .part.
+    Um StreamingHasher em hasher recebe os blocos à medida que são gravados.
+    block_size e fsync_policy configuram a gravação (ver block_writer).
+    """
+    log = log or _default_log
+    part_path = save_path + PART_SUFFIX
+    meta_path = save_path + META_SUFFIX
+    headers = cache.conditional_headers(url, save_path) if cache else {}
+    if segments > 1:
+        headers["Range"] = "bytes=0-0"
+    with span("http.get", "http", url=url), _phase(progress, "connect"):
+        response = session.get(url, headers=headers, stream=True, timeout=timeout)
+    with response:
+        if response.status_code == 304:
+            log(f"{os.path.basename(save_path)} não mudou no servidor; usando a cópia local.")
+            return False
+        retry_after = response.headers.get("Retry-After", "")
+        if response.status_code == 503 and retry_after.isdigit():
+            raise RetryLaterError(f"{url}: servidor pediu nova tentativa em {retry_after}s.", int(retry_after))
+        response.raise_for_status()
+        size = _http_total_size(response) if response.status_code == 206 else None
+        if progress:
+            progress.set_total(size or _http_content_length(response))
+        if response.status_code != 206:
+            _http_stream(response, part_path, progress, hasher, block_size, fsync_policy)
+        response_headers = response.headers
+        validator = response_headers.get("ETag") or response_headers.get("Last-Modified")
+
+    if size is not None:
+        ranges = plan_segments(size, segments, min_segment_size)
+        remote_meta = {"size": size, "mtime": validator}
+        try:
+            downloaded = _download_segments(
+                lambda start, end, writer: _http_fetch_range(session, url, start, end, writer, timeout),
+                ranges, part_path, meta_path, remote_meta, log, progress, hasher, block_size, fsync_policy)
+        except RangeNotSupportedError:
+            log(f"Servidor recusou requisições parciais; baixando {os.path.basename(save_path)} em fluxo único.", "warning")
+            if progress:
+                progress.resume_from(0)
+            with session.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                _http_stream(response, part_path, progress, hasher, block_size, fsync_policy)
+                response_headers = response.headers
+            size = None
+        if size is not None and downloaded != size:
+            raise IncompleteDownloadError(f"{url}: {downloaded} de {size} bytes recebidos.")
+
+    _fsync(part_path, progress, fsync_policy)
+    os.replace(part_path, save_path)
+    _remove_quietly(meta_path)
+    if cache:
+        cache.store(url, save_path, response_headers)
+    return True
+
+
+def copy_local(source_path, save_path, progress=None, hasher=None, block_size=WRITE_BLOCK_SIZE, fsync_policy=FSYNC_END):
+    """Copia um arquivo de uma pasta local ou compartilhada via .part, preservando a data de modificação.
+
+    Retorna False sem copiar se o destino já tem o mesmo tamanho e data da origem.
+    """
+    stat = os.stat(source_path)
+    try:
+        current = os.stat(save_path)
+        if current.st_size == stat.st_size and current.st_mtime_ns == stat.st_mtime_ns:
+            return False
+    except OSError:
+        pass
+    part_path = save_path + PART_SUFFIX
+    if progress:
+        progress.set_total(stat.st_size)
+        progress.start_transfer()
+    if hasher:
+        hasher.reset()
+    with open(source_path, 'rb') as src, open_part(part_path, 0, stat.st_size) as f:
+        writer = BlockWriter(f, 0, block_size, fsync_policy, progress, hasher, expected=stat.st_size)
+        try:
+            while writer.fill(src.readinto):
+                pass
+        finally:
+            copied = writer.close()
+    if copied != stat.st_size:
+        raise IncompleteDownloadError(f"{source_path}: cópia incompleta.")
+    _fsync(part_path, progress, fsync_policy)
+    os.utime(part_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(part_path, save_path)
+    return True
@@ -0,0 +1,102 @@
+"""Extração de arquivos zip em paralelo, com leitura em blocos grandes e reaproveitamento de membros já extraídos."""
+import os
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import span
+
+EXTRACT_BUFFER_SIZE = 1024 * 1024  # Bloco usado ao copiar cada membro para o disco
+EXTRACT_WORKERS = 4  # Membros descompactados simultaneamente (o zlib libera o GIL)
+
+
+def _file_crc(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(EXTRACT_BUFFER_SIZE)
+            if not block:
+                return crc
+            crc = zlib.crc32(block, crc)
+
+
+def is_extracted(info, target):
+    """Indica se target já é uma cópia idêntica do membro (mesmo tamanho e CRC)."""
+    try:
+        return os.path.getsize(target) == info.file_size and _file_crc(target) == info.CRC
+    except OSError:
+        return False
+
+
+def _target_path(dest_dir, name):
+    """Caminho de destino do membro, recusando nomes que escapem de dest_dir."""
+    root = os.path.realpath(dest_dir)
+    target = os.path.realpath(os.path.join(root, *name.replace("\\", "/").split("/")))
+    if os.path.commonpath([root, target]) != root:
+        raise ValueError(f"Membro com caminho inválido no zip: {name}")
+    return target
+
+
+def extract_zip(zip_path, dest_dir, workers=EXTRACT_WORKERS, progress=None, on_member=None):
+    """Extrai zip_path em dest_dir, descompactando membros em paralelo.
+
+    Membros cujo arquivo de destino já tem o mesmo tamanho e CRC são pulados. progress (TransferProgress)
+    recebe os bytes descompactados; on_member(nome, concluídos, total, pulado) é chamado a cada membro.
+    Retorna {"extracted": n, "skipped": n, "bytes": n}.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [info for info in zf.infolist() if not info.is_dir()]
+        for info in zf.infolist():
+            if info.is_dir():
+                os.makedirs(_target_path(dest_dir, info.filename), exist_ok=True)
+    if progress:
+        progress.set_total(sum(info.file_size for info in members))
+        progress.start_transfer()
+
+    local = threading.local()  # Cada thread mantém seu próprio handle do zip
+    handles = []
+    lock = threading.Lock()
+    summary = {"extracted": 0, "skipped": 0, "bytes": 0}
+
+    def handle():
+        if not hasattr(local, "zf"):
+            local.zf = zipfile.ZipFile(zip_path)
+            with lock:
+                handles.append(local.zf)
+        return local.zf
+
+    def extract_member(info):
+        target = _target_path(dest_dir, info.filename)
+        skipped = is_extracted(info, target)
+        if skipped:
+            if progress:
+                progress.add(info.file_size)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with span("zip.membro", "zip", member=info.filename, bytes=info.file_size), \
+                    handle().open(info) as src, open(target, 'wb') as dst:
+                while True:
+                    block = src.read(EXTRACT_BUFFER_SIZE)
+                    if not block:
+                        break
+                    dst.write(block)
+                    if progress:
+                        progress.add(len(block))
+        with lock:
+            summary["skipped" if skipped else "extracted"] += 1
+            summary["bytes"] += info.file_size
+            done = summary["skipped"] + summary["extracted"]
+        if on_member:
+            on_member(info.filename, done, len(members), skipped)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="extracao") as executor:
+            # Os maiores primeiro, para que o último membro não fique sozinho no fim
+            for future in [executor.submit(extract_member, info)
+                           for info in sorted(members, key=lambda i: i.file_size, reverse=True)]:
+                future.result()
+    finally:
+        for zf in handles:
+            zf.close()
+    return summary
@@ -0,0 +1,200 @@
+"""Pool de conexões FTP e cache de listagens compartilhados entre as verificações e os downloads."""
+import socket
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from ftplib import FTP, all_errors
+
+from remote_index import list_entries
+from tracing import span
+
+
+CANCEL_POLL_INTERVAL = 0.2  # Intervalo entre checagens de cancelamento enquanto se aguarda uma conexão livre
+
+
+def _phase(progress, name):
+    return progress.phase(name) if progress else nullcontext()
+
+
+def _abort(ftp):
+    """Derruba a conexão de controle, interrompendo o comando bloqueado em outra thread."""
+    sock = ftp.sock
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class FTPPool:
+    """Mantém um número limitado de conexões FTP já autenticadas para reutilização entre threads."""
+    def __init__(self, host, port=21, max_connections=2, timeout=30, idle_timeout=60, probe_after=15):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout  # Conexões ociosas por mais tempo que isso são descartadas
+        self.probe_after = probe_after  # Conexões ociosas por mais tempo que isso recebem um NOOP antes do uso
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle = []  # Lista de (ftp, instante da última utilização)
+        self._cwd = {}  # Diretório atual de cada conexão, para evitar CWDs repetidos (protegido por _lock)
+        self._retired = set()  # Conexões que devem ser encerradas em vez de voltar ao pool (protegido por _lock)
+        self.handshakes = 0
+
+    def _connect(self, progress=None):
+        ftp = FTP()
+        with span("ftp.conexao", "ftp", host=self.host), _phase(progress, "connect"):
+            ftp.connect(self.host, self.port, timeout=self.timeout)
+        with span("ftp.login", "ftp", host=self.host), _phase(progress, "login"):
+            ftp.login()  # Login anônimo
+        with self._lock:
+            self.handshakes += 1
+        return ftp
+
+    def _close(self, ftp):
+        with self._lock:
+            self._cwd.pop(ftp, None)
+            self._retired.discard(ftp)
+        try:
+            ftp.quit()
+        except Exception:
+            try:
+                ftp.close()
+            except Exception:
+                pass
+
+    def _take_idle(self, path=None):
+        """Retorna uma conexão ociosa ainda válida, descartando as expiradas.
+
+        Dá preferência a uma conexão já posicionada em path, para que downloads seguidos do mesmo
+        diretório usem a mesma sessão, sem novo CWD.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                index = next((i for i in range(len(self._idle) - 1, -1, -1)
+                              if self._cwd.get(self._idle[i][0]) == path), -1)
+                ftp, last_used = self._idle.pop(index)
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.idle_timeout:
+                self._close(ftp)
+                continue
+            if idle_for > self.probe_after:
+                try:
+                    ftp.voidcmd("NOOP")
+                except all_errors:
+                    self._close(ftp)
+                    continue
+            return ftp
+
+    @contextmanager
+    def connection(self, path=None, progress=None, cancel=None):
+        """Empresta uma conexão do pool, opcionalmente já posicionada no diretório informado.
+
+        A conexão volta ao pool ao final do bloco; se ocorrer qualquer erro ela é descartada,
+        pois seu estado no servidor passa a ser desconhecido. Com um TransferProgress, o tempo
+        gasto em connect, login e cwd é registrado nas fases correspondentes. Com um CancelToken
+        (ver orchestrator), o cancelamento derruba a conexão emprestada e interrompe a espera por uma.
+        """
+        with span("ftp.aguarda_conexao", "ftp", path=path):
+            if cancel is None:
+                self._slots.acquire()
+            else:
+                while not self._slots.acquire(timeout=CANCEL_POLL_INTERVAL):
+                    cancel.check()
+        ftp = None
+        try:
+            ftp = self._take_idle(path) or self._connect(progress)
+            with cancel.aborting(lambda: _abort(ftp)) if cancel else nullcontext():
+                with self._lock:
+                    current = self._cwd.get(ftp)
+                if path and current != path:
+                    with span("ftp.cwd", "ftp", path=path), _phase(progress, "cwd"):
+                        ftp.cwd(path)
+                    with self._lock:
+                        self._cwd[ftp] = path
+                yield ftp
+        except BaseException:
+            if ftp is not None:
+                self._close(ftp)
+                ftp = None
+            raise
+        finally:
+            if ftp is not None:
+                with self._lock:
+                    retired = ftp in self._retired
+                    if not retired:
+                        self._idle.append((ftp, time.monotonic()))
+                if retired:
+                    self._close(ftp)
+            self._slots.release()
+
+    def retire(self, ftp):
+        """Marca uma conexão emprestada para ser encerrada ao ser devolvida (ex.: transferência abandonada)."""
+        with self._lock:
+            self._retired.add(ftp)
+
+    def close_all(self):
+        """Encerra todas as conexões ociosas."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ftp, _ in idle:
+            self._close(ftp)
+
+
+class ListingCache:
+    """Cache por diretório das listagens do FTP, com validade (TTL) configurável.
+
+    Verificações simultâneas do mesmo diretório (ex.: SIA e BDSIA) aguardam uma única listagem.
+    """
+    def __init__(self, pool, ttl=300):
+        self.pool = pool
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # path -> (instante da listagem, entradas do diretório)
+        self._path_locks = {}
+
+    def _path_lock(self, path):
+        with self._lock:
+            return self._path_locks.setdefault(path, threading.Lock())
+
+    def _fresh(self, path):
+        entry = self._entries.get(path)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return list(entry[1])
+        return None
+
+    def peek(self, path):
+        """Retorna as entradas em cache ainda válidas, sem acessar o servidor, ou None."""
+        return self._fresh(path)
+
+    def entries(self, path, cancel=None):
+        """Retorna {"name", "size", "modify"} de cada arquivo do diretório (MLSD, ou LIST como alternativa).
+
+        O servidor só é consultado se a listagem em cache expirou. cancel: ver FTPPool.connection.
+        """
+        entries = self._fresh(path)
+        if entries is not None:
+            return entries
+        with self._path_lock(path):
+            entries = self._fresh(path)
+            if entries is not None:
+                return entries
+            with self.pool.connection(path, cancel=cancel) as ftp, span("ftp.listagem", "ftp", path=path):
+                entries = list_entries(ftp)
+            with self._lock:
+                self._entries[path] = (time.monotonic(), entries)
+            return list(entries)
+
+    def list(self, path):
+        """Retorna os nomes de arquivos do diretório, listando no servidor apenas se o cache expirou."""
+        return [entry["name"] for entry in self.entries(path)]
+
+    def invalidate(self, path=None):
+        """Descarta a listagem de um diretório, ou de todos se nenhum for informado."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
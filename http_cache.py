@@ -0,0 +1,75 @@
+"""Sessão HTTP compartilhada e cache persistente de metadados (ETag, Last-Modified) dos downloads."""
+import json
+import os
+import threading
+
+HTTP_POOL_SIZE = 8  # Conexões keep-alive mantidas por host
+
+
+def create_session():
+    """Cria uma sessão com pool de conexões keep-alive, reutilizada por todos os downloads HTTP.
+
+    O requests é importado aqui, e não no carregamento do módulo, por ser a dependência mais lenta de carregar.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HTTPMetadataCache:
+    """Guarda, por URL, os validadores do último download para permitir requisições condicionais."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def conditional_headers(self, url, save_path):
+        """Retorna If-None-Match/If-Modified-Since se a cópia local ainda corresponde ao último download."""
+        with self._lock:
+            entry = self._entries.get(url)
+        if not entry or entry.get("path") != os.path.abspath(save_path):
+            return {}
+        try:
+            if os.path.getsize(save_path) != entry.get("content_length"):
+                return {}
+        except OSError:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, save_path, response_headers):
+        """Registra os validadores do download concluído em save_path."""
+        entry = {
+            "etag": response_headers.get("ETag"),
+            "last_modified": response_headers.get("Last-Modified"),
+            "content_length": os.path.getsize(save_path),
+            "path": os.path.abspath(save_path),
+        }
+        with self._lock:
+            self._entries[url] = entry
+            try:
+                self._save()
+            except OSError:
+                pass  # Sem cache persistente o download apenas não será condicional na próxima vez
@@ -1,45 +1,47 @@
+import time
+STARTUP_STARTED = time.perf_counter()  # Referência do relatório de tempo de inicialização
+
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import os
-import re
+import sys
 from datetime import datetime
 import logging
 import threading
 import queue
-from ftplib import FTP, error_perm
-import webbrowser
-import subprocess
-import requests
-
-# --- Configurações Globais ---
-FTP_SERVER = "arpoador.datasus.gov.br"
-FTP_PATH_BPA = "/siasus/BPA/"
-FTP_PATH_SIA = "/siasus/sia/"
-FTP_PATH_FPO = "/siasus/fpo/"
-
-# Diretórios padrão de instalação
-DIR_BPA = "C:\\BPA"
-DIR_FPO = "C:\\FPO"
-DIR_SIA = "C:\\INSTSIA"
-DIR_CNES = "C:\\CNES"
-
-# Arquivos para controle de versão local
-VERSION_FILE_BPA = os.path.join(DIR_BPA, "versao.txt")
-VERSION_FILE_SIA = os.path.join(DIR_SIA, "versao.txt")
-VERSION_FILE_FPO = os.path.join(DIR_FPO, "versao.txt")
-
-# --- Configuração do Log de Atividades ---
-logging.basicConfig(
-    filename='log_automatizador_datasus.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    encoding='utf-8'
+from core import (
+    Engine, configure_logging, load_settings, save_settings, write_options, STATUS_UPDATED, STATUS_NOT_INSTALLED,
+    FTP_PATH_SIA, DIR_BPA, DIR_FPO, DIR_SIA, DIR_CNES,
+    CNES_URL, CNES_FILENAME, FIREBIRD_URL, FIREBIRD_FILENAME, CHECK_TIMEOUTS, STATUS_SNAPSHOT_FILE,
+    BACKUP_DIR, BACKUP_DIRECTORIES, PREFETCH_DIR, TRACE_FILE, OUTCOME_SKIPPED,
 )
+from orchestrator import CheckOrchestrator, OUTCOME_OK, OUTCOME_ERROR
+from progress import format_bytes
+from poller import StatusSnapshot, UpdatePoller, POLL_INTERVAL, format_age
+from prefetch import Prefetcher, PREFETCH_WINDOW, PREFETCH_RATE_LIMIT_KB
+from tracing import record, span, start_tracing, stop_tracing, traced, tracing_enabled
+from scheduler import DownloadScheduler, TransferCancelled, download_priority, MAX_CONCURRENT_DOWNLOADS, PRIORITY_INSTALLER
+
+# --- Configurações da Interface ---
+QUEUE_TICK_MS = 50  # Intervalo entre as execuções da fila de tarefas da interface
+QUEUE_TIME_BUDGET = 0.03  # Tempo máximo, em segundos, gasto executando tarefas em cada ciclo da fila
+LOG_MAX_LINES = 2000  # Linhas mantidas na Central de Notificações; as mais antigas são descartadas
+TRANSFER_ROW_LINGER_MS = 15000  # Tempo que uma transferência encerrada continua visível no painel
+STARTUP_TIMING_FLAG = "--tempo-inicializacao"  # Registra no log quanto tempo cada etapa da abertura levou
+TRACE_FLAG = "--rastrear"  # Grava um trace (ver tracing.py) de toda a sessão, exportado ao fechar
+TRACE_SAMPLE_FLAG = "--rastrear-amostras"  # Inclui amostras das pilhas de todas as threads (flamegraph)
+TRACE_MEMORY_FLAG = "--rastrear-memoria"  # Inclui a memória alocada (tracemalloc)
+TK_STALL_THRESHOLD = 0.1  # Atraso, em segundos, da fila da interface registrado como bloqueio da thread do Tk
+HEAVY_MODULES = ("requests", "ftplib", "ssl", "zipfile", "subprocess", "webbrowser")  # Carregados só quando usados
+
+IMPORTS_DONE = time.perf_counter()
 
 class App(tk.Tk):
     """Classe principal da aplicação com a interface gráfica."""
-    def __init__(self):
+    def __init__(self, report_startup=False):
         super().__init__()
+        self.report_startup = report_startup
+        self.startup_marks = [("importações", IMPORTS_DONE - STARTUP_STARTED)]
         self.title("Automatizador de Faturamento DATASUS (BPA, SIA, FPO, CNES)")
         self.geometry("850x750")
 
@@ -51,36 +53,140 @@ class App(tk.Tk):
         self.style.configure("Success.TButton", foreground="green", font=('Helvetica', 10, 'bold'))
 
         self.update_queue = queue.Queue()
+        self._queue_due_ns = None  # Instante previsto da próxima execução da fila, para medir bloqueios do Tk
+        self.pending_log_lines = queue.SimpleQueue()  # Linhas aguardando inserção na Central de Notificações
+        self.settings = load_settings()
+        self.engine = Engine(log=self.log, mirror_url=self.settings.get("espelho"), sources=self.settings.get("fontes"),
+                             write_options=write_options(self.settings),
+                             backup_dir=self.settings.get("pasta_backup", BACKUP_DIR),
+                             backup_before_install=self.settings.get("backup_antes_de_instalar", True))
+        self.scheduler = DownloadScheduler(
+            max_workers=self.settings.get("downloads_simultaneos", MAX_CONCURRENT_DOWNLOADS),
+            rate_limit=self.settings.get("limite_banda_kb", 0) * 1024,
+            per_transfer_limit=self.settings.get("limite_banda_por_download_kb", 0) * 1024,
+            on_change=lambda: self.update_queue.put(self.refresh_download_queue))
+        self.orchestrator = CheckOrchestrator(self.engine.product_checks(), timeouts=CHECK_TIMEOUTS)
+        self.check_results = {}
+        self.status_snapshot = StatusSnapshot(STATUS_SNAPSHOT_FILE)
+        self.prefetcher = None
+        if self.settings.get("pre_download", False):
+            self.prefetcher = Prefetcher(
+                self.engine, self.settings.get("pasta_pre_download", PREFETCH_DIR),
+                window=self.settings.get("janela_pre_download", PREFETCH_WINDOW),
+                rate_limit=self.settings.get("limite_banda_pre_download_kb", PREFETCH_RATE_LIMIT_KB) * 1024,
+                on_progress=self.report_progress)
+        self.poller = UpdatePoller(
+            self.orchestrator, self.status_snapshot,
+            interval=self.settings.get("intervalo_verificacao_min", POLL_INTERVAL // 60) * 60,
+            on_result=self.report_check_outcome,
+            on_round=self.on_poll_round,
+            next_interval=self.prefetcher.poll_interval if self.prefetcher else None)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
         self.create_widgets()
+        self.mark_startup("janela principal")
+        # Os painéis secundários, o snapshot e a verificação automática ficam para depois da primeira exibição
+        self.after_idle(self.finish_startup)
+
+    def finish_startup(self):
+        """Conclui a abertura depois que a janela principal já está visível."""
+        self.create_secondary_widgets()
+        self.mark_startup("painéis secundários")
+        # Só agora a fila da interface é processada: as tarefas enfileiradas antes (fila de downloads,
+        # progresso de transferências) usam os painéis secundários e aguardam em update_queue até aqui
         self.process_queue()
         self.log("Programa iniciado. Clique em 'Iniciar Verificação Geral' para começar.")
+        self.show_snapshot()
+        self.mark_startup("snapshot exibido")
+        self.poller.start()
+        if self.prefetcher:
+            self.prefetcher.start()
+        if self.report_startup:
+            self.log_startup_report()
+
+    def mark_startup(self, step):
+        self.startup_marks.append((step, time.perf_counter() - STARTUP_STARTED))
+
+    def log_startup_report(self):
+        """Registra o tempo de cada etapa da abertura e quais módulos pesados já foram carregados."""
+        steps = "; ".join(f"{step}: {elapsed * 1000:.0f} ms" for step, elapsed in self.startup_marks)
+        loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+        report = f"Tempo de inicialização - {steps}. Módulos pesados já carregados: {', '.join(loaded) or 'nenhum'}."
+        self.log(report)
+        print(report, file=sys.stderr)
 
     def log(self, message, level="info"):
-        """Registra uma mensagem na Central de Notificações e no arquivo de log."""
+        """Registra uma mensagem no arquivo de log e a enfileira para a Central de Notificações.
+
+        Pode ser chamado de qualquer thread; o widget só é alterado pela thread do Tk em flush_log.
+        """
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        formatted_message = f"[{timestamp}] {message}"
-        
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, formatted_message + "\n")
-        self.log_text.config(state=tk.DISABLED)
-        self.log_text.see(tk.END)
+        self.pending_log_lines.put(f"[{timestamp}] {message}")
         
         if level == "info": logging.info(message)
         elif level == "error": logging.error(message)
         elif level == "warning": logging.warning(message)
 
+    def flush_log(self):
+        """Insere de uma só vez as linhas de log pendentes, mantendo no máximo LOG_MAX_LINES no widget."""
+        if not hasattr(self, "log_text"):
+            return  # A Central de Notificações ainda não foi criada; as linhas aguardam na fila
+        lines = []
+        while True:
+            try:
+                lines.append(self.pending_log_lines.get_nowait())
+            except queue.Empty:
+                break
+        if not lines:
+            return
+
+        self.log_text.config(state=tk.NORMAL)
+        self.log_text.insert(tk.END, "\n".join(lines[-LOG_MAX_LINES:]) + "\n")
+        excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+        if excess > 0:
+            self.log_text.delete("1.0", f"{excess + 1}.0")
+        self.log_text.config(state=tk.DISABLED)
+        self.log_text.see(tk.END)
+
+    def on_close(self):
+        """Encerra as conexões FTP abertas antes de fechar a janela."""
+        self.poller.stop()
+        if self.prefetcher:
+            self.prefetcher.stop()
+        self.orchestrator.shutdown()
+        self.scheduler.shutdown()
+        self.engine.close()
+        for path in stop_tracing():
+            logging.info(f"Rastreamento gravado em {os.path.abspath(path)}")
+        self.destroy()
+
     def process_queue(self):
-        """Verifica a fila de tarefas e atualiza a GUI de forma segura."""
+        """Executa as tarefas pendentes da interface, dentro de um limite de tempo por ciclo.
+
+        Com o rastreamento ligado, cada tarefa é um span, e um atraso da fila acima de TK_STALL_THRESHOLD
+        (a thread do Tk ocupada com outra coisa) é registrado como tk.bloqueio.
+        """
+        started = time.perf_counter_ns()
+        if tracing_enabled() and self._queue_due_ns and started - self._queue_due_ns > TK_STALL_THRESHOLD * 1e9:
+            record("tk.bloqueio", "tk", self._queue_due_ns, started - self._queue_due_ns)
+        deadline = time.monotonic() + QUEUE_TIME_BUDGET
         try:
-            task = self.update_queue.get_nowait()
-            task()
-        except queue.Empty:
-            pass
+            while time.monotonic() < deadline:
+                try:
+                    task = self.update_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    with span("tk.tarefa", "tk", task=getattr(task, "__qualname__", None)):
+                        task()
+                except Exception as e:
+                    logging.error(f"Erro ao atualizar a interface: {e}")
+            self.flush_log()
         finally:
-            self.after(100, self.process_queue)
+            self._queue_due_ns = time.perf_counter_ns() + QUEUE_TICK_MS * 1_000_000
+            self.after(QUEUE_TICK_MS, self.process_queue)
 
     def create_widgets(self):
-        """Cria todos os componentes visuais da interface."""
+        """Cria o menu, o botão de verificação e o dashboard de status."""
         # --- Menu Superior ---
         menubar = tk.Menu(self)
         self.config(menu=menubar)
@@ -101,6 +207,17 @@ class App(tk.Tk):
         firebird_menu.add_command(label="Shutdown (Parar Serviço)", command=lambda: self.start_thread(self.stop_firebird_service))
         menubar.add_cascade(label="Firebird", menu=firebird_menu)
 
+        # Menu de Downloads
+        downloads_menu = tk.Menu(menubar, tearoff=0)
+        downloads_menu.add_command(label="Limites de Banda...", command=self.configure_download_limits)
+        menubar.add_cascade(label="Downloads", menu=downloads_menu)
+
+        # Menu de Backup
+        backup_menu = tk.Menu(menubar, tearoff=0)
+        backup_menu.add_command(label="Fazer Backup Agora", command=self.backup_now)
+        backup_menu.add_command(label="Restaurar Backup...", command=self.show_backups)
+        menubar.add_cascade(label="Backup", menu=backup_menu)
+
         # Menu de Avisos
         menubar.add_command(label="Avisos Importantes", command=self.show_warnings)
 
@@ -119,6 +236,9 @@ class App(tk.Tk):
         start_button_frame.pack(fill=tk.X, pady=10)
         self.start_button = ttk.Button(start_button_frame, text="▶ Iniciar Verificação Geral", command=self.initial_setup, style="Success.TButton")
         self.start_button.pack(pady=5)
+        ttk.Button(start_button_frame, text="⟳ Atualizar Tudo", command=self.update_everything).pack(pady=(0, 5))
+        self.last_check_var = tk.StringVar(value="Nenhuma verificação anterior registrada.")
+        ttk.Label(start_button_frame, textvariable=self.last_check_var, foreground="gray").pack()
 
         # --- Seção do Dashboard de Status ---
         dashboard_frame = ttk.LabelFrame(main_frame, text="Dashboard de Status", padding="10")
@@ -161,6 +281,18 @@ class App(tk.Tk):
         self.cnes_action_button.grid(row=3, column=2, padx=5, pady=2)
         ttk.Button(dashboard_frame, text="Abrir Pasta", command=lambda: self.open_directory(DIR_CNES)).grid(row=3, column=3, padx=5, pady=2)
 
+        self.installer_rows = {
+            "bpa": (self.bpa_status_var, self.bpa_status_display, self.bpa_action_button),
+            "sia": (self.sia_status_var, self.sia_status_display, self.sia_action_button),
+            "fpo": (self.fpo_status_var, self.fpo_status_display, self.fpo_action_button),
+        }
+
+        self.main_frame = main_frame
+
+    def create_secondary_widgets(self):
+        """Cria os painéis abaixo do dashboard (BDSIA, transferências, fila, log), após a janela aparecer."""
+        main_frame = self.main_frame
+
         # --- Seção do BDSIA ---
         bdsia_frame = ttk.LabelFrame(main_frame, text="Download do BDSIA (Tabela Unificada)", padding="10")
         bdsia_frame.pack(fill=tk.X, expand=False, pady=10)
@@ -176,6 +308,29 @@ class App(tk.Tk):
             self.bdsia_labels.append(label)
             self.bdsia_buttons.append(button)
         
+        # --- Seção de Transferências ---
+        self.transfers_frame = ttk.LabelFrame(main_frame, text="Transferências", padding="10")
+        self.transfers_frame.pack(fill=tk.X, expand=False, pady=5)
+        self.transfers_frame.grid_columnconfigure(2, weight=1)
+        self.transfers_placeholder = ttk.Label(self.transfers_frame, text="Nenhuma transferência em andamento.", foreground="gray")
+        self.transfers_placeholder.grid(row=0, column=0, sticky="w", padx=5)
+        self.transfer_rows = {}
+        self.transfer_row_count = 0
+
+        # --- Seção da Fila de Downloads ---
+        queue_frame = ttk.LabelFrame(main_frame, text="Fila de Downloads", padding="10")
+        queue_frame.pack(fill=tk.X, expand=False, pady=5)
+        self.download_queue_view = ttk.Treeview(queue_frame, columns=("arquivo", "situacao"), show="headings", height=3)
+        self.download_queue_view.heading("arquivo", text="Arquivo")
+        self.download_queue_view.heading("situacao", text="Situação")
+        self.download_queue_view.column("situacao", width=120, stretch=False)
+        self.download_queue_view.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        queue_buttons = ttk.Frame(queue_frame)
+        queue_buttons.pack(side=tk.RIGHT, padx=5)
+        ttk.Button(queue_buttons, text="▲ Subir", command=lambda: self.move_selected_download(-1)).pack(fill=tk.X)
+        ttk.Button(queue_buttons, text="▼ Descer", command=lambda: self.move_selected_download(1)).pack(fill=tk.X)
+        ttk.Button(queue_buttons, text="Cancelar", command=self.cancel_selected_download).pack(fill=tk.X)
+
         # --- Seção da Central de Notificações ---
         log_frame = ttk.LabelFrame(main_frame, text="Central de Notificações e Log de Atividades", padding="10")
         log_frame.pack(fill=tk.BOTH, expand=True, pady=5)
@@ -194,50 +349,87 @@ class App(tk.Tk):
 
     def start_thread(self, target_function, *args):
         """Cria e inicia uma nova thread para executar tarefas demoradas."""
-        thread = threading.Thread(target=target_function, args=args)
+        thread = threading.Thread(target=traced(target_function), args=args, name=target_function.__name__)
         thread.daemon = True
         thread.start()
 
     def initial_setup(self):
-        """Executa as verificações e configurações iniciais."""
-        self.log("Iniciando verificação geral dos sistemas...")
+        """Executa as verificações e configurações iniciais.
+
+        Se uma verificação automática estiver em andamento, a rodada se junta a ela: o orquestrador
+        reaproveita as verificações já em curso em vez de repeti-las.
+        """
+        if self.orchestrator.busy:
+            self.log("Verificação automática em andamento; a verificação geral aproveitará os resultados dela.")
+        else:
+            self.log("Iniciando verificação geral dos sistemas...")
         self.start_button.config(state=tk.DISABLED, text="Verificando...")
         self.start_thread(self.ensure_folders_exist)
-        self.start_thread(self.check_bpa)
-        self.start_thread(self.check_sia)
-        self.start_thread(self.check_fpo)
-        self.start_thread(self.check_bdsia)
-        self.after(10000, lambda: self.start_button.config(state=tk.NORMAL, text="▶ Iniciar Verificação Geral"))
+        round_future = self.refresh_products()
+        round_future.add_done_callback(lambda f: self.update_queue.put(lambda: self.finish_check_round(f.result())))
+
+    def refresh_products(self, *names):
+        """Dispara as verificações indicadas (todas, por padrão); cada resultado é exibido assim que chega."""
+        return self.orchestrator.run(names or None, on_result=self.report_check_outcome)
+
+    def report_check_outcome(self, name, outcome):
+        """Encaminha, da thread do orquestrador, o resultado de uma verificação para o dashboard."""
+        self.update_queue.put(lambda: self.show_check_outcome(name, outcome))
+
+    def show_snapshot(self):
+        """Preenche o dashboard com o resultado da última verificação gravada, indicando sua idade."""
+        snapshot = self.status_snapshot.load()
+        if snapshot is None:
+            return
+        for name, result in snapshot["results"].items():
+            if name != "bdsia":
+                result = self.engine.apply_local_state(result)  # A versão instalada pode ter mudado desde então
+            self.show_check_outcome(name, {"status": OUTCOME_OK, "result": result})
+        oldest = min(snapshot["checked_at"].values())
+        self.last_check_var.set(f"Última verificação: {format_age(time.time() - oldest)} "
+                                f"({datetime.fromtimestamp(oldest).strftime('%d/%m %H:%M')}). Atualizando em segundo plano...")
+
+    def show_last_check(self):
+        self.last_check_var.set(f"Última verificação: agora ({datetime.now().strftime('%d/%m %H:%M')}).")
+
+    def on_poll_round(self, summary):
+        """Fim de uma verificação automática, na thread do orquestrador: alimenta o pré-download e a interface."""
+        if self.prefetcher:
+            self.prefetcher.offer(summary["outcomes"])
+        self.update_queue.put(lambda: self.finish_poll_round(summary))
+
+    def finish_poll_round(self, summary):
+        """Registra o fim de uma verificação automática."""
+        if any(outcome["status"] == OUTCOME_OK for outcome in summary["outcomes"].values()):
+            self.show_last_check()
+        else:
+            self.log(f"Servidor do DATASUS inacessível; nova verificação automática em {summary['next_poll']:.0f}s.", "warning")
+            self.last_check_var.set(self.last_check_var.get().replace("Atualizando em segundo plano...", "Servidor inacessível."))
+
+    def finish_check_round(self, summary):
+        """Reabilita a verificação geral assim que a última verificação da rodada termina."""
+        self.status_snapshot.record(summary["outcomes"])
+        if self.prefetcher:
+            self.prefetcher.offer(summary["outcomes"])
+        if any(outcome["status"] == OUTCOME_OK for outcome in summary["outcomes"].values()):
+            self.show_last_check()
+        failed = [name.upper() for name, outcome in summary["outcomes"].items() if outcome["status"] != OUTCOME_OK]
+        if failed:
+            self.log(f"Verificação geral concluída em {summary['elapsed']:.1f}s, com falha em: {', '.join(failed)}.", "warning")
+        else:
+            self.log(f"Verificação geral concluída em {summary['elapsed']:.1f}s.")
+        self.start_button.config(state=tk.NORMAL, text="▶ Iniciar Verificação Geral")
 
     def ensure_folders_exist(self):
         """Garante que os diretórios base e de exportação existam em C:\."""
         try:
-            paths_to_create = [
-                DIR_BPA, os.path.join(DIR_BPA, "EXPORTA"),
-                DIR_FPO, os.path.join(DIR_FPO, "EXPORTA"),
-                DIR_SIA, os.path.join(DIR_SIA, "IMPORTA"),
-                DIR_CNES
-            ]
-            for path in paths_to_create:
-                if not os.path.exists(path):
-                    os.makedirs(path)
-                    self.log(f"Diretório criado: {path}")
+            self.engine.ensure_folders_exist()
         except PermissionError:
             self.log("Erro de permissão ao criar pastas em C:\\. Execute como Administrador.", "error")
             self.update_queue.put(lambda: messagebox.showerror("Erro de Permissão", "Não foi possível criar as pastas necessárias em C:\\.\n\nPor favor, feche o programa e execute-o como Administrador."))
         except Exception as e:
             self.log(f"Erro inesperado ao criar diretórios: {e}", "error")
 
-    def get_local_version(self, file_path):
-        """Lê a versão salva localmente."""
-        try:
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return f.read().strip()
-        except Exception as e:
-            self.log(f"Erro ao ler arquivo de versão {file_path}: {e}", "error")
-        return None
-
     def set_status(self, label_var, display_widget, message, color, button, button_text=""):
         """Atualiza a label de status e o botão de ação."""
         label_var.set(message)
@@ -247,19 +439,6 @@ class App(tk.Tk):
         else:
             button.config(state=tk.DISABLED)
 
-    def list_ftp_files(self, ftp_path):
-        """Conecta ao FTP e lista os arquivos em um diretório."""
-        try:
-            ftp = FTP(FTP_SERVER, timeout=20)
-            ftp.login() # Login anônimo
-            ftp.cwd(ftp_path)
-            files = ftp.nlst()
-            ftp.quit()
-            return files
-        except Exception as e:
-            self.log(f"Falha ao conectar ou listar arquivos em {ftp_path}: {e}", "error")
-            return None
-
     def open_directory(self, path):
         """Abre um diretório no explorador de arquivos."""
         try:
@@ -278,7 +457,9 @@ class App(tk.Tk):
         warnings = (
             "1. Importante: não extrair o arquivo BDSIA com o programa SIA aberto.\n\n"
             "2. Lembre-se de criar novas pastas da competência do mês.\n\n"
-            "3. Sempre que for lançar um novo BPA consolidado, colocar a folha com número alto para evitar duplicidade."
+            "3. Sempre que for lançar um novo BPA consolidado, colocar a folha com número alto para evitar duplicidade.\n\n"
+            "4. Antes de cada instalador ou atualização baixado, as pastas do BPA, SIA e FPO são copiadas para o backup. "
+            "Para voltar a uma versão anterior, use o menu Backup (com o programa e o Firebird parados)."
         )
         messagebox.showinfo("Avisos Importantes", warnings)
 
@@ -286,6 +467,7 @@ class App(tk.Tk):
         """Abre uma URL no navegador padrão."""
         try:
             self.log(f"Abrindo link: {url}")
+            import webbrowser
             webbrowser.open_new_tab(url)
         except Exception as e:
             self.log(f"Erro ao abrir o link {url}: {e}", "error")
@@ -306,148 +488,71 @@ class App(tk.Tk):
             self.log(f"Erro ao abrir o guia: {e}", "error")
             messagebox.showerror("Erro", f"Não foi possível abrir o guia:\n{e}")
 
-    # --- Lógica do BPA ---
-    def check_bpa(self):
-        try:
-            self.log("Verificando BPA no servidor FTP...")
-            files = self.list_ftp_files(FTP_PATH_BPA)
-            if files is None: raise ConnectionError("Não foi possível listar arquivos do BPA.")
+    def show_check_outcome(self, name, outcome):
+        """Exibe no dashboard o resultado (ou a falha) da verificação de um produto."""
+        if name == "bdsia":
+            if outcome["status"] == OUTCOME_OK:
+                self.check_results[name] = outcome["result"]
+                self.show_bdsia_versions(outcome["result"]["files"])
+            else:
+                self.log(f"Erro ao buscar versões do BDSIA: {outcome['error']}", "error")
+                for i in range(3):
+                    self.bdsia_labels[i].config(text="Erro ao buscar versões.")
+                    self.bdsia_buttons[i].config(state=tk.DISABLED)
+            return
 
-            bpa_files = [f for f in files if re.match(r'bpamag\d+\.exe', f, re.IGNORECASE)]
-            if not bpa_files: raise FileNotFoundError("Nenhum instalador 'bpamag*.exe' encontrado.")
-            
-            latest_bpa_file = sorted(bpa_files, reverse=True)[0]
-            self.latest_bpa_version = latest_bpa_file[:-4] # Remove .exe
-            
-            local_version = self.get_local_version(VERSION_FILE_BPA)
-            
-            def update_gui():
-                if local_version == self.latest_bpa_version:
-                    self.set_status(self.bpa_status_var, self.bpa_status_display, f"Instalado: {local_version} (Atualizado)", "green", self.bpa_action_button)
-                else:
-                    msg = f"Instalado: {local_version or 'Nenhum'}. Disponível: {self.latest_bpa_version}"
-                    self.set_status(self.bpa_status_var, self.bpa_status_display, msg, "orange", self.bpa_action_button, "Baixar BPA")
-                self.log(f"Verificação do BPA concluída. Versão online: {self.latest_bpa_version}")
-
-            self.update_queue.put(update_gui)
-        except Exception as e:
-            self.update_queue.put(lambda: self.set_status(self.bpa_status_var, self.bpa_status_display, "Erro na verificação", "red", self.bpa_action_button))
-            self.log(f"Erro ao verificar BPA: {e}", "error")
+        label_var, display_widget, button = self.installer_rows[name]
+        if outcome["status"] != OUTCOME_OK:
+            self.set_status(label_var, display_widget, "Erro na verificação", "red", button)
+            self.log(f"Erro ao verificar {name.upper()}: {outcome['error']}", "error")
+            return
 
+        result = outcome["result"]
+        self.check_results[name] = result
+        if result["status"] == STATUS_UPDATED:
+            self.set_status(label_var, display_widget, f"Instalado: {result['local_version']} (Atualizado)", "green", button)
+        elif result["status"] == STATUS_NOT_INSTALLED:
+            msg = "Não instalado. É preciso baixar o instalador primeiro."
+            self.set_status(label_var, display_widget, msg, "red", button, f"Baixar Instalador {name.upper()}")
+        else:
+            msg = f"Instalado: {result['local_version'] or 'Nenhum'}. Disponível: {result['latest_version']}"
+            button_text = "Baixar Atualização FPO" if name == "fpo" else f"Baixar {name.upper()}"
+            self.set_status(label_var, display_widget, msg, "orange", button, button_text)
+
+    def download_checked(self, product):
+        """Baixa o arquivo apontado pela última verificação do produto e verifica-o novamente ao final."""
+        result = self.check_results.get(product)
+        if not result or not result.get("file"):
+            messagebox.showerror("Erro", f"Não foi possível determinar o arquivo {product.upper()} para baixar. Tente verificar novamente.")
+            return
+        self.handle_ftp_download_request(result["dest_dir"], result["ftp_path"], result["file"], version_file=result["version_file"], version_str=result["target_version"], callback=lambda: self.refresh_products(product))
+
+    # --- Lógica do BPA ---
     def download_bpa(self):
-        filename = self.latest_bpa_version + ".exe"
-        self.handle_ftp_download_request(DIR_BPA, FTP_PATH_BPA, filename, version_file=VERSION_FILE_BPA, version_str=self.latest_bpa_version, callback=self.check_bpa)
+        self.download_checked("bpa")
 
     # --- Lógica do SIA ---
-    def check_sia(self):
-        try:
-            self.log("Verificando SIA no servidor FTP...")
-            files = self.list_ftp_files(FTP_PATH_SIA)
-            if files is None: raise ConnectionError("Não foi possível listar arquivos do SIA.")
-
-            sia_files = [f for f in files if re.match(r'instsia\d{4}\.exe', f, re.IGNORECASE)]
-            if not sia_files: raise FileNotFoundError("Nenhum instalador 'instsia*.exe' encontrado.")
-            
-            self.latest_sia_file = sorted(sia_files, reverse=True)[0]
-            self.latest_sia_version = self.latest_sia_file[:-4] # Remove .exe
-            
-            local_version = self.get_local_version(VERSION_FILE_SIA)
-
-            def update_gui():
-                if local_version == self.latest_sia_version:
-                    self.set_status(self.sia_status_var, self.sia_status_display, f"Instalado: {local_version} (Atualizado)", "green", self.sia_action_button)
-                else:
-                    msg = f"Instalado: {local_version or 'Nenhum'}. Disponível: {self.latest_sia_version}"
-                    self.set_status(self.sia_status_var, self.sia_status_display, msg, "orange", self.sia_action_button, "Baixar SIA")
-                self.log(f"Verificação do SIA concluída. Versão online: {self.latest_sia_version}")
-
-            self.update_queue.put(update_gui)
-        except Exception as e:
-            self.update_queue.put(lambda: self.set_status(self.sia_status_var, self.sia_status_display, "Erro na verificação", "red", self.sia_action_button))
-            self.log(f"Erro ao verificar SIA: {e}", "error")
-
     def download_sia(self):
-        self.handle_ftp_download_request(DIR_SIA, FTP_PATH_SIA, self.latest_sia_file, version_file=VERSION_FILE_SIA, version_str=self.latest_sia_version, callback=self.check_sia)
+        self.download_checked("sia")
 
     # --- Lógica do FPO ---
-    def check_fpo(self):
-        try:
-            self.log("Verificando FPO no servidor FTP...")
-            files = self.list_ftp_files(FTP_PATH_FPO)
-            if files is None: raise ConnectionError("Não foi possível listar arquivos do FPO.")
-
-            fpo_installers = [f for f in files if "instalador" in f.lower() and f.endswith('.exe')]
-            fpo_updates = [f for f in files if "instalador" not in f.lower() and f.endswith('.exe') and f.lower().startswith('fpo')]
-            
-            if not fpo_updates: raise FileNotFoundError("Nenhum arquivo de atualização do FPO encontrado.")
-            
-            self.fpo_installer_file = sorted(fpo_installers, reverse=True)[0] if fpo_installers else None
-            self.latest_fpo_update_file = sorted(fpo_updates, reverse=True)[0]
-            self.latest_fpo_version = self.latest_fpo_update_file[:-4]
-
-            local_version = self.get_local_version(VERSION_FILE_FPO)
-
-            def update_gui():
-                if not os.path.exists(DIR_FPO) or not local_version:
-                    msg = "Não instalado. É preciso baixar o instalador primeiro."
-                    self.set_status(self.fpo_status_var, self.fpo_status_display, msg, "red", self.fpo_action_button, "Baixar Instalador FPO")
-                    self.fpo_target_file = self.fpo_installer_file
-                    self.fpo_target_version = "Instalador Base"
-                elif local_version == self.latest_fpo_version:
-                    self.set_status(self.fpo_status_var, self.fpo_status_display, f"Instalado: {local_version} (Atualizado)", "green", self.fpo_action_button)
-                else:
-                    msg = f"Instalado: {local_version}. Disponível: {self.latest_fpo_version}"
-                    self.set_status(self.fpo_status_var, self.fpo_status_display, msg, "orange", self.fpo_action_button, "Baixar Atualização FPO")
-                    self.fpo_target_file = self.latest_fpo_update_file
-                    self.fpo_target_version = self.latest_fpo_version
-                self.log(f"Verificação do FPO concluída.")
-
-            self.update_queue.put(update_gui)
-        except Exception as e:
-            self.update_queue.put(lambda: self.set_status(self.fpo_status_var, self.fpo_status_display, "Erro na verificação", "red", self.fpo_action_button))
-            self.log(f"Erro ao verificar FPO: {e}", "error")
-
     def download_fpo(self):
-        if not hasattr(self, 'fpo_target_file') or not self.fpo_target_file:
-            messagebox.showerror("Erro", "Não foi possível determinar o arquivo FPO para baixar. Tente verificar novamente.")
-            return
-        self.handle_ftp_download_request(DIR_FPO, FTP_PATH_FPO, self.fpo_target_file, version_file=VERSION_FILE_FPO, version_str=self.fpo_target_version, callback=self.check_fpo)
+        self.download_checked("fpo")
 
     # --- Lógica do BDSIA ---
-    def check_bdsia(self):
-        try:
-            self.log("Listando versões do BDSIA...")
-            files = self.list_ftp_files(FTP_PATH_SIA)
-            if files is None: raise ConnectionError("Não foi possível listar arquivos do SIA/BDSIA.")
-            
-            bdsia_files = [f for f in files if re.match(r'BDSIA\d{6}[a-zA-Z]\.exe', f, re.IGNORECASE)]
-            top_3_bdsia = sorted(bdsia_files, reverse=True)[:3]
+    def show_bdsia_versions(self, top_3_bdsia):
+        for i in range(3):
+            if i < len(top_3_bdsia):
+                filename = top_3_bdsia[i]
+                self.bdsia_labels[i].config(text=filename)
+                self.bdsia_buttons[i].config(state=tk.NORMAL, command=lambda f=filename: self.handle_ftp_download_request(DIR_SIA, FTP_PATH_SIA, f))
+            else:
+                self.bdsia_labels[i].config(text="-"*20)
+                self.bdsia_buttons[i].config(state=tk.DISABLED, command=None)
 
-            def update_gui():
-                self.log(f"{len(top_3_bdsia)} versões recentes do BDSIA encontradas.")
-                for i in range(3):
-                    if i < len(top_3_bdsia):
-                        filename = top_3_bdsia[i]
-                        self.bdsia_labels[i].config(text=filename)
-                        self.bdsia_buttons[i].config(state=tk.NORMAL, command=lambda f=filename: self.handle_ftp_download_request(DIR_SIA, FTP_PATH_SIA, f))
-                    else:
-                        self.bdsia_labels[i].config(text="-"*20)
-                        self.bdsia_buttons[i].config(state=tk.DISABLED, command=None)
-
-            self.update_queue.put(update_gui)
-        except Exception as e:
-            self.log(f"Erro ao buscar versões do BDSIA: {e}", "error")
-            def clear_bdsia_gui():
-                for i in range(3):
-                    self.bdsia_labels[i].config(text="Erro ao buscar versões.")
-                    self.bdsia_buttons[i].config(state=tk.DISABLED)
-            self.update_queue.put(clear_bdsia_gui)
-    
     # --- Lógica do CNES ---
     def download_cnes(self):
-        url = "https://cnes.datasus.gov.br/EstatisticasServlet?path=SCNES4700-COMPLETA.ZIP"
-        filename = "SCNES4700-COMPLETA.ZIP"
-        self.handle_http_download_request(DIR_CNES, url, filename)
+        self.handle_http_download_request(DIR_CNES, CNES_URL, CNES_FILENAME)
 
     # --- Lógica do Firebird ---
     def check_firebird_version(self):
@@ -467,23 +572,23 @@ class App(tk.Tk):
             if not isql_path:
                 raise FileNotFoundError("O executável 'isql.exe' do Firebird não foi encontrado nos caminhos padrão.")
 
-            # Usar subprocess para obter a versão
+            # Usar subprocess para obter a versão (importado só aqui: o Firebird é usado raramente)
+            import subprocess
             result = subprocess.run([isql_path, "-z"], capture_output=True, text=True, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
             version_line = result.stdout.strip().splitlines()[0]
             self.log(f"Versão do Firebird encontrada: {version_line}")
             self.update_queue.put(lambda: messagebox.showinfo("Versão do Firebird", version_line))
         except Exception as e:
             self.log(f"Não foi possível verificar a versão do Firebird: {e}", "error")
-            self.update_queue.put(lambda: messagebox.showerror("Erro na Verificação", f"Não foi possível verificar a versão do Firebird.\nVerifique se ele está instalado ou se o programa tem permissão.\n\nErro: {e}"))
+            self.update_queue.put(lambda e=e: messagebox.showerror("Erro na Verificação", f"Não foi possível verificar a versão do Firebird.\nVerifique se ele está instalado ou se o programa tem permissão.\n\nErro: {e}"))
 
     def download_firebird(self):
-        url = "https://cnes.datasus.gov.br/EstatisticasServlet?path=INSTALADORFIREBIRD-155.ZIP"
-        filename = "INSTALADORFIREBIRD-155.ZIP"
         dest_dir = filedialog.askdirectory(title="Selecione uma pasta para salvar o instalador do Firebird")
         if dest_dir:
-            self.handle_http_download_request(dest_dir, url, filename)
+            self.handle_http_download_request(dest_dir, FIREBIRD_URL, FIREBIRD_FILENAME)
 
     def _manage_firebird_service(self, action):
+        import subprocess
         command = ["sc", action, "FirebirdServerDefaultInstance"]
         action_text = "iniciar" if action == "start" else "parar"
         self.log(f"Tentando {action_text} o serviço Firebird...")
@@ -509,7 +614,7 @@ class App(tk.Tk):
         except Exception as e:
             msg = f"Falha ao {action_text} o serviço Firebird. Tente executar o programa como Administrador."
             self.log(f"{msg}\nErro: {e}", "error")
-            self.update_queue.put(lambda: messagebox.showerror("Erro de Permissão", f"{msg}\n\nDetalhes: {e}"))
+            self.update_queue.put(lambda e=e: messagebox.showerror("Erro de Permissão", f"{msg}\n\nDetalhes: {e}"))
 
     def start_firebird_service(self):
         self._manage_firebird_service("start")
@@ -517,57 +622,271 @@ class App(tk.Tk):
     def stop_firebird_service(self):
         self._manage_firebird_service("stop")
 
+    # --- Backup ---
+    def backup_now(self):
+        """Inicia em segundo plano o backup das pastas de trabalho existentes."""
+        products = [name for name, directory in BACKUP_DIRECTORIES.items() if os.path.isdir(directory)]
+        if not products:
+            messagebox.showinfo("Backup", "Nenhuma pasta do BPA, SIA ou FPO encontrada.")
+            return
+        for product in products:
+            self.engine.backup_directory(product, "manual", on_progress=self.report_progress)  # O resultado vai para o log
+
+    def show_backups(self):
+        """Lista os snapshots guardados e restaura o escolhido na pasta original ou em outra pasta."""
+        backups = self.engine.list_backups()
+        if not backups:
+            messagebox.showinfo("Restaurar Backup", "Nenhum backup encontrado.")
+            return
+        window = tk.Toplevel(self)
+        window.title("Restaurar Backup")
+        window.transient(self)
+        view = ttk.Treeview(window, columns=("pasta", "competencia", "data", "motivo", "tamanho"), show="headings", height=12)
+        for column, title, width in (("pasta", "Pasta", 110), ("competencia", "Competência", 90), ("data", "Data", 140),
+                                     ("motivo", "Motivo", 220), ("tamanho", "Tamanho", 90)):
+            view.heading(column, text=title)
+            view.column(column, width=width)
+        for backup in backups:
+            view.insert("", tk.END, iid=backup["id"], values=(
+                backup["directory"], backup["competencia"], backup["created_at"].replace("T", " "), backup["reason"],
+                format_bytes(backup["size"])))
+        view.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        buttons = ttk.Frame(window)
+        buttons.pack(pady=(0, 10))
+        ttk.Button(buttons, text="Restaurar na Pasta Original", command=lambda: self.restore_selected_backup(view, False)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="Restaurar em Outra Pasta...", command=lambda: self.restore_selected_backup(view, True)).pack(side=tk.LEFT, padx=5)
+
+    def restore_selected_backup(self, view, choose_target):
+        """Confirma e executa em segundo plano a restauração do snapshot selecionado."""
+        selection = view.selection()
+        if not selection:
+            return
+        snapshot_id = selection[0]
+        directory = view.set(snapshot_id, "pasta")
+        if choose_target:
+            target = filedialog.askdirectory(title="Escolha onde restaurar o backup", parent=view.winfo_toplevel())
+            if not target:
+                return
+        else:
+            target = None
+            if not messagebox.askyesno("Restaurar Backup", f"Os arquivos de '{directory}' serão substituídos pelos do backup "
+                                       f"de {view.set(snapshot_id, 'data')}.\n\nFeche o BPA, o SIA e o FPO e pare o Firebird "
+                                       "antes de continuar. O estado atual da pasta será guardado em um novo backup.\n\n"
+                                       "Deseja continuar?", parent=view.winfo_toplevel()):
+                return
+        self.start_thread(self._restore_worker, snapshot_id, target or directory, target)
+
+    def _restore_worker(self, snapshot_id, shown_target, target):
+        """Worker da restauração de um backup."""
+        try:
+            count = self.engine.restore_backup(snapshot_id, target, on_progress=self.report_progress)
+            self.update_queue.put(lambda: messagebox.showinfo("Restaurar Backup", f"{count} arquivos restaurados em:\n{shown_target}"))
+            if target is None:
+                self.refresh_products()  # A versão instalada pode ter voltado
+        except Exception as e:
+            self.log(f"Falha ao restaurar o backup {snapshot_id}: {e}", "error")
+            self.update_queue.put(lambda e=e: messagebox.showerror("Restaurar Backup", f"Não foi possível restaurar o backup:\n{e}"))
+
     # --- Funções de Download ---
     def handle_ftp_download_request(self, dest_dir, ftp_path, filename, version_file=None, version_str=None, callback=None):
-        """Pede confirmação e inicia a thread de download FTP."""
+        """Pede confirmação e coloca o download FTP na fila."""
         save_path = os.path.join(dest_dir, filename)
         if messagebox.askyesno("Confirmação de Download", f"O arquivo '{filename}' será salvo em:\n'{dest_dir}'\n\nDeseja continuar?"):
-            self.start_thread(self._ftp_download_worker, ftp_path, filename, save_path, version_file, version_str, callback)
+            self.enqueue_download(filename, lambda limiter: self._ftp_download_worker(ftp_path, filename, save_path, version_file, version_str, callback, limiter))
         else:
             self.log(f"Download de {filename} cancelado pelo usuário.", "warning")
 
     def handle_http_download_request(self, dest_dir, url, filename, callback=None):
-        """Pede confirmação e inicia a thread de download HTTP."""
+        """Pede confirmação e coloca o download HTTP na fila."""
         save_path = os.path.join(dest_dir, filename)
         if messagebox.askyesno("Confirmação de Download", f"O arquivo '{filename}' será salvo em:\n'{dest_dir}'\n\nDeseja continuar?"):
-            self.start_thread(self._http_download_worker, url, save_path, callback)
+            self.enqueue_download(filename, lambda limiter: self._http_download_worker(url, save_path, callback, limiter))
         else:
             self.log(f"Download de {filename} cancelado pelo usuário.", "warning")
 
-    def _ftp_download_worker(self, ftp_path, filename, save_path, version_file=None, version_str=None, callback=None):
-        """Worker que executa o download FTP em uma thread separada."""
+    def update_everything(self):
+        """Baixa, após uma única confirmação, tudo o que a última verificação apontou como pendente."""
+        if not self.check_results:
+            messagebox.showinfo("Atualizar Tudo", "Faça a verificação geral antes de atualizar.")
+            return
+        plan = self.engine.update_plan(self.check_results)
+        if not plan:
+            messagebox.showinfo("Atualizar Tudo", "Todos os sistemas já estão atualizados.")
+            return
+        total = sum(item["size"] or 0 for item in plan)
+        files = "\n".join(f"- {item['file']} ({item['product'].upper()})" for item in plan)
+        if not messagebox.askyesno("Atualizar Tudo", f"Serão baixados {len(plan)} arquivos ({format_bytes(total)}):\n\n{files}\n\nDeseja continuar?"):
+            self.log("Atualização geral cancelada pelo usuário.", "warning")
+            return
+        by_directory = self.engine.plan_by_directory(plan)
+        self.log(f"Atualização geral: {len(plan)} arquivos na fila, em {len(by_directory)} download(s).")
+        lock = threading.Lock()
+        collected = {}  # Diretório remoto -> resultados dos seus itens
+        remaining = [len(by_directory)]
+
+        def directory_done(ftp_path, outcomes):
+            with lock:
+                collected[ftp_path] = outcomes
+                remaining[0] -= 1
+                last = not remaining[0]
+            if last:
+                results = [o for path in by_directory if path in collected for o in collected[path]]
+                self.update_queue.put(lambda: self.finish_update_everything(results))
+
+        # Um download do agendador por diretório: cada um ocupa uma vaga de downloads_simultaneos
+        for ftp_path, items in by_directory.items():
+            skipped = [dict(item, status=OUTCOME_SKIPPED, path=None, error="Retirado da fila.") for item in items]
+            self.enqueue_download(
+                f"Atualização geral ({ftp_path})",
+                lambda limiter, path=ftp_path, items=items: self._update_everything_worker(path, items, limiter, directory_done),
+                PRIORITY_INSTALLER, on_cancel=lambda path=ftp_path, skipped=skipped: directory_done(path, skipped))
+
+    def _update_everything_worker(self, ftp_path, items, limiter, on_done):
+        """Worker da atualização geral de um diretório remoto, executado em uma thread do agendador."""
+        outcomes = None
         try:
-            self.log(f"Iniciando download de {filename} via FTP...")
-            ftp = FTP(FTP_SERVER, timeout=30)
-            ftp.login()
-            ftp.cwd(ftp_path)
-            
-            with open(save_path, 'wb') as f:
-                ftp.retrbinary(f'RETR {filename}', f.write)
-            
-            ftp.quit()
-            self.log(f"Download de {filename} concluído com sucesso!", "info")
+            outcomes = self.engine.update_directory(items, on_progress=self.report_progress, limiter=limiter)
+        except TransferCancelled:
+            self.log(f"Atualização geral de {ftp_path} cancelada; os arquivos parciais serão retomados na próxima vez.", "warning")
+            raise
+        finally:
+            if outcomes is None:
+                outcomes = [dict(item, status=OUTCOME_ERROR, path=None, error="Atualização interrompida.") for item in items]
+            on_done(ftp_path, outcomes)
+
+    def finish_update_everything(self, outcomes):
+        """Resume a atualização geral e verifica de novo os produtos."""
+        failed = [o for o in outcomes if o["status"] != OUTCOME_OK]
+        lines = [f"{'✓' if o['status'] == OUTCOME_OK else '✗'} {o['file']}" + (f": {o['error']}" if o["error"] else "")
+                 for o in outcomes]
+        summary = "\n".join(lines)
+        if failed:
+            self.log(f"Atualização geral concluída com {len(failed)} falha(s).", "warning")
+            messagebox.showwarning("Atualizar Tudo", f"Alguns arquivos não foram baixados:\n\n{summary}")
+        else:
+            self.log(f"Atualização geral concluída: {len(outcomes)} arquivos baixados.")
+            messagebox.showinfo("Atualizar Tudo", f"Arquivos baixados:\n\n{summary}\n\nExecute os instaladores na ordem acima.")
+        self.refresh_products()
+
+    def enqueue_download(self, filename, task, priority=None, on_cancel=None):
+        """Entrega o download ao agendador, que respeita o limite de transferências simultâneas e de banda.
+
+        on_cancel() é chamado se o download for retirado da fila antes de começar.
+        """
+        job = self.scheduler.submit(filename, task, download_priority(filename) if priority is None else priority)
+
+        def on_done(future):
+            if future.cancelled():
+                self.log(f"Download de {filename} retirado da fila.", "warning")
+                if on_cancel:
+                    on_cancel()
+        job.future.add_done_callback(on_done)
+
+    def refresh_download_queue(self):
+        """Redesenha a lista da fila de downloads, mantendo a seleção."""
+        selected = self.download_queue_view.selection()
+        self.download_queue_view.delete(*self.download_queue_view.get_children())
+        labels = {"na_fila": "Na fila", "em_andamento": "Baixando"}
+        for job in self.scheduler.snapshot():
+            self.download_queue_view.insert("", tk.END, iid=str(job["id"]), values=(job["name"], labels.get(job["status"], job["status"])))
+        self.download_queue_view.selection_set([iid for iid in selected if self.download_queue_view.exists(iid)])
+
+    def move_selected_download(self, offset):
+        for iid in self.download_queue_view.selection():
+            self.scheduler.move(int(iid), offset)
+
+    def cancel_selected_download(self):
+        for iid in self.download_queue_view.selection():
+            self.scheduler.cancel(int(iid))
+
+    def configure_download_limits(self):
+        """Pergunta os limites de banda (KB/s, 0 = sem limite) e os grava nas configurações locais."""
+        total = simpledialog.askinteger("Limites de Banda", "Limite total para os downloads (KB/s, 0 = sem limite):",
+                                        initialvalue=self.settings.get("limite_banda_kb", 0), minvalue=0, parent=self)
+        if total is None:
+            return
+        per_download = simpledialog.askinteger("Limites de Banda", "Limite por download (KB/s, 0 = sem limite):",
+                                               initialvalue=self.settings.get("limite_banda_por_download_kb", 0), minvalue=0, parent=self)
+        if per_download is None:
+            return
+        self.settings.update(limite_banda_kb=total, limite_banda_por_download_kb=per_download)
+        self.scheduler.set_limits(rate_limit=total * 1024, per_transfer_limit=per_download * 1024)
+        try:
+            save_settings(self.settings)
+        except OSError as e:
+            self.log(f"Não foi possível gravar as configurações: {e}", "error")
+        self.log(f"Limites de banda: total {total or 'ilimitado'} KB/s, por download {per_download or 'ilimitado'} KB/s.")
+
+    def report_progress(self, snapshot):
+        """Encaminha um snapshot de progresso, recebido na thread do download, para o painel de transferências."""
+        self.update_queue.put(lambda: self.show_transfer_progress(snapshot))
+
+    def show_transfer_progress(self, snapshot):
+        """Atualiza (criando se preciso) a linha da transferência no painel."""
+        name = snapshot["name"]
+        if name not in self.transfer_rows:
+            self.transfers_placeholder.grid_remove()
+            self.transfer_row_count += 1
+            row = self.transfer_row_count
+            name_label = ttk.Label(self.transfers_frame, text=name)
+            name_label.grid(row=row, column=0, sticky="w", padx=5)
+            bar = ttk.Progressbar(self.transfers_frame, length=220, maximum=100)
+            bar.grid(row=row, column=1, padx=5, pady=2)
+            info_label = ttk.Label(self.transfers_frame, text="")
+            info_label.grid(row=row, column=2, sticky="w", padx=5)
+            self.transfer_rows[name] = (name_label, bar, info_label)
+        _, bar, info_label = self.transfer_rows[name]
+
+        received = format_bytes(snapshot["bytes"])
+        if snapshot["total"]:
+            bar.config(value=snapshot["percent"])
+            received += f" / {format_bytes(snapshot['total'])}"
+        if snapshot["status"] == "em_andamento":
+            eta = f" - restam {snapshot['eta']:.0f}s" if snapshot["eta"] is not None else ""
+            info_label.config(text=f"{received} - {format_bytes(snapshot['instant_rate'])}/s{eta}", foreground="black")
+            return
+
+        if snapshot["status"] == "erro":
+            info_label.config(text=f"Falhou após {received}", foreground="red")
+        else:
+            bar.config(value=100)
+            info_label.config(text=f"Concluído: {received} em {snapshot['elapsed']:.0f}s ({format_bytes(snapshot['average_rate'])}/s)", foreground="green")
+        self.after(TRANSFER_ROW_LINGER_MS, lambda: self.remove_transfer_row(name))
+
+    def remove_transfer_row(self, name):
+        """Retira do painel uma transferência encerrada."""
+        row = self.transfer_rows.pop(name, None)
+        if row is None:
+            return
+        for widget in row:
+            widget.destroy()
+        if not self.transfer_rows:
+            self.transfers_placeholder.grid()
+
+    def _ftp_download_worker(self, ftp_path, filename, save_path, version_file=None, version_str=None, callback=None, limiter=None):
+        """Worker que executa o download FTP em uma thread do agendador."""
+        try:
+            self.engine.download_ftp(ftp_path, filename, os.path.dirname(save_path), on_progress=self.report_progress, limiter=limiter)
             self.update_queue.put(lambda: self.post_download_action(filename, save_path, version_file, version_str, callback))
+        except TransferCancelled:
+            self.log(f"Download de {filename} cancelado; o arquivo parcial será retomado no próximo download.", "warning")
+            raise
         except Exception as e:
             self.log(f"Falha no download de {filename}: {e}", "error")
-            self.update_queue.put(lambda: messagebox.showerror("Erro de Download", f"Ocorreu um erro no download FTP: {e}"))
+            self.update_queue.put(lambda e=e: messagebox.showerror("Erro de Download", f"Ocorreu um erro no download FTP: {e}"))
 
-    def _http_download_worker(self, url, save_path, callback=None):
-        """Worker que executa o download HTTP em uma thread separada."""
+    def _http_download_worker(self, url, save_path, callback=None, limiter=None):
+        """Worker que executa o download HTTP em uma thread do agendador."""
         filename = os.path.basename(save_path)
         try:
-            self.log(f"Iniciando download de {filename} via HTTP...")
-            response = requests.get(url, stream=True, timeout=30)
-            response.raise_for_status()
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            self.log(f"Download de {filename} concluído com sucesso!", "info")
+            self.engine.download_http(url, filename, os.path.dirname(save_path), on_progress=self.report_progress, limiter=limiter)
             self.update_queue.put(lambda: self.post_download_action(filename, save_path, callback=callback))
+        except TransferCancelled:
+            self.log(f"Download de {filename} cancelado.", "warning")
+            raise
         except Exception as e:
             self.log(f"Falha no download de {filename}: {e}", "error")
-            self.update_queue.put(lambda: messagebox.showerror("Erro de Download", f"Ocorreu um erro no download HTTP: {e}"))
+            self.update_queue.put(lambda e=e: messagebox.showerror("Erro de Download", f"Ocorreu um erro no download HTTP: {e}"))
 
     def post_download_action(self, filename, save_path, version_file=None, version_str=None, callback=None):
         """Ações a serem executadas na thread principal após o download."""
@@ -578,32 +897,35 @@ class App(tk.Tk):
         else: # É .exe
             messagebox.showinfo("Sucesso", f"Instalador '{filename}' baixado com sucesso!\n\nAgora, execute o arquivo para instalar ou atualizar o programa.")
             if version_file and version_str:
-                with open(version_file, 'w') as f:
-                    f.write(version_str)
-                self.log(f"Versão local atualizada para {version_str}.")
+                self.engine.record_version(version_file, version_str)
         
         if callback:
             self.start_thread(callback)
 
     def extract_zip(self, zip_path):
-        """Extrai um arquivo zip para um diretório escolhido pelo usuário."""
-        try:
-            self.log(f"Solicitando local para extrair {os.path.basename(zip_path)}...")
-            extract_dir = filedialog.askdirectory(title=f"Escolha onde extrair {os.path.basename(zip_path)}")
-            if not extract_dir:
-                self.log("Extração cancelada.", "warning")
-                return
+        """Pede o destino da extração e a executa em segundo plano."""
+        self.log(f"Solicitando local para extrair {os.path.basename(zip_path)}...")
+        extract_dir = filedialog.askdirectory(title=f"Escolha onde extrair {os.path.basename(zip_path)}")
+        if not extract_dir:
+            self.log("Extração cancelada.", "warning")
+            return
+        self.start_thread(self._extract_worker, zip_path, extract_dir)
 
-            self.log(f"Extraindo para {extract_dir}...")
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_dir)
-            
-            self.log("Extração concluída com sucesso.", "info")
-            messagebox.showinfo("Sucesso", f"Arquivos extraídos com sucesso para:\n{extract_dir}")
+    def _extract_worker(self, zip_path, extract_dir):
+        """Worker que extrai o zip fora da thread da interface."""
+        try:
+            self.engine.extract_zip(zip_path, extract_dir, on_progress=self.report_progress)
+            self.update_queue.put(lambda: messagebox.showinfo("Sucesso", f"Arquivos extraídos com sucesso para:\n{extract_dir}"))
         except Exception as e:
             self.log(f"Falha ao extrair arquivo zip: {e}", "error")
-            messagebox.showerror("Erro de Extração", f"Não foi possível extrair o arquivo: {e}")
+            self.update_queue.put(lambda e=e: messagebox.showerror("Erro de Extração", f"Não foi possível extrair o arquivo: {e}"))
 
 if __name__ == "__main__":
-    app = App()
+    configure_logging()
+    settings = load_settings()
+    if any(flag in sys.argv[1:] for flag in (TRACE_FLAG, TRACE_SAMPLE_FLAG, TRACE_MEMORY_FLAG)) \
+            or settings.get("rastreamento", False):
+        start_tracing(TRACE_FILE, sample=TRACE_SAMPLE_FLAG in sys.argv[1:] or settings.get("rastreamento_amostras", False),
+                      memory=TRACE_MEMORY_FLAG in sys.argv[1:] or settings.get("rastreamento_memoria", False))
+    app = App(report_startup=STARTUP_TIMING_FLAG in sys.argv[1:])
     app.mainloop()
@@ -0,0 +1,334 @@
+"""Espelho na rede local: uma máquina baixa do DATASUS e serve os arquivos às demais por HTTP.
+
+Exemplo:
+    python mirror.py --porta 8021 --pasta D:\\espelho_datasus
+
+Nas estações, config_automatizador_datasus.json com {"espelho": "http://servidor:8021"} faz o
+automatizador listar e baixar pelo espelho, recorrendo ao DATASUS se ele não responder.
+
+Rotas:
+    GET /ftp/<diretório>/           listagem JSON {"entries": [{"name", "size", "modify"}]}
+    GET /ftp/<diretório>/<arquivo>  arquivo do FTP (com Range e ETag)
+    GET /http/<arquivo>             arquivo do CNES (SCNES4700-COMPLETA.ZIP, INSTALADORFIREBIRD-155.ZIP)
+    GET /delta/<diretório>/<arquivo>?de=<anterior>
+                                    delta de <anterior> para <arquivo> (ver delta.py); 404 se não compensar
+
+Um arquivo que o espelho ainda não tem é buscado no DATASUS em segundo plano; se a busca não
+terminar em COLD_WAIT segundos, a resposta é 503 com Retry-After e a estação pede de novo depois.
+"""
+import argparse
+import http.server
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, wait as wait_futures
+from urllib.parse import parse_qs
+
+from core import (
+    Engine, configure_logging, FTP_SERVER, FTP_PATH_BPA, FTP_PATH_SIA, FTP_PATH_FPO, FTP_LISTING_TTL,
+    CNES_URL, CNES_FILENAME, FIREBIRD_URL, FIREBIRD_FILENAME,
+)
+from delta import DELTA_MAX_RATIO, DELTA_SUFFIX, make_delta, read_header
+from remote_index import classify
+
+MIRROR_PORT = 8021
+MIRROR_DIR = "espelho_datasus"
+REFRESH_INTERVAL = 30 * 60  # Segundos entre atualizações automáticas do espelho (0 desativa)
+MIRRORED_PATHS = (FTP_PATH_BPA, FTP_PATH_SIA, FTP_PATH_FPO)
+MIRRORED_URLS = {CNES_FILENAME: CNES_URL, FIREBIRD_FILENAME: FIREBIRD_URL}
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+COLD_WAIT = 5  # Segundos que um pedido aguarda a busca no DATASUS antes de receber 503
+RETRY_AFTER = 10  # Segundos sugeridos às estações (Retry-After) enquanto a busca continua
+
+
+class StillFetching(Exception):
+    """A busca do arquivo no DATASUS ainda está em andamento."""
+
+
+class MirrorCache:
+    """Cópias locais dos arquivos do DATASUS, revalidadas no máximo a cada revalidate_after segundos.
+
+    Pedidos simultâneos do mesmo arquivo (várias estações baixando o mesmo BDSIA) aguardam
+    uma única busca no DATASUS.
+    """
+    def __init__(self, engine, root, revalidate_after=FTP_LISTING_TTL):
+        self.engine = engine
+        self.root = root
+        self.revalidate_after = revalidate_after
+        self._lock = threading.Lock()
+        self._in_flight = {}  # Chave -> Future da busca em andamento
+        self._validated = {}  # Chave -> instante da última revalidação
+
+    def _claim(self, key):
+        """(Future, dono): resultado recente ou busca em andamento da chave, ou um Future novo a cargo de quem chamou."""
+        with self._lock:
+            validated = self._validated.get(key)
+            if validated and time.monotonic() - validated[0] < self.revalidate_after:
+                future = Future()
+                future.set_result(validated[1])
+                return future, False
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, False
+            future = self._in_flight[key] = Future()
+            return future, True
+
+    def _fulfil(self, key, future, fetch):
+        try:
+            result = fetch()
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            with self._lock:
+                self._validated[key] = (time.monotonic(), result)
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _single_flight(self, key, fetch, wait=None):
+        """Executa fetch() uma única vez para pedidos simultâneos da mesma chave e reaproveita resultados recentes.
+
+        Com wait, a busca roda em segundo plano e o pedido aguarda no máximo wait segundos, levantando
+        StillFetching se ela continuar; a busca segue e atende os pedidos seguintes.
+        """
+        future, owner = self._claim(key)
+        if owner and wait is None:
+            self._fulfil(key, future, fetch)
+        elif owner:
+            threading.Thread(target=self._fulfil, args=(key, future, fetch), name="espelho-busca", daemon=True).start()
+        if wait is not None and not wait_futures([future], timeout=wait).done:
+            raise StillFetching(key)
+        return future.result()
+
+    def ftp_entries(self, ftp_path):
+        """Listagem de um diretório espelhado do FTP."""
+        if ftp_path not in MIRRORED_PATHS:
+            raise FileNotFoundError(ftp_path)
+
+        def fetch():
+            entries = self.engine.list_ftp_entries(ftp_path)
+            if entries is None:
+                raise ConnectionError(f"Não foi possível listar {ftp_path} no DATASUS.")
+            return entries
+        return self._single_flight(("lista", ftp_path), fetch)
+
+    def ftp_file(self, ftp_path, filename, wait=None):
+        """Caminho local de um arquivo do FTP, baixado do DATASUS apenas se novo ou alterado (wait: ver _single_flight)."""
+        if not any(entry["name"] == filename for entry in self.ftp_entries(ftp_path)):
+            raise FileNotFoundError(filename)
+        dest_dir = os.path.join(self.root, "ftp", *ftp_path.strip("/").split("/"))
+        os.makedirs(dest_dir, exist_ok=True)
+        return self._single_flight(("ftp", ftp_path, filename),
+                                   lambda: self.engine.download_ftp(ftp_path, filename, dest_dir), wait)
+
+    def http_file(self, filename, wait=None):
+        """Caminho local de um arquivo do CNES, revalidado no servidor com If-None-Match (wait: ver _single_flight)."""
+        url = MIRRORED_URLS.get(filename)
+        if url is None:
+            raise FileNotFoundError(filename)
+        dest_dir = os.path.join(self.root, "http")
+        os.makedirs(dest_dir, exist_ok=True)
+        return self._single_flight(("http", filename), lambda: self.engine.download_http(url, filename, dest_dir)[0], wait)
+
+    def delta_file(self, ftp_path, filename, old, wait=None):
+        """Caminho local do delta de old para filename, gerado na primeira vez que é pedido.
+
+        Levanta FileNotFoundError se as versões não forem do mesmo produto e tipo, ou se o delta
+        passar de DELTA_MAX_RATIO do tamanho da versão nova (o download completo é melhor).
+        """
+        new_info, old_info = classify(filename), classify(old)
+        if (not new_info or not old_info or old == filename
+                or (new_info["product"], new_info["kind"]) != (old_info["product"], old_info["kind"])):
+            raise FileNotFoundError(old)
+        new_path = self.ftp_file(ftp_path, filename, wait)
+        old_path = self.ftp_file(ftp_path, old, wait)
+        delta_dir = os.path.join(self.root, "delta", *ftp_path.strip("/").split("/"))
+        delta_path = os.path.join(delta_dir, f"{filename}--{old}{DELTA_SUFFIX}")
+
+        def build():
+            try:
+                current = os.path.getmtime(delta_path) >= max(os.path.getmtime(new_path), os.path.getmtime(old_path))
+            except OSError:
+                current = False
+            if current:
+                with open(delta_path, 'rb') as f:
+                    delta_size, new_size = os.path.getsize(delta_path), read_header(f)["new"]["size"]
+            else:
+                os.makedirs(delta_dir, exist_ok=True)
+                started = time.monotonic()
+                header = make_delta(old_path, new_path, delta_path)
+                delta_size, new_size = header["delta_size"], header["new"]["size"]
+                self.engine.log(f"Delta {old} -> {filename}: {delta_size} de {new_size} bytes "
+                                f"({time.monotonic() - started:.1f}s).")
+            if delta_size > DELTA_MAX_RATIO * new_size:
+                raise FileNotFoundError(delta_path)
+            return delta_path
+        return self._single_flight(("delta", ftp_path, filename, old), build, wait)
+
+    def refresh(self, bdsia_count=3):
+        """Traz do DATASUS as versões mais recentes de cada produto; arquivos inalterados não são transferidos.
+
+        Também prepara o delta da versão anterior de cada produto para a mais recente.
+        """
+        wanted, deltas = [], []
+        for ftp_path, products in ((FTP_PATH_BPA, ("bpa",)), (FTP_PATH_SIA, ("sia", "bdsia")), (FTP_PATH_FPO, ("fpo",))):
+            index = self.engine.remote_index(ftp_path, products)
+            if index is None:
+                continue
+            series = [index.query("bpa"), index.query("sia", "installer"), index.query("bdsia"),
+                      index.query("fpo", "installer"), index.query("fpo", "update")]
+            wanted += [(ftp_path, a["name"]) for a in index.query("bdsia")[:bdsia_count]]
+            for found in series:
+                wanted += [(ftp_path, a["name"]) for a in found[:1]]
+                deltas += [(ftp_path, found[0]["name"], found[1]["name"])] if len(found) > 1 else []
+        for ftp_path, filename in dict.fromkeys(wanted):
+            try:
+                self.ftp_file(ftp_path, filename)
+            except Exception as e:
+                self.engine.log(f"Falha ao espelhar {ftp_path}{filename}: {e}", "error")
+        for ftp_path, filename, old in deltas:
+            try:
+                self.delta_file(ftp_path, filename, old)
+            except FileNotFoundError:
+                pass  # Versões sem conteúdo em comum: as estações baixam o arquivo completo
+            except Exception as e:
+                self.engine.log(f"Falha ao gerar o delta {old} -> {filename}: {e}", "error")
+        for filename in MIRRORED_URLS:
+            try:
+                self.http_file(filename)
+            except Exception as e:
+                self.engine.log(f"Falha ao espelhar {filename}: {e}", "error")
+
+
+class MirrorHandler(http.server.BaseHTTPRequestHandler):
+    """Atende as estações: listagens em JSON e arquivos com suporte a Range e If-None-Match."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.info("Espelho: %s - %s", self.client_address[0], format % args)
+
+    def do_HEAD(self):
+        self.do_GET(send_body=False)
+
+    def do_GET(self, send_body=True):
+        cache = self.server.cache
+        path, _, query = self.path.partition("?")
+        try:
+            if path.startswith("/http/"):
+                self._send_file(cache.http_file(path[len("/http/"):], COLD_WAIT), send_body)
+            elif path.startswith("/ftp/"):
+                directory, _, filename = path[len("/ftp"):].rpartition("/")
+                if not filename:
+                    body = json.dumps({"entries": cache.ftp_entries(directory + "/")}).encode()
+                    self._send_headers(200, "application/json", len(body))
+                    if send_body:
+                        self.wfile.write(body)
+                else:
+                    self._send_file(cache.ftp_file(directory + "/", filename, COLD_WAIT), send_body)
+            elif path.startswith("/delta/"):
+                directory, _, filename = path[len("/delta"):].rpartition("/")
+                old = parse_qs(query).get("de", [""])[0]
+                self._send_file(cache.delta_file(directory + "/", filename, old, COLD_WAIT), send_body)
+            else:
+                self.send_error(404)
+        except FileNotFoundError:
+            self.send_error(404)
+        except StillFetching:
+            body = b"Arquivo sendo baixado do DATASUS; tente novamente."
+            self._send_headers(503, "text/plain; charset=utf-8", len(body), {"Retry-After": str(RETRY_AFTER)})
+            if send_body:
+                self.wfile.write(body)
+        except Exception as e:
+            logging.error(f"Espelho: falha ao atender {path}: {e}")
+            self.send_error(502, str(e))
+
+    def _send_headers(self, status, content_type, length, extra=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        for name, value in (extra or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _send_file(self, file_path, send_body):
+        stat = os.stat(file_path)
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        if self.headers.get("If-None-Match") == etag:
+            self._send_headers(304, "application/octet-stream", 0, headers)
+            return
+        start, end = 0, size
+        match = RANGE_PATTERN.match(self.headers.get("Range", ""))
+        if match and (match[1] or match[2]):
+            if match[1]:
+                start, end = int(match[1]), min(int(match[2]) + 1 if match[2] else size, size)
+            else:
+                start = max(0, size - int(match[2]))
+            if start >= end:
+                self._send_headers(416, "application/octet-stream", 0, {"Content-Range": f"bytes */{size}"})
+                return
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        self._send_headers(206 if "Content-Range" in headers else 200, "application/octet-stream", end - start, headers)
+        if send_body and end > start:
+            with open(file_path, 'rb') as f:
+                self.connection.sendfile(f, offset=start, count=end - start)
+
+
+class MirrorServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cache, host="", port=MIRROR_PORT):
+        super().__init__((host, port), MirrorHandler)
+        self.cache = cache
+
+
+def _refresh_loop(cache, interval, stop):
+    while True:
+        cache.refresh()
+        if stop.wait(interval):
+            return
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Espelho local dos arquivos do DATASUS para as estações da rede.")
+    parser.add_argument("--porta", type=int, default=MIRROR_PORT, help=f"Porta HTTP (padrão: {MIRROR_PORT}).")
+    parser.add_argument("--pasta", default=MIRROR_DIR, help=f"Pasta das cópias locais (padrão: {MIRROR_DIR}).")
+    parser.add_argument("--atualizar-a-cada", type=int, default=REFRESH_INTERVAL // 60, metavar="MINUTOS",
+                        help="Intervalo entre atualizações automáticas; 0 baixa apenas sob demanda.")
+    parser.add_argument("--servidor", action="append", metavar="HOST[:PORTA]",
+                        help=f"Servidor FTP de origem; repita para servidores equivalentes (padrão: {FTP_SERVER}).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging()
+    servers = args.servidor or [FTP_SERVER]
+    host, _, port = servers[0].partition(":")
+    # O espelho só repassa arquivos; nada é instalado nesta máquina, então não há pasta a salvaguardar
+    engine = Engine(ftp_server=host, ftp_port=int(port or 21), sources=[f"ftp://{server}" for server in servers],
+                    backup_before_install=False)
+    cache = MirrorCache(engine, args.pasta)
+    server = MirrorServer(cache, port=args.porta)
+    stop = threading.Event()
+    if args.atualizar_a_cada > 0:
+        threading.Thread(target=_refresh_loop, args=(cache, args.atualizar_a_cada * 60, stop),
+                         name="espelho-atualizacao", daemon=True).start()
+    print(f"Espelho atendendo em http://0.0.0.0:{args.porta} (pasta {os.path.abspath(args.pasta)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Orquestrador das verificações: executa os produtos em paralelo, com timeout individual e deduplicação."""
+import itertools
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+# Situação de cada verificação ao final de uma rodada
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "erro"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_CANCELLED = "cancelado"
+
+POLL_INTERVAL = 0.2  # Intervalo máximo entre checagens de cancelamento, em segundos
+
+
+class CheckCancelled(Exception):
+    """A verificação foi interrompida pelo orquestrador (tempo limite ou cancelamento da rodada)."""
+
+
+class CancelToken:
+    """Pedido de interrupção de uma verificação em andamento.
+
+    Quem bloqueia sem prazo curto (conexão FTP, espera pela resposta das fontes) registra com
+    aborting() como ser interrompido; cancel() executa esses callbacks, de modo que a verificação
+    termina de fato e devolve sua thread e sua conexão.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._ids = itertools.count()
+        self.cancelled = False
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks = list(self._callbacks.values())
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass  # Um recurso que não pôde ser interrompido termina pelo próprio timeout
+
+    def check(self):
+        """Levanta CheckCancelled se a verificação foi cancelada."""
+        if self.cancelled:
+            raise CheckCancelled("Verificação interrompida.")
+
+    @contextmanager
+    def aborting(self, callback):
+        """Dentro do bloco, cancel() chama callback(); se já estiver cancelada, levanta CheckCancelled."""
+        with self._lock:
+            key = next(self._ids)
+            self._callbacks[key] = callback
+        try:
+            self.check()
+            yield
+        finally:
+            with self._lock:
+                self._callbacks.pop(key, None)
+
+
+class CheckOrchestrator:
+    """Executa funções de verificação nomeadas e agrega os resultados de cada rodada.
+
+    Uma verificação ainda em andamento não é iniciada de novo: rodadas simultâneas (cliques repetidos,
+    callbacks pós-download) compartilham a mesma execução em vez de empilhar threads.
+    Cada função de verificação recebe um CancelToken, cancelado quando a verificação excede o tempo
+    limite ou a rodada é cancelada; a execução interrompida deixa de ser compartilhada.
+    """
+    def __init__(self, checks, timeouts=None, default_timeout=60, max_workers=None):
+        self.checks = checks  # Nome -> função(CancelToken) que retorna o resultado da verificação
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(checks), thread_name_prefix="verificacao")
+        self._lock = threading.Lock()
+        self._in_flight = {}  # Nome -> Future da execução em andamento
+        self._tokens = {}  # Future da execução em andamento -> seu CancelToken
+        self._cancel = threading.Event()
+        self._rounds = 0  # Rodadas ainda não concluídas
+
+    @property
+    def busy(self):
+        """Indica se há alguma rodada de verificação em andamento."""
+        with self._lock:
+            return self._rounds > 0
+
+    def _submit(self, name):
+        with self._lock:
+            future = self._in_flight.get(name)
+            if future is not None:
+                return future
+            token = CancelToken()
+            future = self._executor.submit(self.checks[name], token)
+            self._in_flight[name] = future
+            self._tokens[future] = token
+        # Registrado fora do lock: se a verificação já terminou, o callback roda imediatamente nesta thread
+        future.add_done_callback(lambda f, n=name: self._forget(n, f))
+        return future
+
+    def _forget(self, name, future):
+        with self._lock:
+            if self._in_flight.get(name) is future:
+                del self._in_flight[name]
+            self._tokens.pop(future, None)
+
+    def _abort(self, name, future):
+        """Interrompe uma execução: a que ainda não começou é cancelada; a que está rodando recebe o cancelamento."""
+        if future.cancel():
+            return
+        with self._lock:
+            token = self._tokens.get(future)
+            if self._in_flight.get(name) is future:
+                del self._in_flight[name]  # A próxima rodada inicia uma execução nova
+        if token is not None:
+            token.cancel()
+
+    def run(self, names=None, on_result=None):
+        """Inicia uma rodada com as verificações indicadas (todas, por padrão).
+
+        on_result(nome, resultado) é chamado, na thread do orquestrador, assim que cada verificação termina.
+        Retorna um Future cujo resultado é {"outcomes": {nome: resultado}, "elapsed": segundos}.
+        """
+        names = list(names or self.checks)
+        with self._lock:
+            if self._rounds == 0:
+                self._cancel.clear()
+            self._rounds += 1
+        started = time.monotonic()
+        futures = {name: self._submit(name) for name in names}
+        round_future = Future()
+        threading.Thread(target=self._coordinate, args=(futures, started, on_result, round_future),
+                         name="verificacao-rodada", daemon=True).start()
+        return round_future
+
+    def cancel(self):
+        """Encerra as rodadas em andamento, marcando as verificações pendentes como canceladas."""
+        self._cancel.set()
+
+    def _coordinate(self, futures, started, on_result, round_future):
+        outcomes = {}
+        pending = dict(futures)
+
+        def finish(name, status, result=None, error=None):
+            outcome = {"status": status, "result": result, "error": error,
+                       "elapsed": round(time.monotonic() - started, 3)}
+            outcomes[name] = outcome
+            del pending[name]
+            if on_result:
+                try:
+                    on_result(name, outcome)
+                except Exception:
+                    pass  # Um erro ao exibir um resultado não deve interromper a rodada
+
+        try:
+            while pending:
+                if self._cancel.is_set():
+                    for name in list(pending):
+                        self._abort(name, pending[name])
+                        finish(name, OUTCOME_CANCELLED, error="Verificação cancelada.")
+                    break
+                now = time.monotonic()
+                for name in list(pending):
+                    limit = self.timeouts.get(name, self.default_timeout)
+                    if now - started >= limit:
+                        self._abort(name, pending[name])
+                        finish(name, OUTCOME_TIMEOUT, error=f"Tempo limite de {limit}s excedido.")
+                if not pending:
+                    break
+                next_deadline = min(started + self.timeouts.get(n, self.default_timeout) for n in pending)
+                timeout = min(POLL_INTERVAL, max(0, next_deadline - time.monotonic()))
+                done, _ = wait(list(pending.values()), timeout=timeout, return_when=FIRST_COMPLETED)
+                for name in [n for n, f in pending.items() if f in done]:
+                    future = pending[name]
+                    if future.cancelled() or isinstance(future.exception(), CheckCancelled):
+                        finish(name, OUTCOME_CANCELLED, error="Verificação cancelada.")
+                    elif future.exception() is not None:
+                        finish(name, OUTCOME_ERROR, error=str(future.exception()))
+                    else:
+                        finish(name, OUTCOME_OK, result=future.result())
+        finally:
+            with self._lock:
+                self._rounds -= 1
+            round_future.set_result({"outcomes": outcomes, "elapsed": round(time.monotonic() - started, 3)})
+
+    def shutdown(self):
+        """Cancela as rodadas e libera as threads ociosas do pool."""
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,133 @@
+"""Verificação periódica em segundo plano e snapshot persistente do último resultado de cada produto."""
+import json
+import os
+import random
+import threading
+import time
+
+from orchestrator import OUTCOME_OK
+
+POLL_INTERVAL = 60 * 60  # Segundos entre verificações automáticas bem-sucedidas
+BACKOFF_INITIAL = 30  # Espera, em segundos, após a primeira rodada sem resposta do servidor
+BACKOFF_MAX = 30 * 60  # Espera máxima entre tentativas enquanto o servidor estiver inacessível
+
+
+def backoff_delay(failures, initial=BACKOFF_INITIAL, maximum=BACKOFF_MAX):
+    """Espera exponencial após failures rodadas seguidas sem sucesso, com jitter de até metade do valor."""
+    base = min(maximum, initial * 2 ** max(0, failures - 1))
+    return base / 2 + random.uniform(0, base / 2)
+
+
+def format_age(seconds):
+    """Descreve há quanto tempo algo aconteceu: 'agora', 'há 5 min', 'há 2 h', 'há 3 dias'."""
+    if seconds < 60:
+        return "agora"
+    if seconds < 3600:
+        return f"há {seconds // 60:.0f} min"
+    if seconds < 86400:
+        return f"há {seconds // 3600:.0f} h"
+    days = seconds // 86400
+    return f"há {days:.0f} dia{'s' if days >= 2 else ''}"
+
+
+class StatusSnapshot:
+    """Arquivo com o último resultado bem-sucedido de cada verificação e o instante em que foi obtido."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Retorna {"results": {nome: resultado}, "checked_at": {nome: epoch}}, ou None se não houver snapshot."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or not data.get("results"):
+            return None
+        return data
+
+    def record(self, outcomes):
+        """Acrescenta ao snapshot os resultados bem-sucedidos de uma rodada; falhas mantêm o resultado anterior."""
+        now = time.time()
+        with self._lock:
+            data = self.load() or {"results": {}, "checked_at": {}}
+            for name, outcome in outcomes.items():
+                if outcome["status"] == OUTCOME_OK:
+                    data["results"][name] = outcome["result"]
+                    data["checked_at"][name] = now
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass  # Sem snapshot a próxima abertura apenas esperará a verificação
+        return data
+
+
+class UpdatePoller:
+    """Executa rodadas do CheckOrchestrator a cada interval segundos, gravando o resultado no snapshot.
+
+    Se nenhuma verificação da rodada tiver sucesso (servidor inacessível), a próxima tentativa segue
+    um backoff exponencial com jitter em vez do intervalo normal. on_result(nome, resultado) e
+    on_round(resumo) são chamados na thread do orquestrador. next_interval(resumo, interval), se
+    informado, decide a espera após uma rodada bem-sucedida (ex.: mais curta perto da publicação do BDSIA).
+    """
+    def __init__(self, orchestrator, snapshot, interval=POLL_INTERVAL, on_result=None, on_round=None,
+                 next_interval=None):
+        self.orchestrator = orchestrator
+        self.snapshot = snapshot
+        self.interval = interval
+        self.next_interval = next_interval
+        self.on_result = on_result
+        self.on_round = on_round
+        self.failures = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, delay=0):
+        """Inicia o ciclo; a primeira rodada acontece após delay segundos."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, args=(delay,), name="verificacao-periodica", daemon=True)
+            self._thread.start()
+
+    def poll_now(self):
+        """Antecipa a próxima rodada."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self, delay):
+        while not self._sleep(delay):
+            if self.orchestrator.busy:
+                delay = BACKOFF_INITIAL  # Uma verificação manual já está em andamento
+                continue
+            summary = self.orchestrator.run(on_result=self.on_result).result()
+            self.snapshot.record(summary["outcomes"])
+            if any(o["status"] == OUTCOME_OK for o in summary["outcomes"].values()):
+                self.failures = 0
+                delay = self.interval
+                if self.next_interval:
+                    try:
+                        delay = self.next_interval(summary, self.interval)
+                    except Exception:
+                        pass  # Sem a estimativa, vale o intervalo normal
+            else:
+                self.failures += 1
+                delay = backoff_delay(self.failures)
+            summary["next_poll"] = delay
+            if self.on_round:
+                try:
+                    self.on_round(summary)
+                except Exception:
+                    pass  # Uma falha ao exibir a rodada não deve interromper o ciclo
+
+    def _sleep(self, seconds):
+        """Aguarda seconds segundos ou até poll_now(); retorna True se o poller foi encerrado."""
+        self._wake.wait(seconds)
+        self._wake.clear()
+        return self._stop.is_set()
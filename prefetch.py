@@ -0,0 +1,198 @@
+"""Pré-download fora do horário de pico dos arquivos novos que a estação vai precisar.
+
+O Prefetcher recebe os resultados das verificações automáticas (ver poller.py) e, dentro da janela
+configurada e sob um teto de banda próprio, baixa o plano de atualização (Engine.update_plan) para
+a área de preparação. Cada arquivo baixado entra no repositório de artefatos: quando o usuário
+pede o download no dia seguinte, ele é copiado de lá sem acessar a rede. Um download que não
+termina até o fim da janela é interrompido e retomado do .part na noite seguinte.
+
+Perto da data em que o BDSIA costuma ser publicado (estimada pelas competências anteriores), as
+verificações passam a ser mais frequentes, para que a nova competência seja vista ainda na janela.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+
+from core import FTP_PATH_SIA, PREFETCH_DIR
+from orchestrator import OUTCOME_OK, OUTCOME_ERROR
+from remote_index import classify
+from scheduler import TokenBucket, TransferCancelled
+
+PREFETCH_WINDOW = "22:00-06:00"  # Horário (HH:MM-HH:MM, pode passar da meia-noite) em que o pré-download roda
+PREFETCH_RATE_LIMIT_KB = 256  # Teto de banda do pré-download, em KB/s (0 = sem limite)
+RELEASE_POLL_INTERVAL = 15 * 60  # Intervalo das verificações enquanto o BDSIA do mês é esperado
+RELEASE_MARGIN_DAYS = 2  # Dias antes do primeiro dia histórico de publicação em que a espera começa
+RELEASE_HISTORY = 6  # Competências do BDSIA usadas para estimar o dia de publicação
+
+
+def parse_window(spec):
+    """Converte 'HH:MM-HH:MM' em (início, fim) em minutos desde a meia-noite; início == fim é o dia todo."""
+    try:
+        start, end = (int(h) * 60 + int(m) for h, m in (part.strip().split(":") for part in spec.split("-")))
+    except ValueError:
+        raise ValueError(f"Janela inválida: {spec!r} (use HH:MM-HH:MM).")
+    if not (0 <= start < 24 * 60 and 0 <= end < 24 * 60):
+        raise ValueError(f"Janela inválida: {spec!r} (use HH:MM-HH:MM).")
+    return start, end
+
+
+def in_window(window, now):
+    """Indica se now está dentro da janela (início, fim)."""
+    start, end = window
+    minute = now.hour * 60 + now.minute
+    if start == end:
+        return True
+    return start <= minute < end if start < end else minute >= start or minute < end
+
+
+def seconds_until_window(window, now):
+    """Segundos até a próxima abertura da janela (0 se ela já está aberta)."""
+    if in_window(window, now):
+        return 0
+    opening = now.replace(hour=window[0] // 60, minute=window[0] % 60, second=0, microsecond=0)
+    if opening <= now:
+        opening += timedelta(days=1)
+    return (opening - now).total_seconds()
+
+
+def release_days(artifacts, history=RELEASE_HISTORY):
+    """(primeiro, último) dia do mês em que saíram as últimas competências do BDSIA, ou None sem histórico.
+
+    Vale a data da primeira versão publicada de cada competência (as letras seguintes são correções).
+    """
+    first_release = {}
+    for artifact in artifacts:
+        if artifact.get("competencia") and artifact.get("modify"):
+            competencia = artifact["competencia"]
+            first_release[competencia] = min(first_release.get(competencia, artifact["modify"]), artifact["modify"])
+    days = [int(modify[6:8]) for _, modify in sorted(first_release.items(), reverse=True)[:history]]
+    return (min(days), max(days)) if days else None
+
+
+def expecting_release(artifacts, now, margin=RELEASE_MARGIN_DAYS):
+    """Indica se um BDSIA novo é esperado: nenhum foi publicado neste mês e o dia histórico já está próximo."""
+    days = release_days(artifacts)
+    if days is None:
+        return False
+    latest = max((a["modify"] for a in artifacts if a.get("modify")), default="")
+    return latest[:6] != now.strftime("%Y%m") and now.day >= days[0] - margin
+
+
+class Prefetcher:
+    """Baixa para staging_dir, dentro da janela e sob rate_limit bytes/s, o que as verificações indicarem.
+
+    offer(outcomes) entrega os resultados de uma rodada de verificações (de qualquer thread);
+    poll_interval(summary, padrão) serve de next_interval ao UpdatePoller.
+    """
+    def __init__(self, engine, staging_dir=PREFETCH_DIR, window=PREFETCH_WINDOW,
+                 rate_limit=PREFETCH_RATE_LIMIT_KB * 1024, on_progress=None):
+        self.engine = engine
+        self.staging_dir = staging_dir
+        self.window = parse_window(window)
+        self.bucket = TokenBucket(rate_limit)
+        self.on_progress = on_progress
+        self._lock = threading.Lock()
+        self._results = {}  # Último resultado bem-sucedido de cada verificação
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def offer(self, outcomes):
+        """Registra os resultados bem-sucedidos de uma rodada e acorda o pré-download."""
+        with self._lock:
+            self._results.update((name, outcome["result"]) for name, outcome in outcomes.items()
+                                 if outcome["status"] == OUTCOME_OK)
+        self._wake.set()
+
+    def poll_interval(self, summary, default):
+        """Intervalo até a próxima verificação: RELEASE_POLL_INTERVAL enquanto o BDSIA do mês é esperado."""
+        index = self.engine.remote_index(FTP_PATH_SIA, ("bdsia",))
+        if index is not None and expecting_release(index.query("bdsia"), datetime.now()):
+            return min(default, RELEASE_POLL_INTERVAL)
+        return default
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="pre-download", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _limiter(self, respect_window):
+        def limiter(nbytes):
+            if self._stop.is_set():
+                raise TransferCancelled("Pré-download encerrado.")
+            if respect_window and not in_window(self.window, datetime.now()):
+                raise TransferCancelled("Fim da janela de pré-download; o download continua na próxima.")
+            self.bucket.consume(nbytes, self._stop)
+        return limiter
+
+    def pending(self, results):
+        """Itens do plano de atualização ainda não preparados em staging_dir."""
+        pending = []
+        for item in self.engine.update_plan(results):
+            path = os.path.join(self.staging_dir, item["file"])
+            if not (os.path.isfile(path) and (item["size"] is None or os.path.getsize(path) == item["size"])):
+                pending.append(item)
+        return pending
+
+    def fetch(self, results, respect_window=True):
+        """Baixa os itens pendentes de results para staging_dir; retorna os itens acrescidos de status e error.
+
+        Para no primeiro cancelamento (fim da janela ou stop()); falhas de um item não impedem os demais.
+        """
+        os.makedirs(self.staging_dir, exist_ok=True)
+        plan = self.engine.update_plan(results)
+        self._prune({item["file"] for item in plan})
+        outcomes = []
+        for item in self.pending(results):
+            if self._stop.is_set() or (respect_window and not in_window(self.window, datetime.now())):
+                break
+            try:
+                self.engine.download_ftp(item["ftp_path"], item["file"], self.staging_dir, self.on_progress,
+                                         self._limiter(respect_window), backup=False)
+                outcomes.append(dict(item, status=OUTCOME_OK, error=None))
+            except TransferCancelled as e:
+                self.engine.log(f"Pré-download de {item['file']} interrompido: {e}")
+                break
+            except Exception as e:
+                self.engine.log(f"Falha no pré-download de {item['file']}: {e}", "warning")
+                outcomes.append(dict(item, status=OUTCOME_ERROR, error=str(e)))
+        return outcomes
+
+    def _prune(self, wanted):
+        """Apaga da área de preparação os arquivos que o plano não pede mais (já instalados ou substituídos).
+
+        Os artefatos continuam no repositório de artefatos.
+        """
+        try:
+            names = os.listdir(self.staging_dir)
+        except OSError:
+            return
+        for name in names:
+            base = name
+            for suffix in (".part.json", ".part", ".delta", ".tmp"):
+                if base.endswith(suffix):
+                    base = base[:-len(suffix)]
+                    break
+            if classify(base) and base not in wanted:
+                try:
+                    os.remove(os.path.join(self.staging_dir, name))
+                except OSError:
+                    pass
+
+    def _loop(self):
+        while not self._stop.is_set():
+            delay = seconds_until_window(self.window, datetime.now())
+            with self._lock:
+                results = dict(self._results)
+            if not delay:
+                if results and self.pending(results):
+                    done = [o for o in self.fetch(results) if o["status"] == OUTCOME_OK]
+                    if done:
+                        self.engine.log(f"Pré-download concluído: {', '.join(o['file'] for o in done)}.")
+                delay = None  # Aguarda a próxima rodada de verificações
+            self._wake.wait(delay)
+            self._wake.clear()
@@ -0,0 +1,149 @@
+"""Métricas de transferência: progresso, vazão, tempo restante e duração de cada fase de um download."""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+UPDATE_INTERVAL = 0.25  # Intervalo mínimo, em segundos, entre notificações de progresso
+RATE_SMOOTHING = 0.3  # Peso da última amostra na média móvel da vazão instantânea
+
+
+def format_bytes(value):
+    """Formata uma quantidade de bytes em B/KB/MB/GB."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024 or unit == "GB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+
+
+class TransferProgress:
+    """Acompanha os bytes recebidos e as fases (connect, login, cwd, listing, first_byte, transfer, fsync) de um download.
+
+    add() pode ser chamado por várias threads (downloads segmentados); on_update recebe um snapshot
+    no máximo a cada UPDATE_INTERVAL segundos e sempre ao final. limiter(nbytes), se informado, é
+    chamado a cada bloco antes da contagem e pode atrasar (limite de banda) ou interromper a transferência.
+    """
+    def __init__(self, name, protocol, total=None, on_update=None, limiter=None):
+        self.name = name
+        self.protocol = protocol
+        self.total = total
+        self.on_update = on_update
+        self.limiter = limiter
+        self.phases = {}  # Fase -> duração acumulada em segundos
+        self.bytes = 0
+        self.resumed_bytes = 0  # Bytes já presentes no .part, que não contam para a vazão
+        self.status = "em_andamento"
+        self.error = None
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._transfer_started = None
+        self._first_byte = None
+        self._last_emit = 0
+        self._last_sample = (self._started, 0)
+        self._instant_rate = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        """Mede a duração de uma fase; chamadas repetidas da mesma fase são somadas."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0) + time.monotonic() - started
+
+    def set_total(self, total):
+        self.total = total
+
+    def resume_from(self, offset):
+        """Informa que o download retoma com offset bytes já gravados."""
+        with self._lock:
+            self.bytes = self.resumed_bytes = offset
+            self._last_sample = (time.monotonic(), offset)
+
+    def start_transfer(self):
+        """Marca o início da transferência de dados (pedido do RETR ou GET)."""
+        with self._lock:
+            if self._transfer_started is None:
+                self._transfer_started = time.monotonic()
+
+    def add(self, nbytes):
+        """Contabiliza bytes recebidos."""
+        if self.limiter:
+            self.limiter(nbytes)
+        now = time.monotonic()
+        with self._lock:
+            if self._first_byte is None:
+                self._first_byte = now
+                self.phases["first_byte"] = now - (self._transfer_started or self._started)
+            self.bytes += nbytes
+            if now - self._last_emit < UPDATE_INTERVAL:
+                return
+            self._last_emit = now
+            self._sample(now)
+        self._emit()
+
+    def _sample(self, now):
+        last_time, last_bytes = self._last_sample
+        if now > last_time:
+            rate = (self.bytes - last_bytes) / (now - last_time)
+            self._instant_rate = rate if not self._instant_rate else (
+                RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self._instant_rate)
+        self._last_sample = (now, self.bytes)
+
+    def snapshot(self):
+        """Retorna o estado atual: bytes, percentual, vazão instantânea e média, ETA e fases."""
+        with self._lock:
+            now = time.monotonic()
+            transferred = self.bytes - self.resumed_bytes
+            transfer_time = now - (self._first_byte or now)
+            average_rate = transferred / transfer_time if transfer_time > 0 else 0.0
+            rate = self._instant_rate or average_rate
+            eta = (self.total - self.bytes) / rate if self.total and rate > 0 else None
+            return {
+                "name": self.name,
+                "protocol": self.protocol,
+                "status": self.status,
+                "bytes": self.bytes,
+                "total": self.total,
+                "percent": round(100 * self.bytes / self.total, 1) if self.total else None,
+                "instant_rate": round(rate, 1),
+                "average_rate": round(average_rate, 1),
+                "eta": round(eta, 1) if eta is not None else None,
+                "elapsed": round(now - self._started, 3),
+                "phases": {name: round(value, 3) for name, value in self.phases.items()},
+                "error": self.error,
+            }
+
+    def finish(self, status="concluido", error=None):
+        """Encerra o acompanhamento e retorna o snapshot final."""
+        with self._lock:
+            if self._first_byte is not None:
+                self.phases["transfer"] = time.monotonic() - self._first_byte
+            self.status = status
+            self.error = error
+        return self._emit()
+
+    def _emit(self):
+        snapshot = self.snapshot()
+        if self.on_update:
+            self.on_update(snapshot)
+        return snapshot
+
+
+class MetricsWriter:
+    """Grava registros de métricas como JSON lines (um objeto por linha)."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, event, **fields):
+        record = {"timestamp": datetime.now().isoformat(timespec="seconds"), "event": event, **fields}
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+            except OSError:
+                pass  # Métricas não podem interromper um download
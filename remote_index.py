@@ -0,0 +1,142 @@
+"""Índice dos arquivos publicados no FTP do DATASUS, com tamanho, data e versão de cada artefato."""
+import re
+from datetime import datetime
+
+# Padrões de cada produto, compilados uma única vez
+BPA_PATTERN = re.compile(r'^bpamag(\d+)\.exe$', re.IGNORECASE)
+SIA_PATTERN = re.compile(r'^instsia(\d{4})\.exe$', re.IGNORECASE)
+BDSIA_PATTERN = re.compile(r'^BDSIA(\d{4})(\d{2})([a-z])\.exe$', re.IGNORECASE)
+FPO_PATTERN = re.compile(r'^fpo.*\.exe$', re.IGNORECASE)
+DIGITS_PATTERN = re.compile(r'\d+')
+
+# Linhas de LIST nos formatos Unix e DOS/IIS
+UNIX_LIST_PATTERN = re.compile(
+    r'^(?P<type>[-dl])\S{9}\s+\d+\s+\S+\s+\S+\s+(?P<size>\d+)\s+'
+    r'(?P<month>\w{3})\s+(?P<day>\d{1,2})\s+(?P<time>\d{1,2}:\d{2}|\d{4})\s+(?P<name>.+)$')
+DOS_LIST_PATTERN = re.compile(
+    r'^(?P<date>\d{2}-\d{2}-\d{2,4})\s+(?P<time>\d{1,2}:\d{2}[AP]M)\s+(?P<size><DIR>|\d+)\s+(?P<name>.+)$',
+    re.IGNORECASE)
+MONTHS = {m: i for i, m in enumerate(("jan", "feb", "mar", "apr", "may", "jun",
+                                      "jul", "aug", "sep", "oct", "nov", "dec"), start=1)}
+
+
+def _mlsd_modify(value):
+    """Converte o fato modify do MLSD (AAAAMMDDHHMMSS[.sss]) em 'AAAAMMDDHHMMSS'."""
+    return value.split(".")[0] if value else None
+
+
+def _parse_list_line(line, now=None):
+    """Interpreta uma linha de LIST; retorna (nome, tipo, tamanho, modify) ou None se o formato for desconhecido."""
+    match = UNIX_LIST_PATTERN.match(line)
+    if match:
+        month = MONTHS.get(match["month"].lower(), 1)
+        day = int(match["day"])
+        if ":" in match["time"]:
+            now = now or datetime.now()
+            hour, minute = (int(v) for v in match["time"].split(":"))
+            year = now.year if (month, day) <= (now.month, now.day) else now.year - 1
+        else:
+            year, hour, minute = int(match["time"]), 0, 0
+        kind = {"d": "dir", "l": "link"}.get(match["type"], "file")
+        return match["name"], kind, int(match["size"]), f"{year:04d}{month:02d}{day:02d}{hour:02d}{minute:02d}00"
+    match = DOS_LIST_PATTERN.match(line)
+    if match:
+        stamp = datetime.strptime(f"{match['date']} {match['time'].upper()}",
+                                  "%m-%d-%y %I:%M%p" if len(match["date"]) == 8 else "%m-%d-%Y %I:%M%p")
+        is_dir = match["size"].upper() == "<DIR>"
+        return match["name"], "dir" if is_dir else "file", None if is_dir else int(match["size"]), stamp.strftime("%Y%m%d%H%M%S")
+    return None
+
+
+def list_entries(ftp):
+    """Lista o diretório atual com MLSD (ou LIST, se o servidor não o suportar).
+
+    Retorna uma lista de {"name", "size", "modify"} apenas para arquivos.
+    """
+    from ftplib import error_perm
+
+    entries = []
+    try:
+        for name, facts in ftp.mlsd(facts=["type", "size", "modify"]):
+            if facts.get("type", "file") != "file":
+                continue
+            size = facts.get("size")
+            entries.append({"name": name, "size": int(size) if size else None, "modify": _mlsd_modify(facts.get("modify"))})
+        return entries
+    except error_perm:
+        pass
+    lines = []
+    ftp.retrlines("LIST", lines.append)
+    for line in lines:
+        parsed = _parse_list_line(line)
+        if parsed and parsed[1] == "file":
+            name, _, size, modify = parsed
+            entries.append({"name": name, "size": size, "modify": modify})
+    return entries
+
+
+def classify(name):
+    """Identifica produto, tipo, versão e competência de um arquivo pelo nome; retorna None se não for um artefato."""
+    match = BPA_PATTERN.match(name)
+    if match:
+        return {"product": "bpa", "kind": "installer", "version": (int(match[1]),)}
+    match = SIA_PATTERN.match(name)
+    if match:
+        return {"product": "sia", "kind": "installer", "version": (int(match[1]),)}
+    match = BDSIA_PATTERN.match(name)
+    if match:
+        year, month, letter = match[1], match[2], match[3].lower()
+        return {"product": "bdsia", "kind": "table", "version": (int(year), int(month), letter),
+                "competencia": year + month, "letter": letter}
+    if FPO_PATTERN.match(name):
+        kind = "installer" if "instalador" in name.lower() else "update"
+        return {"product": "fpo", "kind": kind, "version": tuple(int(d) for d in DIGITS_PATTERN.findall(name))}
+    if "instalador" in name.lower() and name.lower().endswith(".exe"):
+        return {"product": "fpo", "kind": "installer", "version": tuple(int(d) for d in DIGITS_PATTERN.findall(name))}
+    return None
+
+
+class RemoteIndex:
+    """Artefatos de um ou mais diretórios do FTP, classificados por produto e consultáveis por versão e competência."""
+    def __init__(self):
+        self._artifacts = []
+        self._by_name = {}
+
+    def add_directory(self, ftp_path, entries, products=None):
+        """Classifica em uma única passada as entradas listadas em ftp_path.
+
+        products restringe os produtos aceitos no diretório (ex.: apenas "fpo" em /siasus/fpo/).
+        """
+        for entry in entries:
+            info = classify(entry["name"])
+            if info is None or (products and info["product"] not in products):
+                continue
+            artifact = dict(entry, ftp_path=ftp_path, **info)
+            self._artifacts.append(artifact)
+            self._by_name[(ftp_path, entry["name"])] = artifact
+        return self
+
+    def _sort_key(self, artifact):
+        return artifact["version"], artifact["modify"] or ""
+
+    def query(self, product, kind=None, competencia=None):
+        """Artefatos do produto (opcionalmente de um tipo e competência), do mais recente ao mais antigo."""
+        found = [a for a in self._artifacts
+                 if a["product"] == product
+                 and (kind is None or a["kind"] == kind)
+                 and (competencia is None or a.get("competencia") == competencia)]
+        return sorted(found, key=self._sort_key, reverse=True)
+
+    def latest(self, product, kind=None, competencia=None):
+        """Artefato mais recente do produto, ou None."""
+        found = self.query(product, kind, competencia)
+        return found[0] if found else None
+
+    def competencias(self, product="bdsia"):
+        """Competências (AAAAMM) disponíveis, da mais recente para a mais antiga."""
+        return sorted({a["competencia"] for a in self._artifacts if a["product"] == product and a.get("competencia")},
+                      reverse=True)
+
+    def get(self, ftp_path, name):
+        """Artefato pelo diretório e nome do arquivo, ou None."""
+        return self._by_name.get((ftp_path, name))
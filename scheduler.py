@@ -0,0 +1,233 @@
+"""Fila central de downloads: número limitado de transferências simultâneas, prioridades e limite de banda."""
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from remote_index import classify
+from tracing import span
+
+MAX_CONCURRENT_DOWNLOADS = 2  # Transferências simultâneas; as demais aguardam na fila
+CANCEL_POLL_INTERVAL = 0.2  # Intervalo máximo, em segundos, entre checagens de cancelamento durante uma espera
+
+# Prioridades (menor = antes): instaladores, depois tabelas, depois arquivos grandes do CNES
+PRIORITY_INSTALLER = 0
+PRIORITY_TABLE = 10
+PRIORITY_ARCHIVE = 20
+
+# Situação de cada download na fila
+JOB_QUEUED = "na_fila"
+JOB_RUNNING = "em_andamento"
+JOB_DONE = "concluido"
+JOB_FAILED = "erro"
+JOB_CANCELLED = "cancelado"
+
+
+class TransferCancelled(Exception):
+    """O download foi cancelado pelo usuário."""
+
+
+def download_priority(filename):
+    """Prioridade padrão de um arquivo: instaladores antes do BDSIA, que vem antes de zips do CNES."""
+    info = classify(filename)
+    if info is None:
+        return PRIORITY_ARCHIVE
+    return PRIORITY_TABLE if info["product"] == "bdsia" else PRIORITY_INSTALLER
+
+
+class TokenBucket:
+    """Limita a vazão a rate bytes/s, permitindo rajadas de até um segundo; rate 0 desativa o limite."""
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = max(0, rate or 0)
+            self._tokens = min(self._tokens, self.rate)
+            self._updated = time.monotonic()
+
+    def consume(self, amount, cancelled=None):
+        """Retira amount bytes do balde, aguardando a reposição se necessário.
+
+        O saldo pode ficar negativo (blocos maiores que o balde); a espera é cobrada no pedido seguinte.
+        Levanta TransferCancelled se o evento cancelled for sinalizado durante a espera.
+        """
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens > 0:
+                    self._tokens -= amount
+                    return
+                wait = -self._tokens / self.rate
+            if cancelled is None:
+                time.sleep(min(wait, CANCEL_POLL_INTERVAL))
+            elif cancelled.wait(min(wait, CANCEL_POLL_INTERVAL)):
+                raise TransferCancelled("Download cancelado.")
+
+
+class DownloadJob:
+    """Um download na fila: task(limiter) é executada por um worker do DownloadScheduler."""
+    def __init__(self, job_id, name, priority, task, rate):
+        self.id = job_id
+        self.name = name
+        self.priority = priority
+        self.task = task
+        self.status = JOB_QUEUED
+        self.error = None
+        self.future = Future()  # Resultado de task, ou a exceção que a interrompeu
+        self.cancelled = threading.Event()
+        self.bucket = TokenBucket(rate)
+
+    def snapshot(self):
+        return {"id": self.id, "name": self.name, "priority": self.priority, "status": self.status, "error": self.error}
+
+
+class DownloadScheduler:
+    """Executa downloads em um pool limitado, na ordem da fila, sob um limite global e um por transferência.
+
+    A função task de cada download recebe um limiter(nbytes) que deve ser chamado a cada bloco
+    recebido: ele aplica os limites de banda e levanta TransferCancelled se o download for cancelado.
+    on_change() é chamado, em qualquer thread, sempre que a fila muda.
+    """
+    def __init__(self, max_workers=MAX_CONCURRENT_DOWNLOADS, rate_limit=0, per_transfer_limit=0, on_change=None):
+        self.max_workers = max(1, max_workers)
+        self.per_transfer_limit = per_transfer_limit
+        self.on_change = on_change
+        self.bucket = TokenBucket(rate_limit)
+        self._lock = threading.Condition()
+        self._queue = []  # Downloads aguardando, na ordem em que serão iniciados
+        self._running = {}  # Id -> download em andamento
+        self._ids = itertools.count(1)
+        self._workers = 0
+        self._closed = False
+
+    def submit(self, name, task, priority=PRIORITY_ARCHIVE):
+        """Enfileira um download; se já houver um com o mesmo nome na fila ou em andamento, retorna esse."""
+        with self._lock:
+            for job in self._queue + list(self._running.values()):
+                if job.name == name:
+                    return job
+            job = DownloadJob(next(self._ids), name, priority, task, self.per_transfer_limit)
+            position = len(self._queue)
+            while position > 0 and self._queue[position - 1].priority > priority:
+                position -= 1
+            self._queue.insert(position, job)
+            if self._workers < min(self.max_workers, len(self._queue) + len(self._running)):
+                self._workers += 1
+                threading.Thread(target=self._worker, name="download", daemon=True).start()
+            self._lock.notify()
+        self._changed()
+        return job
+
+    def cancel(self, job_id):
+        """Cancela um download na fila ou em andamento (o .part é mantido para retomada)."""
+        with self._lock:
+            job = next((j for j in self._queue if j.id == job_id), None)
+            if job is not None:
+                self._queue.remove(job)
+                job.status = JOB_CANCELLED
+                job.future.cancel()
+            else:
+                job = self._running.get(job_id)
+            if job is None:
+                return False
+            job.cancelled.set()
+        self._changed()
+        return True
+
+    def move(self, job_id, offset):
+        """Adianta (offset < 0) ou atrasa (offset > 0) um download que ainda está na fila."""
+        with self._lock:
+            job = next((j for j in self._queue if j.id == job_id), None)
+            if job is None:
+                return False
+            position = max(0, min(len(self._queue) - 1, self._queue.index(job) + offset))
+            self._queue.remove(job)
+            self._queue.insert(position, job)
+        self._changed()
+        return True
+
+    def set_limits(self, rate_limit=None, per_transfer_limit=None, max_workers=None):
+        """Altera os limites de banda (bytes/s, 0 = ilimitado) e de transferências simultâneas."""
+        with self._lock:
+            if rate_limit is not None:
+                self.bucket.set_rate(rate_limit)
+            if per_transfer_limit is not None:
+                self.per_transfer_limit = per_transfer_limit
+                for job in self._queue + list(self._running.values()):
+                    job.bucket.set_rate(per_transfer_limit)
+            if max_workers is not None:
+                self.max_workers = max(1, max_workers)
+                while self._workers < min(self.max_workers, len(self._queue) + len(self._running)):
+                    self._workers += 1
+                    threading.Thread(target=self._worker, name="download", daemon=True).start()
+                self._lock.notify_all()
+
+    def snapshot(self):
+        """Downloads em andamento e na fila, nesta ordem."""
+        with self._lock:
+            return [job.snapshot() for job in list(self._running.values()) + self._queue]
+
+    def _limiter(self, job):
+        def limiter(nbytes):
+            if job.cancelled.is_set():
+                raise TransferCancelled("Download cancelado.")
+            job.bucket.consume(nbytes, job.cancelled)
+            self.bucket.consume(nbytes, job.cancelled)
+        return limiter
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._closed and not self._queue and self._workers <= self.max_workers:
+                    self._lock.wait()
+                if self._closed or not self._queue or self._workers > self.max_workers:
+                    self._workers -= 1
+                    return
+                job = self._queue.pop(0)
+                job.status = JOB_RUNNING
+                self._running[job.id] = job
+            self._changed()
+            try:
+                with span("fila.download", "fila", job=job.name, priority=job.priority):
+                    result = job.task(self._limiter(job))
+            except TransferCancelled as e:
+                job.status = JOB_CANCELLED
+                job.future.set_exception(e)
+            except Exception as e:
+                job.status, job.error = JOB_FAILED, str(e)
+                job.future.set_exception(e)
+            else:
+                job.status = JOB_DONE
+                job.future.set_result(result)
+            with self._lock:
+                del self._running[job.id]
+            self._changed()
+
+    def _changed(self):
+        if self.on_change:
+            try:
+                self.on_change()
+            except Exception:
+                pass  # Uma falha ao exibir a fila não deve interromper os downloads
+
+    def shutdown(self):
+        """Cancela tudo o que está na fila ou em andamento."""
+        with self._lock:
+            self._closed = True
+            jobs = self._queue + list(self._running.values())
+            for job in self._queue:
+                job.status = JOB_CANCELLED
+                job.future.cancel()
+            self._queue.clear()
+            for job in jobs:
+                job.cancelled.set()
+            self._lock.notify_all()
@@ -0,0 +1,205 @@
+"""Fontes equivalentes dos arquivos do DATASUS (servidores FTP, espelhos da rede local e pastas locais).
+
+Cada fonte mantém uma média móvel de latência e de vazão; as listagens são disputadas entre as
+fontes (a primeira que responder vence) e os downloads seguem a ordem de desempenho esperado.
+Fontes que falham são rebaixadas por um tempo crescente e só voltam a ser preferidas após um sucesso.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+SOURCE_FTP = "ftp"
+SOURCE_MIRROR = "espelho"
+SOURCE_LOCAL = "pasta"
+
+RACE_STAGGER = 0.3  # Segundos de vantagem dados a cada fonte antes de a próxima entrar na disputa
+SCORE_WEIGHT = 0.3  # Peso da medição mais recente nas médias de latência e vazão
+DEMOTE_INITIAL = 30  # Segundos de rebaixamento após a primeira falha seguida de uma fonte
+DEMOTE_MAX = 15 * 60  # Rebaixamento máximo
+
+
+def parse_source(spec):
+    """Interpreta 'ftp://host[:porta]', 'http(s)://espelho[:porta]' ou o caminho de uma pasta (ou file://)."""
+    spec = spec.strip()
+    lowered = spec.lower()
+    if lowered.startswith("ftp://"):
+        host, _, port = spec[len("ftp://"):].strip("/").partition(":")
+        return {"key": f"ftp://{host}:{port or 21}", "kind": SOURCE_FTP, "host": host, "port": int(port or 21)}
+    if lowered.startswith(("http://", "https://")):
+        url = spec.rstrip("/")
+        return {"key": url, "kind": SOURCE_MIRROR, "url": url}
+    root = spec[len("file://"):] if lowered.startswith("file://") else spec
+    return {"key": f"file://{os.path.abspath(root)}", "kind": SOURCE_LOCAL, "root": root}
+
+
+def local_path(source, ftp_path, filename=""):
+    """Caminho, em uma fonte do tipo pasta, de um diretório do FTP (mesma estrutura da pasta do espelho)."""
+    return os.path.join(source["root"], "ftp", *ftp_path.strip("/").split("/"), filename)
+
+
+def local_entries(source, ftp_path):
+    """Lista uma pasta local no mesmo formato de remote_index.list_entries."""
+    entries = []
+    with os.scandir(local_path(source, ftp_path)) as it:
+        for entry in it:
+            if entry.is_file() and not entry.name.endswith((".part", ".tmp", ".json")):
+                stat = entry.stat()
+                entries.append({"name": entry.name, "size": stat.st_size,
+                                "modify": time.strftime("%Y%m%d%H%M%S", time.gmtime(stat.st_mtime))})
+    return entries
+
+
+def _average(previous, sample):
+    return sample if previous is None else previous + SCORE_WEIGHT * (sample - previous)
+
+
+class SourceSelector:
+    """Ordena as fontes configuradas pelo desempenho recente e escolhe a que atende cada operação.
+
+    As pontuações são gravadas em path (se informado) para orientar as próximas execuções.
+    """
+    def __init__(self, specs, path=None, stagger=RACE_STAGGER):
+        self.sources = []
+        for spec in specs:
+            source = parse_source(spec)
+            if all(source["key"] != s["key"] for s in self.sources):
+                self.sources.append(source)
+        self.path = path
+        self.stagger = stagger
+        self._lock = threading.Lock()
+        self._scores = self._load()  # Chave -> {latency, throughput, failures, demoted_until}
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                scores = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return scores if isinstance(scores, dict) else {}
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._scores, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # Sem o arquivo as fontes apenas voltam a ser medidas na próxima execução
+
+    def _score(self, source):
+        return self._scores.setdefault(source["key"], {"latency": None, "throughput": None, "failures": 0,
+                                                        "demoted_until": 0})
+
+    def ranked(self, kinds=None, size=None):
+        """Fontes dos tipos pedidos, da melhor para a pior; as rebaixadas ficam por último.
+
+        Com size, a ordem considera o tempo esperado de transferência (latência + size / vazão).
+        Fontes ainda não medidas contam como ótimas, para que sejam experimentadas.
+        """
+        now = time.time()
+        with self._lock:
+            def key(item):
+                position, source = item
+                score = self._score(source)
+                expected = score["latency"] or 0
+                if size and score["throughput"]:
+                    expected += size / score["throughput"]
+                demoted = score["demoted_until"] > now
+                return demoted, score["demoted_until"] if demoted else 0, expected, position
+            candidates = [(i, s) for i, s in enumerate(self.sources) if kinds is None or s["kind"] in kinds]
+            return [source for _, source in sorted(candidates, key=key)]
+
+    def record_success(self, source, latency=None, nbytes=None, elapsed=None):
+        """Atualiza as médias da fonte e desfaz um rebaixamento."""
+        with self._lock:
+            score = self._score(source)
+            if latency is not None:
+                score["latency"] = round(_average(score["latency"], latency), 4)
+            if nbytes and elapsed:
+                score["throughput"] = round(_average(score["throughput"], nbytes / elapsed), 1)
+            score["failures"] = 0
+            score["demoted_until"] = 0
+            self._save()
+
+    def record_slow(self, source, elapsed):
+        """Conta como latência o tempo que uma fonte ainda sem resposta já levou, sem desfazer rebaixamentos."""
+        with self._lock:
+            score = self._score(source)
+            score["latency"] = round(_average(score["latency"], max(elapsed, score["latency"] or 0)), 4)
+
+    def record_failure(self, source):
+        """Rebaixa a fonte por um tempo que dobra a cada falha seguida; retorna a duração em segundos."""
+        with self._lock:
+            score = self._score(source)
+            score["failures"] += 1
+            duration = min(DEMOTE_MAX, DEMOTE_INITIAL * 2 ** (score["failures"] - 1))
+            score["demoted_until"] = time.time() + duration
+            self._save()
+            return duration
+
+    def scores(self):
+        """Cópia das pontuações de cada fonte configurada."""
+        with self._lock:
+            return {source["key"]: dict(self._score(source)) for source in self.sources}
+
+    def race(self, operation, kinds=None, cancel=None):
+        """Executa operation(fonte) escalonadamente e retorna (fonte, resultado) da primeira que concluir.
+
+        A melhor fonte começa sozinha; se não responder em stagger segundos (ou falhar antes disso),
+        a próxima entra na disputa, e assim por diante. Tentativas perdedoras continuam em segundo plano
+        apenas para atualizar as pontuações. Levanta ConnectionError se todas falharem.
+        Com um CancelToken (ver orchestrator), o cancelamento encerra a espera pelas fontes.
+        """
+        candidates = self.ranked(kinds)
+        if not candidates:
+            raise LookupError("Nenhuma fonte configurada.")
+        results = queue.SimpleQueue()
+        started = {}  # Chave -> instante de início das tentativas ainda sem resposta
+
+        def attempt(source):
+            try:
+                value = operation(source)
+            except Exception as e:
+                self.record_failure(source)
+                results.put((source, None, e))
+            else:
+                self.record_success(source, latency=time.monotonic() - started[source["key"]])
+                results.put((source, value, None))
+
+        errors = []
+        pending = 0
+        with cancel.aborting(lambda: results.put(None)) if cancel else nullcontext():
+            for position, source in enumerate(candidates):
+                started[source["key"]] = time.monotonic()
+                threading.Thread(target=attempt, args=(source,), name="fonte", daemon=True).start()
+                pending += 1
+                last = position == len(candidates) - 1
+                deadline = time.monotonic() + self.stagger
+                while pending:
+                    try:
+                        item = results.get(timeout=None if last else max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break  # Sem resposta a tempo: a próxima fonte entra na disputa
+                    if item is None:
+                        cancel.check()
+                        continue
+                    winner, value, error = item
+                    pending -= 1
+                    if error is None:
+                        now = time.monotonic()
+                        for loser in candidates[:position + 1]:
+                            if loser is not winner and loser["key"] in started:
+                                self.record_slow(loser, now - started[loser["key"]])  # Ainda sem resposta
+                        return winner, value
+                    del started[winner["key"]]
+                    errors.append(f"{winner['key']}: {error}")
+                    if not last:
+                        break  # Falha rápida: não há por que esperar o fim da vantagem
+        raise ConnectionError("Nenhuma fonte respondeu (" + "; ".join(errors) + ").")
@@ -0,0 +1,40 @@
+"""Servidores FTP e HTTP locais do benchmark.py, compartilhados pelos testes."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import LocalFTPServer, LocalHTTPServer, Throttle, start_server, build_tree  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def served_root(tmp_path_factory):
+    """Árvore sintética do FTP (BPA, SIA, FPO) e o zip do CNES."""
+    root = str(tmp_path_factory.mktemp("datasus"))
+    build_tree(root)
+    return root
+
+
+@pytest.fixture
+def ftp_server(served_root):
+    server = start_server(LocalFTPServer(served_root, Throttle()))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def http_server(served_root):
+    server = start_server(LocalHTTPServer(served_root, Throttle()))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Pasta de trabalho vazia, também usada como diretório atual (o Engine grava arquivos relativos)."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,113 @@
+"""Rotação do log em segmentos compactados e consulta pelo índice."""
+import logging
+import os
+import time
+
+import activity_log
+from activity_log import RotatingJsonHandler, load_index, query
+
+
+def _logger(handler):
+    logger = logging.getLogger(f"teste.{id(handler)}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    return logger
+
+
+def _emit(logger, count):
+    for i in range(count):
+        product = ("bpa", "sia")[i % 2]
+        level = logging.WARNING if i % 10 == 0 else logging.INFO
+        logger.log(level, f"Registro {i} de {product.upper()}",
+                   extra={"fields": {"event": "download", "product": product, "bytes": i}})
+        time.sleep(0.002)  # Segmentos são nomeados pelo instante do primeiro registro, em milissegundos
+
+
+def test_rotation_and_index(tmp_path):
+    path, archive = str(tmp_path / "atividade.log"), str(tmp_path / "arquivo")
+    handler = RotatingJsonHandler(path, archive, max_bytes=2000, keep=100)
+    _emit(_logger(handler), 200)
+    handler.close()
+
+    index = load_index(archive)
+    assert len(index) > 5
+    with open(path, encoding='utf-8') as f:
+        assert sum(segment["records"] for segment in index) + len(f.readlines()) == 200
+    assert all(os.path.exists(os.path.join(archive, segment["segment"])) for segment in index)
+    assert {"bpa", "sia"} <= set(index[0]["products"])
+
+
+def test_rotation_keeps_newest_segments(tmp_path):
+    path, archive = str(tmp_path / "atividade.log"), str(tmp_path / "arquivo")
+    handler = RotatingJsonHandler(path, archive, max_bytes=2000, keep=3)
+    _emit(_logger(handler), 200)
+    handler.close()
+
+    index = load_index(archive)
+    assert len(index) == 3
+    assert sorted(name for name in os.listdir(archive) if name.endswith(".gz")) == \
+        sorted(segment["segment"] for segment in index)
+
+
+def test_query_filters(tmp_path):
+    path, archive = str(tmp_path / "atividade.log"), str(tmp_path / "arquivo")
+    handler = RotatingJsonHandler(path, archive, max_bytes=2000, keep=100)
+    _emit(_logger(handler), 200)
+    handler.close()
+
+    records = list(query(path, archive))
+    assert [r["bytes"] for r in records] == list(range(200))
+    assert len(list(query(path, archive, product="sia"))) == 100
+    assert len(list(query(path, archive, level="warning"))) == 20
+    assert list(query(path, archive, event="backup")) == []
+    assert [r["bytes"] for r in query(path, archive, text="registro 42 ")] == [42]
+    day = records[0]["time"][:10]
+    assert len(list(query(path, archive, since=day, until=day))) == 200
+
+
+def test_query_skips_segments_by_index(tmp_path):
+    path, archive = str(tmp_path / "atividade.log"), str(tmp_path / "arquivo")
+    handler = RotatingJsonHandler(path, archive, max_bytes=2000, keep=100)
+    logger = _logger(handler)
+    logger.info("Download do FPO", extra={"fields": {"event": "download", "product": "fpo"}})
+    handler.rotate()
+    _emit(logger, 10)
+    handler.close()
+    segment = load_index(archive)[0]
+    assert segment["products"] == ["fpo"]
+    with open(os.path.join(archive, segment["segment"]), 'wb') as f:
+        f.write(b"corrompido")  # Não deve ser aberto: o índice diz que não há registros do BPA nele
+
+    assert len(list(query(path, archive, product="bpa"))) == 5
+
+
+def test_rotation_failure_keeps_appending(tmp_path, monkeypatch):
+    path, archive = str(tmp_path / "atividade.log"), str(tmp_path / "arquivo")
+    handler = RotatingJsonHandler(path, archive, max_bytes=2000, keep=100)
+    remove = os.remove
+
+    def locked_remove(target):
+        if os.path.abspath(target) == os.path.abspath(path):
+            raise PermissionError("arquivo em uso")
+        remove(target)
+
+    monkeypatch.setattr(activity_log.os, "remove", locked_remove)
+    _emit(_logger(handler), 200)
+    handler.close()
+
+    with open(path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 200  # Nenhum registro perdido; o arquivo atual nunca foi apagado
+    assert 0 < len(load_index(archive)) < 20  # Novas tentativas só a cada max_bytes, não a cada registro
+
+
+def test_query_event_alias_in_older_segments(tmp_path):
+    path, archive = str(tmp_path / "atividade.log"), str(tmp_path / "arquivo")
+    handler = RotatingJsonHandler(path, archive, max_bytes=2000, keep=100)
+    logger = _logger(handler)
+    logger.info("Extração do CNES", extra={"fields": {"event": "extraction", "product": "cnes"}})
+    handler.rotate()
+    logger.info("Extração do CNES", extra={"fields": {"event": "extracao", "product": "cnes"}})
+    handler.close()
+
+    assert [r["event"] for r in query(path, archive, event="extracao")] == ["extraction", "extracao"]
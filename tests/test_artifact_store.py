@@ -0,0 +1,37 @@
+"""SHA-256 calculado durante downloads segmentados."""
+import hashlib
+import os
+
+from artifact_store import StreamingHasher
+
+
+def test_streaming_hasher_out_of_order(tmp_path):
+    data = os.urandom(1024 * 1024)
+    path = str(tmp_path / "arquivo.part")
+    with open(path, 'wb') as f:
+        f.write(data)
+    hasher = StreamingHasher(buffer_limit=64 * 1024)
+    hasher.reset(path)
+    blocks = [(offset, data[offset:offset + 32 * 1024]) for offset in range(0, len(data), 32 * 1024)]
+    # Segundo segmento gravado antes do primeiro: só 64 KB dele cabem na memória
+    for offset, block in blocks[16:] + blocks[:16]:
+        hasher.update(offset, block)
+
+    assert hasher.position == len(data)  # Tudo entrou no hash durante o "download"
+    assert hasher._buffered == 0
+    assert hasher.hexdigest(path) == hashlib.sha256(data).hexdigest()
+
+
+def test_streaming_hasher_resumed_segments(tmp_path):
+    data = os.urandom(256 * 1024)
+    path = str(tmp_path / "arquivo.part")
+    with open(path, 'wb') as f:
+        f.write(data)
+    hasher = StreamingHasher()
+    hasher.reset(path, 1000)
+    hasher.written(128 * 1024, 64 * 1024)  # Parte do segundo segmento já estava no .part
+    hasher.update(1000, data[1000:128 * 1024])
+    hasher.update(192 * 1024, data[192 * 1024:])
+
+    assert hasher.position == len(data)
+    assert hasher.hexdigest(path) == hashlib.sha256(data).hexdigest()
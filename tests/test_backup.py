@@ -0,0 +1,94 @@
+"""Backup incremental deduplicado e restauração das pastas de trabalho."""
+import os
+import zlib
+
+import pytest
+
+import backup
+from backup import BackupRepository
+from benchmark import MB
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _workfolder(path):
+    os.makedirs(path / "dados")
+    (path / "BPAMAG.FDB").write_bytes(os.urandom(8 * MB))
+    (path / "dados" / "tabela.dbf").write_bytes(os.urandom(MB // 2))
+    (path / "versao.txt").write_text("0309")
+    return path
+
+
+def test_snapshot_and_restore(tmp_path):
+    folder = _workfolder(tmp_path / "BPA")
+    repository = BackupRepository(str(tmp_path / "repositorio"))
+
+    summary = repository.snapshot("BPA", str(folder), reason="teste")
+
+    assert summary["errors"] == {}
+    assert summary["read_bytes"] == summary["size"] == 8 * MB + MB // 2 + 4
+    target = tmp_path / "restaurado"
+    assert repository.restore(summary["id"], str(target)) == 3
+    for relative in ("BPAMAG.FDB", "dados/tabela.dbf", "versao.txt"):
+        assert _read(target / relative) == _read(folder / relative)
+
+
+def test_incremental_snapshot_reads_only_changed_files(tmp_path):
+    folder = _workfolder(tmp_path / "BPA")
+    repository = BackupRepository(str(tmp_path / "repositorio"))
+    first = repository.snapshot("BPA", str(folder))
+    original = _read(folder / "BPAMAG.FDB")
+
+    with open(folder / "BPAMAG.FDB", 'r+b') as f:  # Alteração pontual no meio do banco
+        f.seek(4 * MB)
+        f.write(b"alterado")
+    second = repository.snapshot("BPA", str(folder))
+
+    assert second["read_bytes"] == 8 * MB
+    assert 0 < second["stored_bytes"] < first["stored_bytes"] // 3  # Só os blocos alterados são novos
+    assert [s["id"] for s in repository.snapshots("BPA")] == [second["id"], first["id"]]
+
+    repository.restore(first["id"])
+    assert _read(folder / "BPAMAG.FDB") == original
+
+
+def test_restore_detects_corrupted_chunk(tmp_path):
+    folder = _workfolder(tmp_path / "BPA")
+    repository = BackupRepository(str(tmp_path / "repositorio"))
+    summary = repository.snapshot("BPA", str(folder))
+    chunk = repository.load(summary["id"])["files"]["versao.txt"]["chunks"][0]
+    with open(repository.chunk_path(chunk), 'wb') as f:
+        f.write(zlib.compress(b"outro conteudo"))
+
+    with pytest.raises(ValueError):
+        repository.restore(summary["id"], str(tmp_path / "restaurado"))
+
+
+def test_database_in_use_is_reported(tmp_path, monkeypatch):
+    folder = _workfolder(tmp_path / "BPA")
+    repository = BackupRepository(str(tmp_path / "repositorio"))
+
+    def database_in_use(path):
+        raise backup.DatabaseInUseError(f"Banco de dados em uso: {path}")
+
+    monkeypatch.setattr(backup, "_open_database", database_in_use)
+    summary = repository.snapshot("BPA", str(folder))
+
+    assert list(summary["errors"]) == ["BPAMAG.FDB"]
+    assert sorted(repository.load(summary["id"])["files"]) == ["dados/tabela.dbf", "versao.txt"]
+
+
+def test_restore_in_place_keeps_newer_files(tmp_path):
+    folder = _workfolder(tmp_path / "BPA")
+    repository = BackupRepository(str(tmp_path / "repositorio"))
+    summary = repository.snapshot("BPA", str(folder))
+    (folder / "versao.txt").write_text("0410")
+    (folder / "novo.txt").write_text("criado depois")
+
+    repository.restore(summary["id"])
+
+    assert (folder / "versao.txt").read_text() == "0309"
+    assert (folder / "novo.txt").read_text() == "criado depois"
@@ -0,0 +1,73 @@
+"""Deltas binários entre versões de um instalador."""
+import os
+
+import pytest
+
+from benchmark import MB
+from delta import DELTA_MAX_RATIO, DeltaError, apply_delta, make_delta
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def versions(tmp_path):
+    old_path = str(tmp_path / "instsia0123.exe")
+    new_path = str(tmp_path / "instsia0124.exe")
+    data = bytearray(os.urandom(2 * MB))
+    with open(old_path, 'wb') as f:
+        f.write(data)
+    data[MB:MB] = os.urandom(10 * 1024)  # Trecho inserido: desloca todo o restante
+    data[100:200] = bytes(100)
+    with open(new_path, 'wb') as f:
+        f.write(data)
+    return old_path, new_path
+
+
+def test_delta_roundtrip(tmp_path, versions):
+    old_path, new_path = versions
+    delta_path = str(tmp_path / "sia.delta")
+
+    header = make_delta(old_path, new_path, delta_path)
+
+    assert header["new"]["size"] == os.path.getsize(new_path)
+    assert header["delta_size"] < DELTA_MAX_RATIO * header["new"]["size"]
+    assert header["delta_size"] < 200 * 1024
+    save_path = str(tmp_path / "reconstruido.exe")
+    assert apply_delta(old_path, delta_path, save_path) == header["new"]["sha256"]
+    assert _read(save_path) == _read(new_path)
+    assert not os.path.exists(save_path + ".tmp")
+
+
+def test_delta_rejects_different_old_version(tmp_path, versions):
+    old_path, new_path = versions
+    delta_path = str(tmp_path / "sia.delta")
+    make_delta(old_path, new_path, delta_path)
+    with open(old_path, 'r+b') as f:
+        f.seek(MB // 2)
+        f.write(b"outra versao")
+    save_path = str(tmp_path / "reconstruido.exe")
+    with open(save_path, 'wb') as f:
+        f.write(b"anterior")
+
+    with pytest.raises(DeltaError):
+        apply_delta(old_path, delta_path, save_path)
+
+    assert _read(save_path) == b"anterior"
+    assert not os.path.exists(save_path + ".tmp")
+
+
+def test_delta_rejects_unexpected_size(tmp_path, versions):
+    old_path, new_path = versions
+    delta_path = str(tmp_path / "sia.delta")
+    header = make_delta(old_path, new_path, delta_path)
+    save_path = str(tmp_path / "reconstruido.exe")
+    with open(save_path, 'wb') as f:
+        f.write(b"anterior")
+
+    with pytest.raises(DeltaError):
+        apply_delta(old_path, delta_path, save_path, header["new"]["size"] + 1)
+
+    assert _read(save_path) == b"anterior"
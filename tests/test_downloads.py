@@ -0,0 +1,201 @@
+"""Downloads FTP e HTTP: retomada com REST, segmentos com checkpoint no sidecar e requisições condicionais."""
+import hashlib
+import json
+import os
+import time
+
+import pytest
+
+import downloads
+from artifact_store import StreamingHasher
+from benchmark import CNES_FILE, MB, write_synthetic_file
+from downloads import META_SUFFIX, PART_SUFFIX, download_ftp_resumable, download_http
+from ftp_pool import FTPPool
+from http_cache import HTTPMetadataCache, create_session
+
+BPA_PATH = "/siasus/BPA/"
+BPA_FILE = "bpamag0309.exe"
+
+
+def _quiet(message, level="info"):
+    pass
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def pool(ftp_server):
+    pool = FTPPool("127.0.0.1", ftp_server.port, max_connections=5)
+    yield pool
+    pool.close_all()
+
+
+def _remote_meta(pool, filename):
+    with pool.connection(BPA_PATH) as ftp:
+        size, mtime = downloads.remote_file_info(ftp, filename)
+    return {"size": size, "mtime": mtime}
+
+
+def test_ftp_download(pool, served_root, workdir):
+    save_path = str(workdir / BPA_FILE)
+    download_ftp_resumable(pool, BPA_PATH, BPA_FILE, save_path, log=_quiet)
+    assert _read(save_path) == _read(os.path.join(served_root, "siasus/BPA", BPA_FILE))
+    assert not os.path.exists(save_path + PART_SUFFIX)
+    assert not os.path.exists(save_path + META_SUFFIX)
+
+
+def test_ftp_resume_uses_rest(pool, ftp_server, served_root, workdir):
+    source = _read(os.path.join(served_root, "siasus/BPA", BPA_FILE))
+    save_path = str(workdir / BPA_FILE)
+    received = 300 * 1024
+    # Prefixo zerado: se o download recomeçasse do zero, ele seria sobrescrito com o conteúdo real
+    with open(save_path + PART_SUFFIX, 'wb') as f:
+        f.write(bytes(received))
+    with open(save_path + META_SUFFIX, 'w') as f:
+        json.dump(dict(_remote_meta(pool, BPA_FILE), received=received), f)
+    ftp_server.commands.clear()
+
+    download_ftp_resumable(pool, BPA_PATH, BPA_FILE, save_path, log=_quiet)
+
+    assert "REST" in ftp_server.commands
+    data = _read(save_path)
+    assert data[:received] == bytes(received)
+    assert data[received:] == source[received:]
+
+
+def test_ftp_resume_discarded_when_remote_changed(pool, served_root, workdir):
+    save_path = str(workdir / BPA_FILE)
+    with open(save_path + PART_SUFFIX, 'wb') as f:
+        f.write(bytes(1024))
+    with open(save_path + META_SUFFIX, 'w') as f:
+        json.dump(dict(_remote_meta(pool, BPA_FILE), mtime="19990101000000", received=1024), f)
+
+    download_ftp_resumable(pool, BPA_PATH, BPA_FILE, save_path, log=_quiet)
+
+    assert _read(save_path) == _read(os.path.join(served_root, "siasus/BPA", BPA_FILE))
+
+
+def test_ftp_segments(pool, ftp_server, served_root, workdir):
+    directory = os.path.join(served_root, "segmentos")
+    os.makedirs(directory, exist_ok=True)
+    write_synthetic_file(os.path.join(directory, "grande.exe"), 4 * MB + 123)
+    save_path = str(workdir / "grande.exe")
+    ftp_server.commands.clear()
+
+    download_ftp_resumable(pool, "/segmentos/", "grande.exe", save_path, segments=4, min_segment_size=MB, log=_quiet)
+
+    assert ftp_server.commands.count("RETR") == 4
+    assert _read(save_path) == _read(os.path.join(directory, "grande.exe"))
+
+
+def test_ftp_segments_resume_from_sidecar(pool, ftp_server, served_root, workdir):
+    directory = os.path.join(served_root, "segmentos")
+    os.makedirs(directory, exist_ok=True)
+    write_synthetic_file(os.path.join(directory, "retomado.exe"), 4 * MB)
+    source = _read(os.path.join(directory, "retomado.exe"))
+    save_path = str(workdir / "retomado.exe")
+    with pool.connection("/segmentos/") as ftp:
+        size, mtime = downloads.remote_file_info(ftp, "retomado.exe")
+    ranges = downloads.plan_segments(size, 2, MB)
+    # Primeiro segmento completo, segundo pela metade; o .part tem o conteúdo real do que já foi recebido
+    done = [ranges[0][1] - ranges[0][0], (ranges[1][1] - ranges[1][0]) // 2]
+    part = bytearray(size)
+    part[:done[0]] = source[:done[0]]
+    part[ranges[1][0]:ranges[1][0] + done[1]] = source[ranges[1][0]:ranges[1][0] + done[1]]
+    with open(save_path + PART_SUFFIX, 'wb') as f:
+        f.write(part)
+    with open(save_path + META_SUFFIX, 'w') as f:
+        json.dump({"size": size, "mtime": mtime, "segments": [[s, e, d] for (s, e), d in zip(ranges, done)]}, f)
+    ftp_server.commands.clear()
+
+    download_ftp_resumable(pool, "/segmentos/", "retomado.exe", save_path, segments=2, min_segment_size=MB,
+                           log=_quiet)
+
+    assert ftp_server.commands.count("RETR") == 1  # Só o segmento incompleto volta ao servidor
+    assert _read(save_path) == source
+
+
+def test_segment_checkpoint_during_download(pool, served_root, workdir, monkeypatch):
+    directory = os.path.join(served_root, "segmentos")
+    os.makedirs(directory, exist_ok=True)
+    write_synthetic_file(os.path.join(directory, "checkpoint.exe"), 4 * MB)
+    monkeypatch.setattr(downloads, "SEGMENT_CHECKPOINT_INTERVAL", 0)
+    saved = []
+    write_meta = downloads._write_meta
+
+    def recording_write_meta(meta_path, meta):
+        if "segments" in meta:
+            saved.append(sum(segment[2] for segment in meta["segments"]))
+        write_meta(meta_path, meta)
+
+    monkeypatch.setattr(downloads, "_write_meta", recording_write_meta)
+    save_path = str(workdir / "checkpoint.exe")
+
+    download_ftp_resumable(pool, "/segmentos/", "checkpoint.exe", save_path, segments=2, min_segment_size=MB,
+                           block_size=64 * 1024, log=_quiet)
+
+    assert any(0 < received < 4 * MB for received in saved)
+    assert saved[-1] == 4 * MB
+
+
+def test_http_segments(http_server, served_root, workdir):
+    save_path = str(workdir / CNES_FILE)
+    with create_session() as session:
+        assert download_http(session, http_server.url(CNES_FILE), save_path, segments=4, min_segment_size=MB,
+                             log=_quiet)
+    assert _read(save_path) == _read(os.path.join(served_root, CNES_FILE))
+    assert not os.path.exists(save_path + META_SUFFIX)
+
+
+def test_http_without_ranges(http_server, served_root, workdir):
+    http_server.accept_ranges = False
+    save_path = str(workdir / CNES_FILE)
+    with create_session() as session:
+        download_http(session, http_server.url(CNES_FILE), save_path, segments=4, min_segment_size=MB, log=_quiet)
+    assert _read(save_path) == _read(os.path.join(served_root, CNES_FILE))
+
+
+def test_cnes_conditional_download(http_server, served_root, workdir):
+    save_path = str(workdir / CNES_FILE)
+    cache = HTTPMetadataCache(str(workdir / "cache.json"))
+    url = http_server.url(CNES_FILE)
+    with create_session() as session:
+        assert download_http(session, url, save_path, cache=cache, log=_quiet)
+        assert not download_http(session, url, save_path, cache=cache, log=_quiet)  # 304: cópia local mantida
+
+        # Cópia local de tamanho diferente: a requisição deixa de ser condicional
+        with open(save_path, 'ab') as f:
+            f.write(b"x")
+        assert download_http(session, url, save_path, cache=cache, log=_quiet)
+    assert _read(save_path) == _read(os.path.join(served_root, CNES_FILE))
+
+
+def test_cnes_download_after_remote_change(http_server, served_root, workdir):
+    save_path = str(workdir / "alterado.zip")
+    remote = os.path.join(served_root, "alterado.zip")
+    write_synthetic_file(remote, MB)
+    cache = HTTPMetadataCache(str(workdir / "cache.json"))
+    url = http_server.url("alterado.zip")
+    with create_session() as session:
+        assert download_http(session, url, save_path, cache=cache, log=_quiet)
+        write_synthetic_file(remote, MB + 10)
+        os.utime(remote, (time.time() + 60, time.time() + 60))
+        assert download_http(session, url, save_path, cache=cache, log=_quiet)
+    assert _read(save_path) == _read(remote)
+
+
+def test_segmented_download_hash(pool, served_root, workdir):
+    directory = os.path.join(served_root, "segmentos")
+    os.makedirs(directory, exist_ok=True)
+    write_synthetic_file(os.path.join(directory, "hash.exe"), 6 * MB)
+    save_path = str(workdir / "hash.exe")
+    hasher = StreamingHasher(buffer_limit=MB)
+
+    download_ftp_resumable(pool, "/segmentos/", "hash.exe", save_path, segments=3, min_segment_size=MB,
+                           hasher=hasher, log=_quiet)
+
+    assert hasher.position == 6 * MB
+    assert hasher.hexdigest(save_path) == hashlib.sha256(_read(save_path)).hexdigest()
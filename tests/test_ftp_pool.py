@@ -0,0 +1,39 @@
+"""Pool de conexões FTP: reutilização da sessão e do diretório atual, conexões retiradas."""
+from ftplib import error_perm
+
+import pytest
+
+from ftp_pool import FTPPool
+
+
+def test_connection_reused_without_repeated_cwd(ftp_server):
+    pool = FTPPool("127.0.0.1", ftp_server.port, max_connections=2)
+    ftp_server.commands.clear()
+    for _ in range(3):
+        with pool.connection("/siasus/BPA/") as ftp:
+            ftp.voidcmd("NOOP")
+    pool.close_all()
+    assert pool.handshakes == 1
+    assert ftp_server.commands.count("CWD") == 1
+
+
+def test_retired_connection_is_closed(ftp_server):
+    pool = FTPPool("127.0.0.1", ftp_server.port, max_connections=2)
+    with pool.connection("/siasus/BPA/") as ftp:
+        pool.retire(ftp)
+    with pool.connection("/siasus/BPA/") as other:
+        assert other is not ftp
+    pool.close_all()
+    assert pool.handshakes == 2
+    assert not pool._retired and not pool._cwd
+
+
+def test_failed_connection_is_discarded(ftp_server):
+    pool = FTPPool("127.0.0.1", ftp_server.port, max_connections=1)
+    with pytest.raises(error_perm):
+        with pool.connection("/inexistente/"):
+            pass
+    with pool.connection("/siasus/BPA/") as ftp:
+        ftp.voidcmd("NOOP")
+    pool.close_all()
+    assert pool.handshakes == 2
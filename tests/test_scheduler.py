@@ -0,0 +1,105 @@
+"""Fila de downloads: prioridades, concorrência e limite de banda por token bucket."""
+import threading
+import time
+
+import pytest
+
+from scheduler import (DownloadScheduler, JOB_CANCELLED, PRIORITY_ARCHIVE, PRIORITY_INSTALLER, PRIORITY_TABLE,
+                       TokenBucket, TransferCancelled, download_priority)
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(1024 * 1024)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.consume(256 * 1024)
+    elapsed = time.monotonic() - started
+    assert 0.9 < elapsed < 2  # 1,25 MB a 1 MB/s, com o primeiro bloco pago depois
+
+
+def test_token_bucket_unlimited_and_cancel():
+    bucket = TokenBucket(0)
+    started = time.monotonic()
+    bucket.consume(100 * 1024 * 1024)
+    assert time.monotonic() - started < 0.1
+
+    bucket.set_rate(1024)
+    bucket.consume(1024 * 1024)  # Dívida de mil segundos
+    cancelled = threading.Event()
+    threading.Timer(0.3, cancelled.set).start()
+    with pytest.raises(TransferCancelled):
+        bucket.consume(1024, cancelled)
+
+
+def test_download_priority():
+    assert download_priority("instsia0124.exe") == PRIORITY_INSTALLER
+    assert download_priority("BDSIA202404a.exe") == PRIORITY_TABLE
+    assert download_priority("SCNES4700-COMPLETA.ZIP") == PRIORITY_ARCHIVE
+
+
+def test_scheduler_runs_by_priority():
+    scheduler = DownloadScheduler(max_workers=1)
+    release = threading.Event()
+    order = []
+
+    def task(name, wait=False):
+        def run(limiter):
+            if wait:
+                release.wait(5)
+            order.append(name)
+            return name
+        return run
+
+    first = scheduler.submit("primeiro", task("primeiro", wait=True), PRIORITY_ARCHIVE)
+    time.sleep(0.1)
+    scheduler.submit("cnes", task("cnes"), PRIORITY_ARCHIVE)
+    scheduler.submit("bdsia", task("bdsia"), PRIORITY_TABLE)
+    scheduler.submit("instalador", task("instalador"), PRIORITY_INSTALLER)
+    cnes = scheduler.submit("cnes", task("repetido"))  # Mesmo nome: o download já enfileirado é reaproveitado
+    release.set()
+
+    assert first.future.result(5) == "primeiro"
+    assert cnes.future.result(5) == "cnes"
+    scheduler.shutdown()
+    assert order == ["primeiro", "instalador", "bdsia", "cnes"]
+
+
+def test_scheduler_concurrency_and_cancel():
+    scheduler = DownloadScheduler(max_workers=2)
+    running, peak, lock = [0], [0], threading.Lock()
+    release = threading.Event()
+
+    def task(limiter):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        release.wait(5)
+        with lock:
+            running[0] -= 1
+
+    jobs = [scheduler.submit(f"download{i}", task) for i in range(4)]
+    time.sleep(0.2)
+    assert peak[0] == 2
+    assert scheduler.cancel(jobs[3].id)
+    assert jobs[3].status == JOB_CANCELLED
+    release.set()
+    for job in jobs[:3]:
+        job.future.result(5)
+    scheduler.shutdown()
+    assert peak[0] == 2
+    assert jobs[3].future.cancelled()
+
+
+def test_scheduler_rate_limit_and_cancel_running():
+    scheduler = DownloadScheduler(max_workers=1, per_transfer_limit=512 * 1024)
+
+    def task(limiter):
+        for _ in range(100):
+            limiter(256 * 1024)
+
+    job = scheduler.submit("lento", task)
+    time.sleep(0.5)
+    scheduler.cancel(job.id)
+    with pytest.raises(TransferCancelled):
+        job.future.result(2)
+    scheduler.shutdown()
@@ -0,0 +1,62 @@
+"""Atualização por diretório: a versão local só é gravada depois de o download ser verificado."""
+import os
+
+import pytest
+
+from core import Engine, FTP_PATH_BPA
+from orchestrator import OUTCOME_ERROR, OUTCOME_OK
+
+BPA_FILE = "bpamag0410.exe"
+
+
+def _quiet(message, level="info"):
+    pass
+
+
+@pytest.fixture
+def engine(ftp_server, workdir):
+    engine = Engine(log=_quiet, ftp_server="127.0.0.1", ftp_port=ftp_server.port, backup_before_install=False)
+    yield engine
+    engine.close()
+
+
+def _item(served_root, workdir):
+    os.makedirs(workdir / "BPA", exist_ok=True)
+    return {"product": "bpa", "ftp_path": FTP_PATH_BPA, "dest_dir": str(workdir / "BPA"), "file": BPA_FILE,
+            "size": os.path.getsize(os.path.join(served_root, FTP_PATH_BPA.strip("/"), BPA_FILE)),
+            "version_file": str(workdir / "versao.txt"), "version": "0410"}
+
+
+def test_update_records_verified_version(engine, served_root, workdir):
+    item = _item(served_root, workdir)
+    outcome, = engine.update_directory([item])
+    assert outcome["status"] == OUTCOME_OK
+    assert (workdir / "versao.txt").read_text().strip() == "0410"
+
+
+def test_update_without_recorded_hash_keeps_version(engine, served_root, workdir, monkeypatch):
+    def full_repository(*args, **kwargs):
+        raise OSError("disco cheio")
+
+    monkeypatch.setattr(engine.artifacts, "add", full_repository)
+    item = _item(served_root, workdir)
+    outcome, = engine.update_directory([item])
+    assert outcome["status"] == OUTCOME_ERROR
+    assert "inconclusiva" in outcome["error"]
+    assert not (workdir / "versao.txt").exists()
+
+
+def test_update_rejects_changed_file(engine, served_root, workdir, monkeypatch):
+    download_ftp = engine.download_ftp
+
+    def corrupting_download(*args, **kwargs):
+        save_path = download_ftp(*args, **kwargs)
+        with open(save_path, 'r+b') as f:
+            f.write(b"corrompido")
+        return save_path
+
+    monkeypatch.setattr(engine, "download_ftp", corrupting_download)
+    outcome, = engine.update_directory([_item(served_root, workdir)])
+    assert outcome["status"] == OUTCOME_ERROR
+    assert "SHA-256" in outcome["error"]
+    assert not (workdir / "versao.txt").exists()
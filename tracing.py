@@ -0,0 +1,179 @@
+"""Rastreamento opcional da execução em spans, exportado no formato de trace do Chrome.
+
+Com o rastreamento ligado (start_tracing), cada span(...) registra nome, categoria, thread, início,
+duração e atributos; o arquivo gerado abre em chrome://tracing ou em https://ui.perfetto.dev e mostra
+o que rodou em paralelo em cada thread. Desligado, span() não registra nada e custa só uma checagem.
+
+Opcionalmente, uma thread de amostragem registra a cada SAMPLE_INTERVAL segundos a pilha de todas
+as threads (arquivo .folded, para flamegraph.pl ou https://speedscope.app) e, com tracemalloc, a
+memória alocada pelo Python, como um contador no próprio trace e as maiores alocações ao final.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+
+TRACE_MAX_EVENTS = 200_000  # Spans mantidos em memória; os mais antigos são descartados
+SAMPLE_INTERVAL = 0.01  # Segundos entre amostras das pilhas
+MEMORY_SAMPLE_EVERY = 50  # Amostras de pilha entre duas leituras da memória alocada
+TOP_ALLOCATIONS = 25  # Linhas de código com mais memória alocada incluídas no trace
+FOLDED_SUFFIX = ".folded"
+
+_tracer = None  # Rastreador ativo, ou None com o rastreamento desligado
+
+
+def tracing_enabled():
+    return _tracer is not None
+
+
+@contextmanager
+def span(name, category="app", **args):
+    """Registra a duração do bloco como um span da thread atual; uma exceção vira o atributo "erro"."""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    except BaseException as e:
+        args["erro"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        tracer.record(name, category, start, time.perf_counter_ns() - start, args)
+
+
+def traced(function, category="thread", name=None):
+    """Envolve function para que cada execução seja um span (ex.: o alvo de uma thread)."""
+    name = name or getattr(function, "__qualname__", repr(function))
+
+    @wraps(function)
+    def run(*args, **kwargs):
+        with span(name, category):
+            return function(*args, **kwargs)
+    return run
+
+
+def record(name, category, start_ns, duration_ns, **args):
+    """Registra um span já medido (início e duração em time.perf_counter_ns)."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.record(name, category, start_ns, duration_ns, args)
+
+
+class Tracer:
+    """Acumula os spans e, se pedido, as amostras de pilha e de memória; save() grava o trace."""
+    def __init__(self, path, sample=False, memory=False, max_events=TRACE_MAX_EVENTS):
+        self.path = path
+        self.sample = sample
+        self.memory = memory
+        self.origin = time.perf_counter_ns()
+        self.events = deque(maxlen=max_events)  # append é seguro entre threads
+        self.stacks = Counter()  # "thread;função;função..." -> número de amostras
+        self._threads = {}  # Identificador da thread -> nome
+        self._pid = os.getpid()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def _tid(self):
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        return tid
+
+    def record(self, name, category, start_ns, duration_ns, args):
+        self.events.append({"name": name, "cat": category, "ph": "X", "pid": self._pid, "tid": self._tid(),
+                            "ts": (start_ns - self.origin) / 1000, "dur": duration_ns / 1000,
+                            "args": {key: value if isinstance(value, (int, float, bool)) or value is None else str(value)
+                                     for key, value in args.items()}})
+
+    def start(self):
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.sample or self.memory:
+            self._sampler = threading.Thread(target=self._sample_loop, name="rastreamento-amostras", daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        count = 0
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            count += 1
+            if self.sample:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for tid, frame in sys._current_frames().items():
+                    if tid == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    self.stacks[";".join([names.get(tid, str(tid))] + stack[::-1])] += 1
+            if self.memory and count % MEMORY_SAMPLE_EVERY == 0:
+                self._sample_memory()
+
+    def _sample_memory(self):
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        self.events.append({"name": "memoria", "ph": "C", "pid": self._pid, "tid": 0,
+                            "ts": (time.perf_counter_ns() - self.origin) / 1000,
+                            "args": {"atual_kb": current // 1024, "pico_kb": peak // 1024}})
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def save(self):
+        """Grava o trace em path (e as pilhas em path + .folded); retorna os caminhos gravados."""
+        events = list(self.events)
+        events += [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                   for tid, name in list(self._threads.items())]
+        trace = {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"pid": self._pid}}
+        if self.memory:
+            import tracemalloc
+
+            self._sample_memory()
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ALLOCATIONS]
+            trace["otherData"]["maiores_alocacoes"] = [f"{stat.traceback}: {stat.size // 1024} KB em {stat.count} blocos"
+                                                       for stat in statistics]
+            tracemalloc.stop()
+        written = [self.path]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        if self.stacks:
+            folded_path = os.path.splitext(self.path)[0] + FOLDED_SUFFIX
+            with open(folded_path, 'w', encoding='utf-8') as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            written.append(folded_path)
+        return written
+
+
+def start_tracing(path, sample=False, memory=False):
+    """Liga o rastreamento; o trace é gravado em path por stop_tracing()."""
+    global _tracer
+    if _tracer is None:
+        tracer = Tracer(path, sample, memory)
+        tracer.start()
+        _tracer = tracer
+    return _tracer
+
+
+def stop_tracing():
+    """Desliga o rastreamento e grava o trace; retorna os caminhos gravados (vazio se ele não estava ligado)."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return []
+    tracer.stop()
+    return tracer.save()